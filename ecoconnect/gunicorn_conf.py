@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration for production.
+
+    gunicorn -c python:ecoconnect.gunicorn_conf ecoconnect.wsgi
+
+The app is preloaded and warmed up in the master so templates are compiled once
+and shared copy-on-write by every worker. Every setting can be overridden with
+the matching GUNICORN_* environment variable.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Views mostly wait on the database and SMTP, so a few threads per worker help.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers to cap slow leaks; jitter stops them all restarting at once.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 200))
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def when_ready(server):
+    """Warm the preloaded app in the master before any worker is forked."""
+    from django.db import connections
+    from services.warmup import warm_up
+
+    timings = warm_up()
+    # Workers must never inherit the master's database sockets.
+    connections.close_all()
+    server.log.info(f"Warmup finished: {timings}")
+
+
+def post_fork(server, worker):
+    """Drop any connection handle inherited from the master without closing it.
+
+    Closing would send a terminate message over the socket the master still owns.
+    Each gthread request thread opens its own connection on first use and keeps it
+    for CONN_MAX_AGE seconds, so there is nothing useful to pre-open per worker.
+    """
+    from django.db import connections
+
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None
+
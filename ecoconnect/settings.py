@@ -21,7 +21,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "services.profiling.SamplingProfilerMiddleware",
+    "services.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "services.httpcache.ThresholdGZipMiddleware",
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -30,6 +34,24 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Sampling request profiler (see services/profiling.py and `manage.py profile_report`).
+# Disabled by default; when off the middleware removes itself from the chain.
+# Sending "X-Profile: <PROFILING_SECRET>" forces a sample; without a secret the header is ignored.
+PROFILING = {
+    "ENABLED": config('PROFILING_ENABLED', default=False, cast=bool),
+    "SAMPLE_RATE": config('PROFILING_SAMPLE_RATE', default=0.01, cast=float),
+    "HEADER": "X-Profile",
+    "SECRET": config('PROFILING_SECRET', default=''),
+    "PATHS": config('PROFILING_PATHS', default='', cast=Csv()),
+    "DIR": BASE_DIR / "logs" / "profiles",
+    "MAX_SAMPLES": config('PROFILING_MAX_SAMPLES', default=200, cast=int),
+}
+
+# Metrics (/metrics/). Set METRICS_MULTIPROC_DIR to a directory shared by all
+# gunicorn workers so the endpoint reports totals across processes.
+METRICS_MULTIPROC_DIR = config('METRICS_MULTIPROC_DIR', default='') or None
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
 ROOT_URLCONF = "ecoconnect.urls"
 
 TEMPLATES = [
@@ -54,9 +76,71 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections open between requests instead of reconnecting each time.
+        "CONN_MAX_AGE": config('DB_CONN_MAX_AGE', default=60, cast=int),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Optional region sharding of provider schedules (see services/sharding.py).
+# DB_SHARDS lists the shard aliases; SHARD_REGIONS pins regions (the location up
+# to the first comma) to shards as "region=alias" pairs, others are hashed.
+# Run "migrate --database <alias>" for every shard.
+DB_SHARDS = config('DB_SHARDS', default='', cast=Csv())
+SHARD_REGIONS = {
+    region.strip().lower(): alias.strip()
+    for region, _, alias in (pair.partition("=") for pair in config('SHARD_REGIONS', default='', cast=Csv()))
+    if alias.strip()
+}
+for _alias in DB_SHARDS:
+    DATABASES.setdefault(_alias, {**DATABASES["default"], "NAME": BASE_DIR / f"db_{_alias}.sqlite3"})
+DATABASE_ROUTERS = ["services.sharding.RegionRouter"]
+
+# Cache (per-process locmem by default; point at Redis/Memcached in production so
+# read-through locks and invalidations are shared by every worker)
+CACHES = {
+    "default": {
+        "BACKEND": config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": config('CACHE_LOCATION', default='ecoconnect'),
+    }
+}
+
+# Admission control for expensive POSTs (token buckets: "<count>/<s|m|h|d>")
+RATELIMIT_ENABLED = config('RATELIMIT_ENABLED', default=True, cast=bool)
+RATE_LIMITS = {
+    "book": {"user": "10/m", "ip": "30/m", "global": "600/m"},
+    "register": {"ip": "10/m", "global": "120/m"},
+    "create_provider": {"user": "5/m", "ip": "20/m", "global": "120/m"},
+}
+# Concurrent booking transactions allowed per worker process before shedding with 503
+BOOKING_MAX_IN_FLIGHT = config('BOOKING_MAX_IN_FLIGHT', default=4, cast=int)
+
+# Live availability (server-sent events). The cache broker reaches every worker sharing the cache;
+# under WSGI the stream sends one snapshot and the browser reconnects every LIVE_POLL_SECONDS.
+LIVE_BROKER = config('LIVE_BROKER', default='services.live.CacheBroker')
+LIVE_STREAM_MAX_SECONDS = config('LIVE_STREAM_MAX_SECONDS', default=300, cast=int)
+LIVE_HEARTBEAT_SECONDS = config('LIVE_HEARTBEAT_SECONDS', default=15, cast=int)
+LIVE_POLL_SECONDS = config('LIVE_POLL_SECONDS', default=10, cast=int)
+
+# Booking change feed (/events/ and `manage.py booking_events`): events older than the
+# retention window are deleted by `manage.py expire_booking_events`.
+BOOKING_EVENTS_RETENTION_DAYS = config('BOOKING_EVENTS_RETENTION_DAYS', default=90, cast=int)
+BOOKING_EVENTS_ALLOWED_IPS = config('BOOKING_EVENTS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
+# HTTP caching: responses smaller than this many bytes are sent uncompressed,
+# and anonymous directory pages may be reused by shared caches for this long (seconds)
+GZIP_MIN_LENGTH = config('GZIP_MIN_LENGTH', default=1024, cast=int)
+PROVIDER_LIST_MAX_AGE = config('PROVIDER_LIST_MAX_AGE', default=30, cast=int)
+
+# Memory-mapped provider directory snapshot shared by all workers (empty disables it).
+# Rebuild with "manage.py build_directory_snapshot"; a stale file is ignored until then.
+DIRECTORY_SNAPSHOT_PATH = config('DIRECTORY_SNAPSHOT_PATH', default='')
+
+# Idempotency-Key replays for booking/cancellation POSTs: how long outcomes are kept (seconds),
+# and after how long an unfinished first attempt is presumed dead
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=86400, cast=int)
+IDEMPOTENCY_LOCK_TIMEOUT = config('IDEMPOTENCY_LOCK_TIMEOUT', default=60, cast=int)
+
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
     {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator"},
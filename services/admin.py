@@ -1,20 +1,193 @@
+from django import forms
 from django.contrib import admin
-from .models import ServiceProvider, Booking, ProviderAvailability
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+from . import search
+from .models import ServiceProvider, Booking, ProviderAvailability, OutboundEmail, ReminderDispatch, WaitlistEntry
+from .scheduling import free_crew, span_days
+from .sharding import shard_for
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses a cheap row estimate for unfiltered changelists on big tables.
+
+    An exact ``COUNT(*)`` over tens of millions of rows dominates the changelist
+    render time. When no filter is active we ask the database for an estimate
+    (``pg_class.reltuples`` on PostgreSQL, the highest primary key elsewhere)
+    and only fall back to an exact count below ``exact_count_threshold`` rows.
+    """
+
+    exact_count_threshold = 100_000
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if not qs.query.where:
+            estimate = self._estimate_rows(qs)
+            if estimate is not None and estimate > self.exact_count_threshold:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def _estimate_rows(qs):
+        connection = connections[qs.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [qs.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 until the table has been analyzed.
+            return row[0] if row and row[0] >= 0 else None
+        return qs.model._default_manager.using(qs.db).aggregate(top=Max("pk"))["top"]
+
+
+class LocationPrefixFilter(admin.SimpleListFilter):
+    """Free-text location filter; avoids the DISTINCT scan the default field filter runs."""
+
+    title = "location"
+    parameter_name = "location"
+    template = "admin/services/input_filter.html"
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(location__istartswith=self.value())
+        return queryset
+
+    def choices(self, changelist):
+        params = changelist.get_filters_params()
+        params.pop(self.parameter_name, None)
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "display": "All",
+            "params": params,
+        }
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the second "N total" COUNT(*) Django runs for filtered changelists.
+    show_full_result_count = False
+
+
+class DefaultScheduleAdmin(LargeTableAdmin):
+    """Schedule rows kept in ``default``; the admin can't join shard rows to users and providers.
+
+    Without this the sharding router would refuse the unhinted changelist query.
+    """
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(DEFAULT_DB_ALIAS)
+
 
 @admin.register(ServiceProvider)
-class ServiceProviderAdmin(admin.ModelAdmin):
+class ServiceProviderAdmin(LargeTableAdmin):
     list_display = ['name', 'service_type', 'location', 'user']
-    list_filter = ['service_type', 'location']
+    list_filter = ['service_type', LocationPrefixFilter]
+    list_select_related = ['user']
     search_fields = ['name', 'location']
+    raw_id_fields = ['user']
+    date_hierarchy = 'created_at'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of LIKE scans (also serves provider autocompletes).
+        if not search_term or not search.is_supported():
+            return super().get_search_results(request, queryset, search_term)
+        ids = [pk for pk, _ in search.search_providers(search_term)]
+        matches = Q(pk__in=ids) | Q(location__istartswith=search_term)
+        return queryset.filter(matches), False
+
+class BookingAdminForm(forms.ModelForm):
+    """Checks a new or moved interval for capacity and a free crew, like ``BookingForm``.
+
+    ``Booking.save()`` enforces both too, but as an ``IntegrityError``; here a
+    full interval comes back as a form error instead.
+    """
+
+    class Meta:
+        model = Booking
+        fields = "__all__"
+
+    def clean(self):
+        cleaned_data = super().clean()
+        provider, starts_at, ends_at = (cleaned_data.get(f) for f in ("provider", "starts_at", "ends_at"))
+        if not provider or not starts_at or not ends_at or ends_at <= starts_at:
+            return cleaned_data
+        # The instance still holds the stored values until the form is saved.
+        held = []
+        if self.instance.pk is not None:
+            if (self.instance.provider_id, self.instance.starts_at, self.instance.ends_at) == (
+                provider.pk, starts_at, ends_at
+            ):
+                return cleaned_data
+            if self.instance.provider_id == provider.pk:
+                # Moving within the provider gives the booking's own days back first.
+                held = span_days(self.instance.starts_at, self.instance.ends_at)
+        days = span_days(starts_at, ends_at)
+        slots = list(
+            ProviderAvailability.objects.using(shard_for(provider)).filter(provider=provider, date__in=days)
+            .values_list("date", "remaining", "crews")
+        )
+        if len(slots) != len(days):
+            return cleaned_data  # Booking.clean() names the days without availability.
+        crews = min(row[2] for row in slots)
+        if not all(remaining or day in held for day, remaining, _ in slots) or free_crew(
+            provider.pk, starts_at, ends_at, crews, exclude_pk=self.instance.pk
+        ) is None:
+            raise ValidationError("The provider is fully booked at that time.", code="booked")
+        return cleaned_data
+
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
-    list_display = ['customer', 'provider', 'booking_date']
+class BookingAdmin(DefaultScheduleAdmin):
+    form = BookingAdminForm
+    # Derived from the interval on save; the crew is picked from the free ones.
+    readonly_fields = ['booking_date', 'end_date', 'crew']
+    list_display = ['customer', 'provider', 'booking_date', 'starts_at', 'ends_at']
     list_filter = ['booking_date', 'provider__service_type']
+    list_select_related = ['customer', 'provider']
     search_fields = ['customer__username', 'provider__name']
+    autocomplete_fields = ['provider']
+    raw_id_fields = ['customer']
+    date_hierarchy = 'booking_date'
 
 @admin.register(ProviderAvailability)
-class ProviderAvailabilityAdmin(admin.ModelAdmin):
-    list_display = ['provider', 'date']
+class ProviderAvailabilityAdmin(DefaultScheduleAdmin):
+    list_display = ['provider', 'date', 'start_time', 'end_time', 'capacity', 'crews', 'remaining']
     list_filter = ['date', 'provider__service_type']
+    list_select_related = ['provider']
     search_fields = ['provider__name']
+    autocomplete_fields = ['provider']
+    date_hierarchy = 'date'
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(DefaultScheduleAdmin):
+    list_display = ['provider', 'date', 'customer', 'created_at']
+    list_select_related = ['customer', 'provider']
+    autocomplete_fields = ['provider']
+    raw_id_fields = ['customer']
+    date_hierarchy = 'date'
+
+@admin.register(ReminderDispatch)
+class ReminderDispatchAdmin(LargeTableAdmin):
+    list_display = ['key', 'recipient', 'claimed_at', 'sent_at']
+    search_fields = ['=recipient']
+    date_hierarchy = 'claimed_at'
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(DefaultScheduleAdmin):
+    list_display = ['kind', 'subject', 'created_at', 'attempts', 'sent_at']
+    list_filter = ['kind']
+    date_hierarchy = 'created_at'
@@ -0,0 +1,139 @@
+"""Demand rollups: bookings and capacity per day, service type and location.
+
+Schedule writes only append a ``RollupDirtyDay`` mark (see ``signals``), on
+the schedule database and in the same transaction as the write.
+``update_dirty_days`` is the incremental job. It takes a batch of marks,
+recomputes those days from the live tables, and deletes exactly the marks it
+read, so marks written while it runs are kept for the next pass.
+``recompute_days`` is also what the backfill command uses, a chunk of days at
+a time. Reports aggregate ``DemandRollup`` and never touch ``Booking``.
+
+The live tables are aggregated per provider on every schedule database (see
+``services.sharding``), then folded into service type and location with the
+providers from ``default``. Rows are grouped by the provider's current
+service type and location, so changing either marks all of that provider's
+days dirty and its history moves with it.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncWeek
+
+from .models import Booking, DemandRollup, ProviderAvailability, RollupDirtyDay, ServiceProvider
+from .sharding import fan_out, schedule_databases, shard_for
+
+logger = logging.getLogger(__name__)
+
+
+def mark_dirty(days, using):
+    RollupDirtyDay.objects.using(using).bulk_create([RollupDirtyDay(day=day) for day in set(days)])
+
+
+def mark_provider_dirty(provider):
+    """Mark every day with availability or bookings of ``provider`` dirty, e.g. after it changed group."""
+    alias = shard_for(provider)
+    days = set(ProviderAvailability.objects.using(alias).filter(provider_id=provider.pk).values_list("date", flat=True))
+    days.update(Booking.objects.using(alias).filter(provider_id=provider.pk).values_list("booking_date", flat=True))
+    mark_dirty(days, using=alias)
+    return len(days)
+
+
+def recompute_days(days):
+    """Rebuild every rollup row for ``days`` from bookings and availability; return rows written."""
+    days = sorted(set(days))
+    if not days:
+        return 0
+
+    def per_provider(alias):
+        offered = list(
+            ProviderAvailability.objects.using(alias).filter(date__in=days)
+            .values_list("date", "provider_id")
+            .annotate(offered=Sum("capacity"), filled=Sum(F("capacity") - F("remaining")))
+            .order_by()
+        )
+        started = list(
+            Booking.objects.using(alias).filter(booking_date__in=days)
+            .values_list("booking_date", "provider_id")
+            .annotate(n=Count("pk"))
+            .order_by()
+        )
+        return offered, started
+
+    results = fan_out(per_provider)
+    provider_ids = {r[1] for offered, started in results for r in offered + started}
+    groups = {
+        pk: (service_type, location)
+        for pk, service_type, location in ServiceProvider.objects.filter(pk__in=provider_ids).values_list(
+            "pk", "service_type", "location"
+        )
+    }
+
+    rows = {}
+
+    def rollup(day, provider_id):
+        if provider_id not in groups:
+            return None
+        service_type, location = groups[provider_id]
+        key = (day, service_type, location)
+        return rows.setdefault(key, DemandRollup(day=day, service_type=service_type, location=location))
+
+    for offered, started in results:
+        for day, provider_id, capacity, filled in offered:
+            row = rollup(day, provider_id)
+            if row:
+                row.offered += capacity
+                row.filled += filled
+        for day, provider_id, n in started:
+            row = rollup(day, provider_id)
+            if row:
+                row.bookings += n
+
+    with transaction.atomic():
+        DemandRollup.objects.filter(day__in=days).delete()
+        DemandRollup.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def update_dirty_days(batch_size=1000):
+    """Process up to ``batch_size`` dirty marks per schedule database; return ``(marks consumed, days recomputed)``."""
+    aliases = schedule_databases()
+    marks = fan_out(
+        lambda alias: list(RollupDirtyDay.objects.using(alias).order_by("pk").values_list("pk", "day")[:batch_size]),
+        aliases,
+    )
+    days = {day for rows in marks for _, day in rows}
+    if not days:
+        return 0, 0
+    recompute_days(days)
+    for alias, rows in zip(aliases, marks):
+        RollupDirtyDay.objects.using(alias).filter(pk__in=[pk for pk, _ in rows]).delete()
+    return sum(len(rows) for rows in marks), len(days)
+
+
+def day_chunks(start, end, size):
+    """Split ``start``..``end`` (inclusive) into lists of at most ``size`` consecutive days."""
+    day = start
+    while day <= end:
+        chunk_end = min(end, day + timedelta(days=size - 1))
+        yield [day + timedelta(days=i) for i in range((chunk_end - day).days + 1)]
+        day = chunk_end + timedelta(days=1)
+
+
+def weekly_report(start, end, service_type=None, location=None):
+    """Weekly totals per service type and location, read from the rollups only."""
+    qs = DemandRollup.objects.filter(day__gte=start, day__lte=end)
+    if service_type:
+        qs = qs.filter(service_type=service_type)
+    if location:
+        qs = qs.filter(location__istartswith=location)
+    rows = (
+        qs.annotate(week=TruncWeek("day"))
+        .values("week", "service_type", "location")
+        .annotate(bookings=Sum("bookings"), offered=Sum("offered"), filled=Sum("filled"))
+        .order_by("-week", "service_type", "location")
+    )
+    for row in rows:
+        row["fill_rate"] = row["filled"] / row["offered"] if row["offered"] else None
+        yield row
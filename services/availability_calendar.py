@@ -0,0 +1,150 @@
+"""Month-grid view of a provider's schedule, and batched opening/closing of days.
+
+``month_grid`` reads a window of one or more months with two range queries,
+one for availability and one for the bookings touching the window, and
+merges them into calendar weeks in memory. The query count does not depend
+on how many days are shown.
+
+``open_days`` and ``clear_days`` apply a provider's selection from the grid
+in one transaction with set-based writes. They use the same deferred
+summary/event upkeep as closures. ``clear_days`` never removes a booked day;
+cancelling bookings goes through ``closures.close_dates``, which tells the
+customers.
+
+Everything runs against the provider's schedule database (see
+``services.sharding``); customer names are looked up by id.
+"""
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import mark_dirty
+from .events import event_for
+from .models import Booking, ProviderAvailability, WaitlistEntry
+from .scheduling import default_capacity
+from .sharding import shard_for, use_shard
+from .signals import deferred_schedule_updates, record_events
+
+logger = logging.getLogger(__name__)
+
+
+def add_months(day, months):
+    """The first day of the month ``months`` after ``day``'s month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def window_slots(provider, start, end):
+    """The provider's availability from ``start`` to ``end``, inclusive."""
+    return ProviderAvailability.objects.using(shard_for(provider)).filter(provider=provider).between(start, end)
+
+
+def window_bookings(provider, start, end):
+    """``(booking_date, end_date, customer_id)`` of the bookings touching ``start``..``end``, by start."""
+    return (
+        Booking.objects.using(shard_for(provider)).filter(provider=provider, booking_date__lte=end, end_date__gte=start)
+        .order_by("starts_at")
+        .values_list("booking_date", "end_date", "customer_id")
+    )
+
+
+def month_grid(provider, first_month, months=1):
+    """Weeks of day cells for ``months`` calendar months starting with ``first_month``'s month.
+
+    Returns ``[{"month": date, "weeks": [[cell, ...], ...]}, ...]``. Each cell
+    is a dict with ``date``, ``in_month``, ``past``, ``slot`` (the
+    ``ProviderAvailability`` or ``None``) and ``bookings`` (customer names
+    of the bookings touching the day).
+    """
+    shown = [add_months(first_month, i) for i in range(months)]
+    grid = [(month, calendar.Calendar().monthdatescalendar(month.year, month.month)) for month in shown]
+    # Whole weeks are shown, so the window includes the padding days around the months.
+    start, end = grid[0][1][0][0], grid[-1][1][-1][-1]
+
+    slots = {a.date: a for a in window_slots(provider, start, end)}
+    booked = defaultdict(list)
+    rows = list(window_bookings(provider, start, end))
+    usernames = dict(User.objects.filter(pk__in={r[2] for r in rows}).values_list("pk", "username")) if rows else {}
+    for first, last, customer_id in rows:
+        day = max(first, start)
+        while day <= min(last, end):
+            booked[day].append(usernames.get(customer_id, ""))
+            day += timedelta(days=1)
+
+    today = timezone.now().date()
+    return [
+        {
+            "month": month,
+            "weeks": [
+                [
+                    {
+                        "date": day,
+                        "in_month": day.month == month.month,
+                        "past": day < today,
+                        "slot": slots.get(day),
+                        "bookings": booked.get(day, []),
+                    }
+                    for day in week
+                ]
+                for week in weeks
+            ],
+        }
+        for month, weeks in grid
+    ]
+
+
+def open_days(provider, days, capacity=None, crews=1):
+    """Add availability on each of ``days`` that has none yet; return the days added.
+
+    ``capacity`` defaults to one booking per crew, as for a blank availability form.
+    """
+    capacity = capacity or default_capacity(crews)
+    alias = shard_for(provider)
+    with transaction.atomic(using=alias), use_shard(alias):
+        existing = set(
+            ProviderAvailability.objects.using(alias).filter(provider=provider, date__in=days).values_list("date", flat=True)
+        )
+        new = [
+            ProviderAvailability(provider=provider, date=day, capacity=capacity, crews=crews, remaining=capacity)
+            for day in days
+            if day not in existing
+        ]
+        with deferred_schedule_updates([provider.pk]):
+            ProviderAvailability.objects.using(alias).bulk_create(new, batch_size=500)
+            record_events([event_for(slot, created=True) for slot in new])
+            mark_dirty((slot.date for slot in new), using=alias)
+    logger.info(f"Provider {provider.pk} opened {len(new)} day(s)")
+    return [slot.date for slot in new]
+
+
+def clear_days(provider, days):
+    """Remove availability on each of ``days`` that has no bookings; return ``(removed, kept)`` days."""
+    alias = shard_for(provider)
+    with transaction.atomic(using=alias), use_shard(alias):
+        # Locked so a booking can't claim one of these days between the check and the delete.
+        slots = list(
+            ProviderAvailability.objects.using(alias).select_for_update()
+            .filter(provider=provider, date__in=days)
+            .order_by("date")
+        )
+        dates = {slot.date for slot in slots}
+        busy = set()
+        if dates:
+            spans = Booking.objects.using(alias).filter(
+                provider=provider, booking_date__lte=max(dates), end_date__gte=min(dates)
+            ).values_list("booking_date", "end_date")
+            for first, last in spans:
+                busy.update(first + timedelta(days=i) for i in range((last - first).days + 1))
+        free = [slot for slot in slots if slot.date not in busy]
+        removed = [slot.date for slot in free]
+        with deferred_schedule_updates([provider.pk]):
+            ProviderAvailability.objects.using(alias).filter(pk__in=[slot.pk for slot in free]).delete()
+            WaitlistEntry.objects.using(alias).filter(provider=provider, date__in=removed).delete()
+            mark_dirty(removed, using=alias)
+    logger.info(f"Provider {provider.pk} cleared {len(removed)} day(s)")
+    return removed, sorted(dates & busy)
@@ -0,0 +1,165 @@
+"""Read-through caching for hot provider data.
+
+``read_through`` wraps an expensive producer with three protections against
+cache stampedes:
+
+* single-flight: only the request holding a per-key lock (``cache.add``)
+  recomputes a missing or expired entry;
+* probabilistic early refresh: entries are occasionally recomputed shortly
+  before they expire, weighted by how long they took to build, so popular keys
+  are usually refreshed by one request before the hard expiry;
+* stale-while-revalidate: while one request recomputes, everyone else keeps
+  getting the previous value instead of piling onto the database.
+
+Entries carry a generation token so that model signals can invalidate every
+key belonging to a provider with a single cache write.
+"""
+import logging
+import math
+import random
+import time
+import uuid
+
+from django.core.cache import cache
+from django.http import Http404
+from django.utils import timezone
+
+from .metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300  # seconds an entry is considered fresh
+STALE_TTL = 60  # extra seconds an expired entry may be served while it is rebuilt
+LOCK_TIMEOUT = 10  # upper bound on how long one rebuild may hold the lock
+LOCK_WAIT = 2.0  # how long a cold miss waits for another worker's rebuild
+POLL_INTERVAL = 0.02
+EARLY_REFRESH_BETA = 1.0  # >1 refreshes earlier, <1 later, 0 disables
+
+
+def _lock_key(key):
+    return f"{key}:lock"
+
+
+def _store(key, producer, ttl, stale_ttl, generation):
+    started = time.monotonic()
+    value = producer()
+    delta = time.monotonic() - started
+    cache.set(key, (value, time.time() + ttl, delta, generation), ttl + stale_ttl)
+    return value
+
+
+def _acquire(key):
+    """A token if this request now holds the rebuild lock of ``key``, else None."""
+    token = uuid.uuid4().hex
+    return token if cache.add(_lock_key(key), token, LOCK_TIMEOUT) else None
+
+
+def _release(key, token):
+    # Check-and-delete: a rebuild that outlived LOCK_TIMEOUT must not drop a lock another worker took since.
+    if cache.get(_lock_key(key)) == token:
+        cache.delete(_lock_key(key))
+
+
+def _rebuild(key, producer, ttl, stale_ttl, generation, token):
+    try:
+        return _store(key, producer, ttl, stale_ttl, generation)
+    finally:
+        _release(key, token)
+
+
+def read_through(key, producer, ttl=DEFAULT_TTL, stale_ttl=STALE_TTL, generation_key=None):
+    """Return the cached value for ``key``, calling ``producer`` at most once per expiry."""
+    keys = [key, generation_key] if generation_key else [key]
+    found = cache.get_many(keys)
+    entry = found.get(key)
+    generation = found.get(generation_key) if generation_key else None
+
+    if entry is not None and entry[3] == generation:
+        value, expires_at, delta, _ = entry
+        # XFetch: -log(U) is exponentially distributed, so slow-to-build entries
+        # get picked for refresh earlier and more often than cheap ones.
+        jitter = -delta * EARLY_REFRESH_BETA * math.log(1.0 - random.random())
+        if time.time() + jitter < expires_at:
+            CACHE_REQUESTS.inc(result="hit")
+            return value
+        token = _acquire(key)
+        if token is None:
+            CACHE_REQUESTS.inc(result="stale")
+            return value
+        CACHE_REQUESTS.inc(result="miss")
+        return _rebuild(key, producer, ttl, stale_ttl, generation, token)
+
+    # Missing or invalidated: there is nothing safe to serve, so wait for whoever is rebuilding.
+    CACHE_REQUESTS.inc(result="miss")
+    token = _acquire(key)
+    if token is not None:
+        # Another request may have finished a rebuild between our read and taking the lock.
+        entry = cache.get(key)
+        if entry is not None and entry[3] == generation:
+            _release(key, token)
+            return entry[0]
+        return _rebuild(key, producer, ttl, stale_ttl, generation, token)
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry[3] == generation:
+            return entry[0]
+    logger.warning(f"Timed out waiting for cache rebuild of {key}; computing directly")
+    return producer()
+
+
+def invalidate(generation_key):
+    """Expire every entry stored under ``generation_key`` without touching them individually."""
+    cache.set(generation_key, uuid.uuid4().hex, None)
+
+
+# ---------- Provider data ----------
+
+def provider_generation_key(provider_id):
+    return f"provider:{provider_id}:generation"
+
+
+def invalidate_provider(provider_id):
+    invalidate(provider_generation_key(provider_id))
+
+
+def get_provider(provider_id):
+    """Cached equivalent of ``get_object_or_404(ServiceProvider, id=provider_id)``."""
+    from .models import ServiceProvider
+
+    try:
+        provider_id = int(provider_id)
+    except (TypeError, ValueError):
+        raise Http404("No ServiceProvider matches the given query.")
+
+    provider = read_through(
+        f"provider:{provider_id}",
+        lambda: ServiceProvider.objects.filter(id=provider_id).first(),
+        generation_key=provider_generation_key(provider_id),
+    )
+    if provider is None:
+        raise Http404("No ServiceProvider matches the given query.")
+    return provider
+
+
+def free_dates_queryset(provider_id, today):
+    from .models import ProviderAvailability
+    from .sharding import shard_for
+
+    return (
+        ProviderAvailability.objects.using(shard_for(provider_id)).open()
+        .filter(provider_id=provider_id, date__gte=today)
+        .order_by("date")
+        .values_list("date", flat=True)
+    )
+
+
+def get_free_dates(provider_id):
+    """Cached list of the provider's future availability dates that are not booked yet."""
+    today = timezone.now().date()
+    return read_through(
+        f"provider:{provider_id}:free-dates:{today.isoformat()}",
+        lambda: list(free_dates_queryset(provider_id, today)),
+        generation_key=provider_generation_key(provider_id),
+    )
@@ -0,0 +1,94 @@
+"""Provider closures: cancel every booking and availability date in a range at once."""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+from django.db import transaction
+
+from .analytics import mark_dirty
+from .events import event_for
+from .models import Booking, ProviderAvailability, WaitlistEntry
+from .notifications import enqueue
+from .sharding import shard_for, use_shard
+from .signals import deferred_schedule_updates, record_events
+
+logger = logging.getLogger(__name__)
+
+
+def _cancellation_emails(provider, rows, reason):
+    by_customer = defaultdict(list)
+    for email, username, booking_date in rows:
+        if email:
+            by_customer[(email, username)].append(booking_date)
+    note = f"\nReason given by the provider: {reason}\n" if reason else ""
+    return [
+        EmailMessage(
+            "EcoConnect: Booking Cancelled",
+            f"Hi {username},\n\n{provider.name} has closed and cancelled your booking(s) on: "
+            f"{', '.join(d.isoformat() for d in sorted(dates))}.\n{note}",
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+        )
+        for (email, username), dates in by_customer.items()
+    ]
+
+
+def close_dates(provider, start, end, reason=""):
+    """Cancel ``provider``'s bookings touching ``start``..``end`` and remove its availability there.
+
+    Everything happens in one transaction. The rows are deleted with single
+    ``DELETE`` statements that bypass the ORM collector, so no row is loaded
+    as an instance and no per-row signal runs. What those receivers would do
+    is done here once instead: change-feed events from the rows read up
+    front, one capacity recount and one summary refresh. Customers get one
+    email each through the outbox, written in the same transaction and sent
+    after commit. Returns counts of cancelled bookings, removed dates and
+    notified customers.
+
+    The transaction is the one on the provider's schedule database; customers
+    are looked up by id, since they may live in another database.
+    """
+    alias = shard_for(provider)
+    bookings = Booking.objects.using(alias).filter(provider=provider, booking_date__lte=end, end_date__gte=start)
+    dates = ProviderAvailability.objects.using(alias).filter(provider=provider, date__gte=start, date__lte=end)
+    waiting = WaitlistEntry.objects.using(alias).filter(provider=provider, date__gte=start, date__lte=end)
+    with transaction.atomic(using=alias), use_shard(alias):
+        # Plain field values: enough for the events and emails, without building model instances per row.
+        rows = list(bookings.values("id", "customer_id", "booking_date", "end_date", "starts_at", "ends_at", "crew"))
+        slots = list(dates.values("date", "capacity", "crews", "start_time", "end_time"))
+        customers = User.objects.in_bulk({r["customer_id"] for r in rows})
+        with deferred_schedule_updates([provider.pk]):
+            # Nothing references these rows, so no cascade is skipped.
+            cancelled = bookings._raw_delete(alias)
+            removed = dates._raw_delete(alias)
+            # Nobody can be promoted into a closed date.
+            waiting._raw_delete(alias)
+            record_events(
+                [event_for(Booking(provider_id=provider.pk, **row), created=False) for row in rows]
+                + [event_for(ProviderAvailability(provider_id=provider.pk, **slot), created=False) for slot in slots]
+            )
+            first, last = start, end
+            if rows:
+                # Multi-day bookings may also have held capacity on days outside the range.
+                first = min(first, *(r["booking_date"] for r in rows))
+                last = max(last, *(r["end_date"] for r in rows))
+                ProviderAvailability.objects.using(alias).filter(
+                    provider=provider, date__gte=first, date__lte=last
+                ).recount_remaining()
+            mark_dirty((first + timedelta(days=i) for i in range((last - first).days + 1)), using=alias)
+
+        emails = _cancellation_emails(
+            provider,
+            [
+                (customers[r["customer_id"]].email, customers[r["customer_id"]].username, r["booking_date"])
+                for r in rows if r["customer_id"] in customers
+            ],
+            reason,
+        )
+        enqueue("booking_cancelled", emails, using=alias)
+
+    logger.info(f"Provider {provider.pk} closed {start}..{end}: {cancelled} booking(s), {removed} date(s)")
+    return {"bookings": cancelled, "dates": removed, "customers": len(emails)}
@@ -0,0 +1,129 @@
+"""Append-only change feed of bookings and availability for downstream consumers.
+
+The signal receivers append a ``BookingEvent`` in the same transaction as
+every booking or availability insert and delete. Inside
+``deferred_schedule_updates`` (bulk paths such as closures) the events are
+buffered instead, then written with one ``bulk_create`` when the block exits.
+
+A consumer keeps the ``sequence`` of the last event it handled and asks for
+what came after it with ``read_events``. Ids are handed out before commit,
+so with concurrent writers a lower id can become visible after a higher
+one, and an id cursor would skip it for good. ``sequence`` is numbered
+after commit instead, by ``sequence_events`` under a lock: a transaction
+that commits late gets a later number, however long it ran.
+``read_events`` numbers whatever has committed before reading, so nothing
+else has to run for the feed to advance. ``delete_expired`` enforces the
+retention window in small batches; consumers must read more often than
+that.
+
+With sharded schedules (``services.sharding``) each schedule database keeps
+its own feed, numbered independently, so consumers keep one cursor per
+database and pass it as ``using``.
+"""
+import logging
+import time
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Max, Min
+
+from .models import Booking, BookingEvent, BookingEventSequence
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 1000
+
+
+def event_for(instance, created):
+    """The unsaved event for a booking or availability row being inserted (``created``) or deleted."""
+    if isinstance(instance, Booking):
+        return BookingEvent(
+            kind=BookingEvent.BOOKED if created else BookingEvent.CANCELLED,
+            provider_id=instance.provider_id,
+            booking_id=instance.pk,
+            customer_id=instance.customer_id,
+            date=instance.booking_date,
+            end_date=instance.end_date,
+            data={
+                "starts_at": instance.starts_at.isoformat(),
+                "ends_at": instance.ends_at.isoformat(),
+                "crew": instance.crew,
+            },
+        )
+    return BookingEvent(
+        kind=BookingEvent.AVAILABILITY_ADDED if created else BookingEvent.AVAILABILITY_REMOVED,
+        provider_id=instance.provider_id,
+        date=instance.date,
+        data={
+            "capacity": instance.capacity,
+            "crews": instance.crews,
+            "start_time": instance.start_time.isoformat() if instance.start_time else None,
+            "end_time": instance.end_time.isoformat() if instance.end_time else None,
+        },
+    )
+
+
+def serialize(event):
+    return {
+        "id": event.id,
+        "sequence": event.sequence,
+        "kind": event.kind,
+        "provider_id": event.provider_id,
+        "booking_id": event.booking_id,
+        "customer_id": event.customer_id,
+        "date": event.date.isoformat(),
+        "end_date": event.end_date.isoformat() if event.end_date else None,
+        "data": event.data,
+        "recorded_at": event.recorded_at.isoformat(),
+    }
+
+
+def sequence_events(using=DEFAULT_DB_ALIAS):
+    """Number the committed events that have no ``sequence`` yet, in id order; return how many.
+
+    The ``BookingEventSequence`` row is locked for the whole call, so calls
+    hand out numbers, and commit them, one after another. Every number is
+    higher than any given out before. The gaps left by rolled-back ids
+    don't matter to a cursor.
+    """
+    with transaction.atomic(using=using):
+        counter, _ = BookingEventSequence.objects.using(using).select_for_update().get_or_create(pk=1)
+        pending = BookingEvent.objects.using(using).filter(sequence__isnull=True)
+        bounds = pending.aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            return 0
+        # One UPDATE: ids keep their order. A lower id committing meanwhile is outside
+        # the range and waits for the next call, since it would number below the counter.
+        offset = counter.last + 1 - bounds["first"]
+        numbered = pending.filter(id__gte=bounds["first"], id__lte=bounds["last"]).update(sequence=F("id") + offset)
+        counter.last = bounds["last"] + offset
+        counter.save(update_fields=["last"])
+    return numbered
+
+
+def read_events(after=0, limit=500, kinds=None, using=DEFAULT_DB_ALIAS):
+    """Up to ``limit`` events with ``sequence > after``, in commit order.
+
+    The next cursor is the last returned ``sequence``, or ``after`` unchanged
+    when nothing new has committed.
+    """
+    sequence_events(using)
+    qs = BookingEvent.objects.using(using).filter(sequence__gt=after)
+    if kinds:
+        qs = qs.filter(kind__in=kinds)
+    return list(qs.order_by("sequence")[: max(1, min(limit, MAX_BATCH))])
+
+
+def delete_expired(before, batch_size=1000, pause=0.0, using=DEFAULT_DB_ALIAS):
+    """Delete events recorded before ``before``, oldest first, ``batch_size`` rows per statement."""
+    expired = BookingEvent.objects.using(using).filter(recorded_at__lt=before).order_by("id")
+    deleted = 0
+    while True:
+        # Short deletes keep the table available to writers while a large backlog drains.
+        batch = list(expired.values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            break
+        deleted += BookingEvent.objects.using(using).filter(pk__in=batch).delete()[0]
+        if pause:
+            time.sleep(pause)
+    logger.info(f"Deleted {deleted} booking event(s) recorded before {before.isoformat()} from {using}")
+    return deleted
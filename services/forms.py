@@ -1,9 +1,13 @@
+from datetime import timedelta
+
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
+from django.db.models import Min
 from django.utils import timezone
 from .models import Booking, ServiceProvider, ProviderAvailability
+from .scheduling import availability_on, free_crew, interval_for_days, open_days_in, span_days, window_bounds
 
 class ProviderFilterForm(forms.Form):
     q = forms.ChoiceField(
@@ -12,8 +16,63 @@ class ProviderFilterForm(forms.Form):
         label="Service type",
     )
     location = forms.CharField(max_length=100, required=False, label="Location")
+    keywords = forms.CharField(
+        max_length=100,
+        required=False,
+        label="Keywords",
+        widget=forms.TextInput(attrs={"placeholder": "e.g. heat pump, free quote"}),
+    )
+    available_from = forms.DateField(
+        required=False,
+        label="Free from",
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    available_to = forms.DateField(
+        required=False,
+        label="Free until",
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+
+    has_open_dates = forms.BooleanField(required=False, label="Has open dates")
+    sort = forms.ChoiceField(
+        choices=[("", "Newest"), ("soonest", "Available soonest")],
+        required=False,
+        label="Sort by",
+    )
+
+    # Keeps the availability range scan bounded no matter what the query string says.
+    MAX_AVAILABILITY_RANGE_DAYS = 90
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get("available_from")
+        end = cleaned_data.get("available_to")
+        if not start and not end:
+            return cleaned_data
+
+        today = timezone.now().date()
+        start = max(start or today, today)
+        end = end or start
+        if end < start:
+            raise ValidationError("The end date must be on or after the start date.")
+        if (end - start).days > self.MAX_AVAILABILITY_RANGE_DAYS:
+            raise ValidationError(
+                f"Please search a range of at most {self.MAX_AVAILABILITY_RANGE_DAYS} days."
+            )
+        cleaned_data["available_from"] = start
+        cleaned_data["available_to"] = end
+        return cleaned_data
 
 class BookingForm(forms.ModelForm):
+    # Optional: leave blank to book the provider's whole window on booking_date.
+    end_date = forms.DateField(
+        required=False,
+        label="Until (multi-day jobs)",
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    start_time = forms.TimeField(required=False, widget=forms.TimeInput(attrs={"type": "time"}))
+    end_time = forms.TimeField(required=False, widget=forms.TimeInput(attrs={"type": "time"}))
+
     class Meta:
         model = Booking
         fields = ["provider", "booking_date"]
@@ -30,7 +89,7 @@ class BookingForm(forms.ModelForm):
             raise ValidationError("Booking date must be in the future.")
         
         provider = self.cleaned_data.get("provider")
-        if provider and not ProviderAvailability.objects.filter(provider=provider, date=date).exists():
+        if provider and not availability_on(provider, date).exists():
             raise ValidationError("This provider is not available on that date.")
         
         return date
@@ -41,9 +100,25 @@ class BookingForm(forms.ModelForm):
         booking_date = cleaned_data.get("booking_date")
         
         if provider and booking_date:
-            # Check if the date is already booked
-            if Booking.objects.filter(provider=provider, booking_date=booking_date).exists():
-                raise ValidationError("This date is already booked for the selected provider.")
+            end_date = cleaned_data.get("end_date") or booking_date
+            if end_date < booking_date:
+                raise ValidationError("The end date must be on or after the booking date.")
+            starts_at, ends_at = interval_for_days(provider.pk, booking_date, end_date)
+            if cleaned_data.get("start_time"):
+                starts_at = window_bounds(booking_date, cleaned_data["start_time"])[0]
+            if cleaned_data.get("end_time"):
+                ends_at = window_bounds(end_date, None, cleaned_data["end_time"])[1]
+            # Window and availability checks run in Booking.clean() during model validation;
+            # set before the capacity check so a waitlist offer can reuse the interval.
+            self.instance.starts_at, self.instance.ends_at = starts_at, ends_at
+            # Check there is capacity left and a crew free for the interval
+            days = span_days(starts_at, ends_at)
+            open_days = open_days_in(provider, days)
+            crews = open_days.aggregate(crews=Min("crews"))["crews"]
+            if open_days.count() != len(days) or free_crew(provider.pk, starts_at, ends_at, crews) is None:
+                raise ValidationError(
+                    "This date is already booked for the selected provider.", code="booked"
+                )
         
         return cleaned_data
 
@@ -85,10 +160,13 @@ class UserRegisterForm(UserCreationForm):
 class AvailabilityForm(forms.ModelForm):
     class Meta:
         model = ProviderAvailability
-        fields = ["date"]
+        fields = ["date", "start_time", "end_time", "capacity", "crews"]
         widgets = {
-            "date": forms.DateInput(attrs={"type": "date"})
+            "date": forms.DateInput(attrs={"type": "date"}),
+            "start_time": forms.TimeInput(attrs={"type": "time"}),
+            "end_time": forms.TimeInput(attrs={"type": "time"}),
         }
+        labels = {"capacity": "Bookings per day", "crews": "Crews"}
     
     def clean_date(self):
         date = self.cleaned_data["date"]
@@ -99,3 +177,114 @@ class AvailabilityForm(forms.ModelForm):
             raise ValidationError("Availability date must be in the future.")
         
         return date
+
+class CalendarWindowForm(forms.Form):
+    month = forms.DateField(
+        required=False, input_formats=["%Y-%m"], label="Month", widget=forms.DateInput(attrs={"type": "month"})
+    )
+    months = forms.TypedChoiceField(
+        choices=[(1, "Month"), (3, "Quarter")], coerce=int, empty_value=1, required=False, label="Show"
+    )
+
+class AvailabilityToggleForm(forms.Form):
+    ACTIONS = [("open", "Open selected days"), ("close", "Close selected days")]
+
+    action = forms.ChoiceField(choices=ACTIONS)
+    days = forms.Field(widget=forms.MultipleHiddenInput)
+    capacity = forms.IntegerField(
+        min_value=1, max_value=32767, required=False, label="Bookings per day",
+        help_text="Leave blank for one booking per crew.",
+    )
+    crews = forms.IntegerField(min_value=1, max_value=32767, initial=1, required=False, label="Crews")
+
+    MAX_DAYS = 366
+
+    def clean_days(self):
+        values = self.cleaned_data["days"]
+        if not isinstance(values, list):
+            raise ValidationError("Please pick days from the calendar.")
+        parse = forms.DateField().to_python
+        # Blank entries parse to None; invalid ones raise ValidationError.
+        days = sorted({day for day in map(parse, values) if day is not None})
+        if not days:
+            raise ValidationError("Please pick days from the calendar.")
+        if len(days) > self.MAX_DAYS:
+            raise ValidationError(f"Please change at most {self.MAX_DAYS} days at a time.")
+        if days and days[0] < timezone.now().date():
+            raise ValidationError("Past days cannot be changed.")
+        return days
+
+class ClosureForm(forms.Form):
+    start_date = forms.DateField(label="Closed from", widget=forms.DateInput(attrs={"type": "date"}))
+    end_date = forms.DateField(label="Closed until", widget=forms.DateInput(attrs={"type": "date"}))
+    reason = forms.CharField(max_length=200, required=False, label="Reason (sent to customers)")
+
+    MAX_CLOSURE_DAYS = 366
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get("start_date")
+        end = cleaned_data.get("end_date")
+        if not start or not end:
+            return cleaned_data
+        if start < timezone.now().date():
+            raise ValidationError("Closures must start today or later.")
+        if end < start:
+            raise ValidationError("The end date must be on or after the start date.")
+        if (end - start).days >= self.MAX_CLOSURE_DAYS:
+            raise ValidationError(f"Please close at most {self.MAX_CLOSURE_DAYS} days at a time.")
+        return cleaned_data
+
+class WaitlistForm(forms.Form):
+    provider = forms.ModelChoiceField(queryset=ServiceProvider.objects.all(), widget=forms.HiddenInput)
+    date = forms.DateField(widget=forms.HiddenInput)
+    # The interval wanted; blank means the whole day.
+    starts_at = forms.DateTimeField(required=False, widget=forms.HiddenInput)
+    ends_at = forms.DateTimeField(required=False, widget=forms.HiddenInput)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        provider, date = cleaned_data.get("provider"), cleaned_data.get("date")
+        if not provider or not date:
+            return cleaned_data
+        if date < timezone.now().date():
+            raise ValidationError("Booking date must be in the future.")
+        slot = availability_on(provider, date).first()
+        if slot is None:
+            raise ValidationError("This provider is not available on that date.")
+        starts_at, ends_at = cleaned_data.get("starts_at"), cleaned_data.get("ends_at")
+        if starts_at is None or ends_at is None:
+            starts_at, ends_at = interval_for_days(provider.pk, date)
+            cleaned_data["starts_at"] = cleaned_data["ends_at"] = None
+        elif ends_at <= starts_at or timezone.localtime(starts_at).date() != date:
+            raise ValidationError("Please pick a time on the date you are waiting for.")
+        days = span_days(starts_at, ends_at)
+        open_days = open_days_in(provider, days)
+        crews = open_days.aggregate(crews=Min("crews"))["crews"]
+        if open_days.count() == len(days) and free_crew(provider.pk, starts_at, ends_at, crews) is not None:
+            raise ValidationError("That time still has space, so you can book it directly.", code="open")
+        return cleaned_data
+
+class DemandReportForm(forms.Form):
+    start = forms.DateField(required=False, label="From", widget=forms.DateInput(attrs={"type": "date"}))
+    end = forms.DateField(required=False, label="Until", widget=forms.DateInput(attrs={"type": "date"}))
+    service_type = forms.ChoiceField(
+        choices=[("", "-- Service Type --")] + list(ServiceProvider.SERVICE_TYPES),
+        required=False,
+        label="Service type",
+    )
+    location = forms.CharField(max_length=100, required=False, label="Location")
+
+    DEFAULT_WEEKS = 12
+    MAX_RANGE_DAYS = 366
+
+    def clean(self):
+        cleaned_data = super().clean()
+        end = cleaned_data.get("end") or timezone.now().date()
+        start = cleaned_data.get("start") or end - timedelta(weeks=self.DEFAULT_WEEKS)
+        if end < start:
+            raise ValidationError("The end date must be on or after the start date.")
+        if (end - start).days >= self.MAX_RANGE_DAYS:
+            raise ValidationError(f"Please report on at most {self.MAX_RANGE_DAYS} days at a time.")
+        cleaned_data["start"], cleaned_data["end"] = start, end
+        return cleaned_data
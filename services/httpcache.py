@@ -0,0 +1,89 @@
+"""HTTP caching policy: compression, validators and per-view Cache-Control.
+
+``cache_policy`` declares how a view's responses may be cached. Pages shown to
+a signed-in user are always ``private``, and every page varies on ``Cookie``
+because the navigation bar depends on the login. ``directory_condition`` lets
+the provider directory answer ``If-None-Match``/``If-Modified-Since`` with a
+304 before the view runs. Its validators come from one primary-key lookup,
+``services.snapshot.directory_state()``, instead of a hash of the rendered
+page: the version and change time on the ``DirectoryStamp`` row. Provider
+saves and deletes bump it, and so do schedule changes that move a provider's
+summary in ``refresh_availability_summary()``. The same state tells the view whether
+the directory snapshot (``services.snapshot``) is still current.
+
+``ThresholdGZipMiddleware`` compresses responses above
+``settings.GZIP_MIN_LENGTH`` bytes. It leaves event streams alone, because
+gzip would buffer the events.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.middleware.gzip import GZipMiddleware
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .snapshot import directory_state
+
+
+class ThresholdGZipMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        if response.get("Content-Type", "").startswith("text/event-stream"):
+            return response
+        if not response.streaming and len(response.content) < settings.GZIP_MIN_LENGTH:
+            return response
+        return super().process_response(request, response)
+
+
+def cache_policy(max_age=0, private=False):
+    """Set Cache-Control/Vary on a view's responses, including 304s.
+
+    Anonymous responses may be stored by shared caches for ``max_age``
+    seconds, unless ``private`` is set. Responses for signed-in users (or
+    ``private`` views) may only be kept by the browser, which has to
+    revalidate before reuse.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            response = view_func(request, *args, **kwargs)
+            if private or request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True, max_age=0)
+            else:
+                patch_cache_control(response, public=True, max_age=max_age)
+            patch_vary_headers(response, ["Cookie"])
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def directory_stats(request):
+    """``(last change, version)`` of the provider directory, queried once per request."""
+    if not hasattr(request, "_directory_stats"):
+        request._directory_stats = directory_state()
+    return request._directory_stats
+
+
+def _directory_state(request):
+    """``(last_modified, etag)`` for the provider directory, or ``(None, None)`` to skip validation."""
+    if not hasattr(request, "_directory_state"):
+        state = (None, None)
+        # A 304 would leave flash messages unshown, so render normally while any are pending.
+        if not len(get_messages(request)):
+            changed, version = directory_stats(request)
+            today = timezone.now().date()
+            # The date catches "open from today" filters rolling over.
+            raw = "|".join(str(part) for part in (
+                changed, version, today, request.user.pk, request.GET.urlencode(),
+            ))
+            state = (changed, hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest())
+        request._directory_state = state
+    return request._directory_state
+
+
+directory_condition = condition(
+    etag_func=lambda request, *args, **kwargs: _directory_state(request)[1],
+    last_modified_func=lambda request, *args, **kwargs: _directory_state(request)[0],
+)
@@ -0,0 +1,155 @@
+"""Replay-safe POSTs via an ``Idempotency-Key`` header or ``idempotency_key`` form field.
+
+The first request with a key claims it with a unique row in
+``IdempotencyKey`` and runs the view. If the view finishes with a redirect
+(the app's "it worked" shape), the status, ``Location`` and flash messages are
+recorded in the row and in the cache. A retry with the same key replays them
+without running the view, so it never touches the booking tables or sends
+email again. A retry that arrives while the first attempt is still running
+gets 409. Any other response (form errors, rate limiting) is not recorded, so
+the client can fix the problem and retry with the same key.
+
+Keys are scoped per user and view. Reusing a key with a different payload is
+rejected with 422. ``sweep_idempotency_keys`` deletes expired rows.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+FIELD = "idempotency_key"
+MAX_KEY_LENGTH = 200
+_IGNORED_FIELDS = {FIELD, "csrfmiddlewaretoken"}
+
+
+def _client_key(request):
+    return (request.META.get(HEADER) or request.POST.get(FIELD) or "").strip()
+
+
+def _digest(*parts):
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def request_fingerprint(request):
+    """Hash of the path and submitted fields, so a reused key with a different payload is caught."""
+    fields = sorted(
+        (name, value) for name, values in request.POST.lists() if name not in _IGNORED_FIELDS for value in values
+    )
+    return _digest(request.path, *(f"{name}={value}" for name, value in fields))
+
+
+def _cache_key(key):
+    return f"idempotency:{key}"
+
+
+def _queued_messages(request):
+    # Flash messages added during this request. The public API would mark them
+    # as read, so peek at the storage's queue instead.
+    storage = getattr(request, "_messages", None)
+    return [[m.level, m.message] for m in getattr(storage, "_queued_messages", [])]
+
+
+def _replay(request, outcome):
+    _, status, location, flashed = outcome
+    for level, message in flashed:
+        messages.add_message(request, level, message)
+    response = HttpResponse(status=status)
+    response["Location"] = location
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _reject(status, message):
+    return HttpResponse(message, status=status, content_type="text/plain")
+
+
+def _lookup(key):
+    """The recorded outcome ``(fingerprint, status, location, messages)``; status None while in flight."""
+    outcome = cache.get(_cache_key(key))
+    if outcome is not None:
+        return outcome
+    row = (
+        IdempotencyKey.objects.filter(key=key, expires_at__gt=timezone.now())
+        .values_list("fingerprint", "status", "location", "messages")
+        .first()
+    )
+    if row and row[1] is not None:
+        cache.set(_cache_key(key), row, settings.IDEMPOTENCY_TTL)
+    return row
+
+
+def _claim(key, fingerprint):
+    now = timezone.now()
+    IdempotencyKey.objects.filter(key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                key=key,
+                fingerprint=fingerprint,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT),
+            )
+        return True
+    except IntegrityError:
+        return False
+
+
+def _record(key, fingerprint, response, flashed):
+    outcome = (fingerprint, response.status_code, response.get("Location", ""), flashed)
+    IdempotencyKey.objects.filter(key=key).update(
+        status=outcome[1],
+        location=outcome[2],
+        messages=flashed,
+        expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL),
+    )
+    cache.set(_cache_key(key), outcome, settings.IDEMPOTENCY_TTL)
+
+
+def idempotent(scope):
+    """Replay the recorded outcome of a POST whose ``Idempotency-Key`` was seen before."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            client_key = _client_key(request)
+            if request.method != "POST" or not client_key:
+                return view(request, *args, **kwargs)
+            if len(client_key) > MAX_KEY_LENGTH:
+                return _reject(400, "Idempotency key is too long.")
+
+            key = _digest(scope, request.user.pk, client_key)
+            fingerprint = request_fingerprint(request)
+            outcome = _lookup(key)
+            if outcome is None and not _claim(key, fingerprint):
+                # Someone claimed the key between our lookup and insert.
+                outcome = _lookup(key) or (fingerprint, None, "", [])
+            if outcome is not None:
+                if outcome[0] != fingerprint:
+                    return _reject(422, "This idempotency key was already used for a different request.")
+                if outcome[1] is None:
+                    return _reject(409, "The original request is still being processed.")
+                logger.info(f"Replaying {scope} request for idempotency key {key[:12]}")
+                return _replay(request, outcome)
+
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                IdempotencyKey.objects.filter(key=key).delete()
+                raise
+            if 300 <= response.status_code < 400:
+                _record(key, fingerprint, response, _queued_messages(request))
+            else:
+                IdempotencyKey.objects.filter(key=key).delete()
+            return response
+        return wrapped
+    return decorator
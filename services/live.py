@@ -0,0 +1,195 @@
+"""Live availability updates: a small pub/sub feeding the server-sent events stream.
+
+Messages are snapshots (a provider's current free dates), not deltas, so
+fan-out can coalesce them. Each channel keeps only the latest payload, a
+version number and one shared ``asyncio.Event``. A connected client holds a
+reference to that state and waits on the shared event, so an idle
+connection costs one suspended generator and no per-client queue. Publishing
+wakes every waiter at once. A slow client simply skips to the newest
+version.
+
+``InProcessBroker`` reaches clients connected to the same worker process.
+``CacheBroker`` (the default) passes payloads between processes through the
+shared cache. ``settings.LIVE_BROKER`` names the broker class, so another
+transport can replace it without touching the views or the signals.
+"""
+import asyncio
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def provider_channel(provider_id):
+    return f"provider:{provider_id}:availability"
+
+
+class _ChannelState:
+    __slots__ = ("version", "payload", "changed", "subscribers")
+
+    def __init__(self):
+        self.version = 0
+        self.payload = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+
+
+class Subscription:
+    def __init__(self, broker, channel, state):
+        self.broker = broker
+        self.channel = channel
+        self.state = state
+        self.seen = state.version
+
+    async def next(self, timeout):
+        """The next ``(version, payload)`` on the channel, or ``None`` after ``timeout`` idle seconds."""
+        state = self.state
+        if state.version == self.seen:
+            try:
+                await asyncio.wait_for(state.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.seen = state.version
+        return self.seen, state.payload
+
+    def close(self):
+        self.broker._unsubscribe(self.channel, self.state)
+
+
+class InProcessBroker:
+    """Fan-out to subscribers on this process's event loop."""
+
+    def __init__(self):
+        self._channels = {}
+        self._loop = None
+
+    def has_subscribers(self, channel):
+        return channel in self._channels
+
+    def subscribe(self, channel):
+        """Register interest in ``channel``; must be called on the event loop serving the stream."""
+        self._loop = asyncio.get_running_loop()
+        state = self._channels.setdefault(channel, _ChannelState())
+        state.subscribers += 1
+        return Subscription(self, channel, state)
+
+    def _unsubscribe(self, channel, state):
+        state.subscribers -= 1
+        if not state.subscribers and self._channels.get(channel) is state:
+            del self._channels[channel]
+
+    def publish(self, channel, producer):
+        """Publish ``producer()`` to ``channel``; the producer only runs if someone is listening.
+
+        Safe to call from any thread (typically a sync view's ``on_commit`` hook).
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self.has_subscribers(channel):
+            return False
+        payload = producer()
+        loop.call_soon_threadsafe(self._deliver, channel, payload)
+        return True
+
+    def _deliver(self, channel, payload):
+        state = self._channels.get(channel)
+        if state is None:
+            return
+        state.version += 1
+        state.payload = payload
+        # Wake everyone waiting on the old event; new waits use a fresh one.
+        changed, state.changed = state.changed, asyncio.Event()
+        changed.set()
+
+
+class CacheBroker(InProcessBroker):
+    """Fan-out across worker processes through the shared cache.
+
+    A process with subscribers on a channel keeps a ``listening`` key alive and
+    polls the channel's latest payload every ``LIVE_POLL_SECONDS`` from one task
+    per channel, then delivers it to its subscribers as ``InProcessBroker`` does.
+    Publishing writes that payload from any process, and only while a process is
+    listening. Needs a cache shared by the workers (``CACHE_BACKEND``).
+    """
+
+    def __init__(self, poll_seconds=None):
+        super().__init__()
+        self.poll_seconds = poll_seconds or settings.LIVE_POLL_SECONDS
+        self._pollers = {}
+
+    @staticmethod
+    def _keys(channel):
+        return f"live:{channel}:listening", f"live:{channel}:latest"
+
+    def subscribe(self, channel):
+        subscription = super().subscribe(channel)
+        if channel not in self._pollers:
+            listening, latest = self._keys(channel)
+            cache.set(listening, True, self.poll_seconds * 3)
+            # Only payloads published from here on are news to this process.
+            seen = (cache.get(latest) or (None, None))[0]
+            self._pollers[channel] = asyncio.ensure_future(self._poll(channel, seen))
+        return subscription
+
+    def _unsubscribe(self, channel, state):
+        super()._unsubscribe(channel, state)
+        if channel not in self._channels and channel in self._pollers:
+            self._pollers.pop(channel).cancel()
+
+    async def _poll(self, channel, seen):
+        listening, latest = self._keys(channel)
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await cache.aset(listening, True, self.poll_seconds * 3)
+                token, payload = await cache.aget(latest) or (None, None)
+            except Exception as e:
+                logger.error(f"Failed to poll live channel {channel}: {e}")
+                continue
+            if token is not None and token != seen:
+                seen = token
+                self._deliver(channel, payload)
+
+    def publish(self, channel, producer):
+        listening, latest = self._keys(channel)
+        if not cache.get(listening):
+            return False
+        cache.set(latest, (uuid.uuid4().hex, producer()), self.poll_seconds * 3)
+        return True
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, "LIVE_BROKER", "services.live.CacheBroker"))()
+    return _broker
+
+
+def publish_availability(provider_id):
+    """Push the provider's current free dates to connected clients (no-op if nobody listens)."""
+    from .cache import get_free_dates
+
+    try:
+        get_broker().publish(
+            provider_channel(provider_id),
+            lambda: [d.isoformat() for d in get_free_dates(provider_id)],
+        )
+    except Exception as e:
+        logger.error(f"Failed to publish availability for provider {provider_id}: {e}")
+
+
+def sse_event(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from services.analytics import day_chunks, recompute_days
+from services.models import Booking, ProviderAvailability
+from services.sharding import fan_out
+
+
+class Command(BaseCommand):
+    help = "Rebuild demand rollups for a date range, a chunk of days at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", help="First day (YYYY-MM-DD, default: earliest data)")
+        parser.add_argument("--to", dest="end", help="Last day (YYYY-MM-DD, default: latest data)")
+        parser.add_argument("--chunk-days", type=int, default=31)
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options["start"]) if options["start"] else None
+            end = date.fromisoformat(options["end"]) if options["end"] else None
+        except ValueError:
+            raise CommandError("--from/--to must be YYYY-MM-DD")
+        if options["chunk_days"] < 1:
+            raise CommandError("--chunk-days must be at least 1")
+
+        if start is None or end is None:
+            bounds = [b for pair in fan_out(self.bounds) for b in pair]
+            lows = [b["lo"] for b in bounds if b["lo"]]
+            highs = [b["hi"] for b in bounds if b["hi"]]
+            if not lows:
+                self.stdout.write("Nothing to backfill.")
+                return
+            start, end = start or min(lows), end or max(highs)
+
+        rows = 0
+        for days in day_chunks(start, end, options["chunk_days"]):
+            # Each chunk is its own short transaction, so live writes are never blocked for long.
+            rows += recompute_days(days)
+            self.stdout.write(f"  {days[0]}..{days[-1]}: {rows} row(s) so far")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup row(s) for {start}..{end}."))
+
+    @staticmethod
+    def bounds(alias):
+        """The first and last day with availability, and with bookings, on one schedule database."""
+        return [
+            ProviderAvailability.objects.using(alias).aggregate(lo=Min("date"), hi=Max("date")),
+            Booking.objects.using(alias).aggregate(lo=Min("booking_date"), hi=Max("booking_date")),
+        ]
@@ -0,0 +1,49 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from services.events import MAX_BATCH, read_events, serialize
+from services.sharding import schedule_databases
+
+
+class Command(BaseCommand):
+    help = "Print booking/availability change events after a cursor as JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--after", type=int, help="Cursor: print events with a higher sequence (default 0)")
+        parser.add_argument(
+            "--cursor-file",
+            help="Read the cursor from this file and store the new one there once the events are printed",
+        )
+        parser.add_argument("--limit", type=int, default=MAX_BATCH, help=f"At most this many events (max {MAX_BATCH})")
+        parser.add_argument("--kind", action="append", dest="kinds", help="Only this kind (repeatable)")
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="Schedule database to read; with sharding each has its own feed and cursor",
+        )
+
+    def handle(self, *args, **options):
+        if options["database"] not in schedule_databases():
+            raise CommandError(f"{options['database']} is not a schedule database.")
+        path = options["cursor_file"]
+        after = options["after"]
+        if after is None and path and os.path.exists(path):
+            with open(path) as f:
+                try:
+                    after = int(f.read().strip() or 0)
+                except ValueError:
+                    raise CommandError(f"{path} does not contain a cursor.")
+        after = after or 0
+
+        batch = read_events(after, options["limit"], kinds=options["kinds"], using=options["database"])
+        for event in batch:
+            self.stdout.write(json.dumps(serialize(event)))
+        if path and batch:
+            # Written only after the events are out, so a crash replays rather than skips them.
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                f.write(str(batch[-1].sequence))
+            os.replace(tmp, path)
+        self.stderr.write(f"{len(batch)} event(s); next cursor {batch[-1].sequence if batch else after}")
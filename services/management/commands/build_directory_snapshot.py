@@ -0,0 +1,59 @@
+import struct
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from services.snapshot import DirectorySnapshot, build, directory_state, get_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write the memory-mapped provider directory snapshot that workers serve the directory from"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="Snapshot file (default: DIRECTORY_SNAPSHOT_PATH)")
+        parser.add_argument(
+            "--if-stale", action="store_true", help="Do nothing while the current snapshot still matches the database"
+        )
+        parser.add_argument(
+            "--watch", type=float, metavar="SECONDS",
+            help="Keep running: check the directory version every SECONDS and rebuild whenever it moved",
+        )
+
+    def handle(self, *args, **options):
+        path = options["output"] or settings.DIRECTORY_SNAPSHOT_PATH
+        if not path:
+            raise CommandError("Set DIRECTORY_SNAPSHOT_PATH or pass --output.")
+        if options["watch"] is None:
+            if not self.build(path, options["if_stale"]):
+                self.stdout.write("Snapshot is current.")
+            return
+        try:
+            while True:
+                self.build(path, if_stale=True)
+                # The check is one primary-key lookup, so a short interval is cheap.
+                time.sleep(options["watch"])
+                close_old_connections()
+        except KeyboardInterrupt:
+            pass
+
+    def build(self, path, if_stale):
+        """Write the snapshot unless ``if_stale`` and it is current; return whether it was written."""
+        if if_stale:
+            snapshot = self.current(path)
+            if snapshot is not None and snapshot.matches(directory_state()):
+                return False
+        rows = build(path)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} provider(s) to {path}."))
+        return True
+
+    @staticmethod
+    def current(path):
+        if path == settings.DIRECTORY_SNAPSHOT_PATH:
+            # Remapped only when the file changed.
+            return get_snapshot()
+        try:
+            return DirectorySnapshot(path)
+        except (OSError, ValueError, struct.error):
+            return None
@@ -0,0 +1,108 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from services.snapshot import build
+
+# One worker: serves directory pages, reports latency, then memory once every worker has warmed up.
+PROBE = r"""
+import json, os, sys, time
+import django
+django.setup()
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from services.views import ProviderListView
+
+def memory():
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if parts[0].rstrip(":") in ("Rss", "Pss", "Shared_Clean", "Private_Clean", "Private_Dirty"):
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        import resource
+        fields["Rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return fields
+
+view = ProviderListView.as_view()
+factory = RequestFactory()
+queries = json.loads(sys.argv[2])
+timings = []
+for i in range(int(sys.argv[1])):
+    request = factory.get("/providers/", queries[i % len(queries)])
+    request.user = AnonymousUser()
+    started = time.perf_counter()
+    response = view(request)
+    response.render()
+    timings.append(time.perf_counter() - started)
+print("ready", flush=True)
+sys.stdin.readline()
+print(json.dumps({"timings": timings, "memory": memory()}), flush=True)
+"""
+
+QUERIES = [{}, {"page": "last"}, {"q": "solar"}, {"location": "on"}, {"has_open_dates": "on", "sort": "soonest"}]
+
+
+class Command(BaseCommand):
+    help = "Compare directory list latency and per-worker memory: database versus the mmap snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent worker processes per mode")
+        parser.add_argument("--requests", type=int, default=200, help="Directory pages served per worker")
+
+    def _run(self, snapshot_path, workers, requests):
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "ecoconnect.settings"),
+            DIRECTORY_SNAPSHOT_PATH=snapshot_path,
+        )
+        procs = [
+            subprocess.Popen(
+                [sys.executable, "-c", PROBE, str(requests), json.dumps(QUERIES)],
+                cwd=settings.BASE_DIR, env=env, text=True,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            for _ in range(workers)
+        ]
+        # Memory is read only once every worker is up, so shared pages are split between them.
+        for proc in procs:
+            if proc.stdout.readline().strip() != "ready":
+                raise CommandError(f"Probe process failed:\n{proc.stderr.read()}")
+        results = []
+        for proc in procs:
+            out, err = proc.communicate("go\n")
+            if proc.returncode != 0:
+                raise CommandError(f"Probe process failed:\n{err}")
+            results.append(json.loads(out.strip().splitlines()[-1]))
+        return results
+
+    def _report(self, label, results):
+        timings = sorted(t * 1000 for r in results for t in r["timings"])
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{label:<9} list latency median {statistics.median(timings):7.2f} ms   p95 {p95:7.2f} ms"
+        )
+        for key in ["Rss", "Pss", "Shared_Clean", "Private_Clean", "Private_Dirty"]:
+            values = [r["memory"][key] for r in results if key in r["memory"]]
+            if values:
+                self.stdout.write(f"          {key:<14} per worker {statistics.mean(values):8.1f} MB")
+
+    def handle(self, *args, **options):
+        workers, requests = options["workers"], options["requests"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = settings.DIRECTORY_SNAPSHOT_PATH or os.path.join(tmp, "directory.snapshot")
+            rows = build(path)
+            self.stdout.write(
+                f"{rows} provider(s), snapshot {os.path.getsize(path) / 1024:.1f} KB; "
+                f"{workers} worker(s) x {requests} request(s) per mode"
+            )
+            self._report("database", self._run("", workers, requests))
+            self._report("snapshot", self._run(path, workers, requests))
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from services.events import delete_expired
+from services.sharding import schedule_databases
+
+
+class Command(BaseCommand):
+    help = "Delete change-feed events older than the retention window in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.BOOKING_EVENTS_RETENTION_DAYS)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        deleted = sum(
+            delete_expired(cutoff, batch_size=options["batch_size"], pause=options["pause"], using=alias)
+            for alias in schedule_databases()
+        )
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} booking event(s) older than {options['days']} day(s)."))
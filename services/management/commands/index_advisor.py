@@ -0,0 +1,132 @@
+import re
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from services.availability_calendar import window_bookings, window_slots
+from services.cache import free_dates_queryset
+from services.models import DirectoryStamp, ServiceProvider
+from services.scheduling import availability_on, day_bounds, latest_starting_before, open_days_in
+from services.sharding import use_shard
+from services.views import ProviderListView, _customer_bookings
+
+# Plan lines that mean "reads the whole table" or "sorts outside an index", per backend.
+# On SQLite, SCAN ... USING INDEX walks the whole index and looks up every row it passes;
+# only SEARCH uses the index to narrow the rows down.
+PLAN_ISSUES = {
+    "sqlite": [
+        (re.compile(r"\bSCAN (?!CONSTANT ROW)(\w+)(?!.*\bUSING\b)"), "full scan"),
+        (re.compile(r"\bSCAN (\w+) USING INDEX\b"), "index scan"),
+        (re.compile(r"USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)"), "temp sort"),
+    ],
+    "postgresql": [
+        (re.compile(r"Seq Scan on (\w+)"), "full scan"),
+        (re.compile(r"->\s+(?:Incremental )?Sort\b|^Sort\b"), "temp sort"),
+    ],
+}
+
+# Issues no index can remove, by (query, issue), with the reason they are tolerated.
+# Any other issue on the same query is still flagged.
+ACCEPTED = {
+    ("providers: newest", "index scan"):
+        "walks provider_created_idx newest first and stops after one page",
+    ("providers: by location", "index scan"):
+        "a substring match no B-tree can seek; walks providers newest first until a page matches",
+    ("providers: free in date range", "temp sort"):
+        "sorts only the providers with an open date in the range, by that date",
+    ("manage_availability: bookings in window", "temp sort"):
+        "sorts only the bookings touching the shown weeks, by start time",
+}
+
+
+def provider_list(params):
+    """The queryset ProviderListView pages over for the query string ``params``."""
+    view = ProviderListView()
+    view.setup(RequestFactory().get("/providers/", params))
+    return view.get_queryset()[: view.paginate_by]
+
+
+def hot_queries():
+    """``(name, queryset)`` for the queries behind the busiest pages and form checks.
+
+    Each is built by the helper the view or form itself calls, so the two can't drift apart.
+    """
+    today = timezone.now().date()
+    user, provider = User(pk=1), ServiceProvider(pk=1)
+    _, ends_at = day_bounds(today + timedelta(days=1))
+    return [
+        ("providers: newest", provider_list({})),
+        ("providers: by service type", provider_list({"q": "solar"})),
+        ("providers: by location", provider_list({"location": "Wind"})),
+        ("providers: soonest with open dates", provider_list({"sort": "soonest", "has_open_dates": "on"})),
+        ("providers: free in date range", provider_list({
+            "available_from": today.isoformat(), "available_to": (today + timedelta(days=14)).isoformat(),
+        })),
+        # services.snapshot.directory_state(), behind every directory request and 304
+        ("directory: version", DirectoryStamp.objects.filter(pk=1).values_list("changed_at", "version")),
+        ("user_history", _customer_bookings(user)),
+        # services.availability_calendar.month_grid()
+        ("manage_availability: dates in window", window_slots(provider, today, today + timedelta(days=41))),
+        ("manage_availability: bookings in window", window_bookings(provider, today, today + timedelta(days=41))),
+        ("book_service: free dates", free_dates_queryset(provider.pk, today)),
+        # BookingForm.clean_booking_date() / clean(); .exists() selects nothing but a constant
+        ("BookingForm: provider available on date", availability_on(provider, today).values("pk")[:1]),
+        ("BookingForm: open days in interval", open_days_in(provider, [today])),
+        # services.scheduling.find_overlap(), once per crew
+        ("BookingForm: crew overlap", latest_starting_before(provider.pk, ends_at)[:1]),
+    ]
+
+
+def plan_issues(plan, vendor):
+    issues = []
+    for line in plan.splitlines():
+        for pattern, label in PLAN_ISSUES.get(vendor, []):
+            if pattern.search(line):
+                issues.append(f"{label}: {line.strip()}")
+    return issues
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the app's hot querysets and flag full table scans and temporary sorts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan, not just flagged ones")
+        parser.add_argument("--fail-on-issues", action="store_true", help="Exit non-zero if anything is flagged")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PLAN_ISSUES:
+            raise CommandError(f"Plan analysis is only implemented for SQLite and PostgreSQL, not {vendor}.")
+
+        queries = hot_queries()
+        flagged = 0
+        for name, qs in queries:
+            # The plans are read on ``connection``, so explain schedule queries there too.
+            with use_shard(DEFAULT_DB_ALIAS):
+                plan = qs.explain()
+            issues = plan_issues(plan, vendor)
+            accepted = [issue for issue in issues if (name, issue.split(":")[0]) in ACCEPTED]
+            flagged_issues = [issue for issue in issues if issue not in accepted]
+            if flagged_issues:
+                flagged += 1
+                self.stdout.write(self.style.WARNING(f"FLAG {name}"))
+            elif accepted:
+                self.stdout.write(f"note {name}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok   {name}"))
+            for issue in flagged_issues:
+                self.stdout.write(f"       {issue}")
+            for issue in accepted:
+                self.stdout.write(f"       {issue} ({ACCEPTED[name, issue.split(':')[0]]})")
+            if options["verbose_plans"] or flagged_issues:
+                for line in plan.splitlines():
+                    self.stdout.write(f"         | {line}")
+
+        summary = f"{flagged} of {len(queries)} hot queries flagged."
+        if flagged and options["fail_on_issues"]:
+            raise CommandError(summary)
+        self.stdout.write(summary)
@@ -0,0 +1,77 @@
+import json
+import pstats
+from collections import defaultdict
+from io import StringIO
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from services.profiling import profiling_settings
+
+
+class Command(BaseCommand):
+    help = "Merge sampled request profiles into ranked hot-path reports per view"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", help="Profile directory (default: settings.PROFILING['DIR'])")
+        parser.add_argument("--view", help="Only report this URL name")
+        parser.add_argument("--limit", type=int, default=15, help="Functions to list per view")
+        parser.add_argument("--statements", type=int, default=5, help="SQL statements to list per view")
+        parser.add_argument(
+            "--sort", default="cumulative", choices=["cumulative", "tottime", "ncalls"],
+            help="pstats sort key for the function ranking",
+        )
+
+    def handle(self, *args, **options):
+        root = Path(options["dir"]) if options["dir"] else profiling_settings()["DIR"]
+        if not root.is_dir():
+            raise CommandError(f"No profiles found in {root}")
+
+        views = sorted(d for d in root.iterdir() if d.is_dir())
+        if options["view"]:
+            views = [d for d in views if d.name == options["view"]]
+
+        summaries = []
+        for directory in views:
+            samples = [json.loads(p.read_text()) for p in directory.glob("*.json")]
+            dumps = [str(p) for p in directory.glob("*.prof")]
+            if not samples or not dumps:
+                continue
+            summaries.append((directory.name, samples, dumps))
+        # Hottest views first, by total sampled wall time.
+        summaries.sort(key=lambda s: sum(x["seconds"] for x in s[1]), reverse=True)
+
+        for view, samples, dumps in summaries:
+            n = len(samples)
+            total = sum(s["seconds"] for s in samples)
+            sql = sum(s["sql_seconds"] for s in samples)
+            queries = sum(s["sql_count"] for s in samples)
+            templates = sum(s["template_seconds"] for s in samples)
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {view} ({n} samples)"))
+            self.stdout.write(
+                f"  avg {total / n * 1000:.1f} ms | SQL {sql / n * 1000:.1f} ms over "
+                f"{queries / n:.1f} queries | templates {templates / n * 1000:.1f} ms"
+            )
+            stats = pstats.Stats(*dumps, stream=StringIO())
+            stats.sort_stats(options["sort"])
+            for func in stats.fcn_list[: options["limit"]]:
+                cc, nc, tt, ct, _ = stats.stats[func]
+                filename, line, name = func
+                self.stdout.write(
+                    f"  {ct / n * 1000:9.2f} ms cum {tt / n * 1000:9.2f} ms self {nc:>8} calls  "
+                    f"{name} ({filename}:{line})"
+                )
+            self.write_statements(samples, options["statements"])
+
+    def write_statements(self, samples, limit):
+        """The view's ``limit`` SQL statements with the most total time, summed over its samples."""
+        totals = defaultdict(lambda: [0, 0.0])
+        for sample in samples:
+            # Samples written before statements were recorded have none.
+            for sql, (count, seconds) in sample.get("statements", {}).items():
+                totals[sql][0] += count
+                totals[sql][1] += seconds
+        ranked = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        n = len(samples)
+        for sql, (count, seconds) in ranked:
+            self.stdout.write(f"  {seconds / n * 1000:9.2f} ms SQL {count / n:8.1f} calls  {sql[:160]}")
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from services.models import ProviderAvailability, ServiceProvider
+from services.sharding import availability_summaries, schedule_databases
+
+
+class Command(BaseCommand):
+    help = "Find and repair drift in the availability capacity counters and the ServiceProvider summary"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without fixing it")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        counters = sum(
+            self.reconcile_counters(alias, today, options["batch_size"], options["dry_run"])
+            for alias in schedule_databases()
+        )
+        summaries = ServiceProvider.objects.order_by("pk").values_list("pk", "shard", "next_free_date", "open_slot_count")
+
+        last_id, checked, drifted = 0, 0, 0
+        while True:
+            # Keyset pagination keeps every batch an index range scan on the primary key.
+            batch = list(summaries.filter(pk__gt=last_id)[: options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            checked += len(batch)
+            # Expected values come from each provider's own schedule database.
+            expected = availability_summaries([(pk, shard) for pk, shard, _, _ in batch], today)
+            bad = [pk for pk, _, stored_next, stored_count in batch
+                   if (stored_next, stored_count) != expected[pk]]
+            drifted += len(bad)
+            if bad and not options["dry_run"]:
+                with transaction.atomic():
+                    ServiceProvider.objects.filter(pk__in=bad).refresh_availability_summary(today=today)
+
+        verb = "Found" if options["dry_run"] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} provider(s). {verb} {drifted} with drift and {counters} drifted capacity counter(s)."
+        ))
+
+    def reconcile_counters(self, alias, today, batch_size, dry_run):
+        drifted_rows = (
+            ProviderAvailability.objects.using(alias).filter(date__gte=today)
+            .with_expected_remaining()
+            .exclude(remaining=F("expected_remaining"))
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        last_id, drifted = 0, 0
+        while True:
+            batch = list(drifted_rows.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                return drifted
+            last_id = batch[-1]
+            drifted += len(batch)
+            if not dry_run:
+                # Recounting must come before the summary check, which reads ``remaining``.
+                with transaction.atomic(using=alias):
+                    ProviderAvailability.objects.using(alias).filter(pk__in=batch).recount_remaining()
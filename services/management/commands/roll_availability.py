@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from services.models import ServiceProvider
+
+
+class Command(BaseCommand):
+    help = "Nightly: advance next_free_date/open_slot_count for providers whose next free date has passed"
+
+    def handle(self, *args, **kwargs):
+        today = timezone.now().date()
+        # Providers whose next free date is still ahead have no past dates in their
+        # count either, so only the ones that fell behind need recomputing.
+        updated = ServiceProvider.objects.filter(
+            next_free_date__lt=today
+        ).refresh_availability_summary(today=today)
+        self.stdout.write(self.style.SUCCESS(f"Rolled availability forward for {updated} provider(s)."))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from services.models import ServiceProvider, ProviderAvailability
+from services.sharding import use_shard
 from datetime import date, timedelta
 
 class Command(BaseCommand):
@@ -15,7 +16,8 @@ class Command(BaseCommand):
             defaults={"bio": "Solar installs and maintenance.", "price_note": "From $99 inspection"}
         )
         # Next 10 days every other day
-        ProviderAvailability.objects.filter(provider=p).delete()
+        with use_shard(p):
+            ProviderAvailability.objects.filter(provider=p).delete()
         today = date.today()
         for i in range(1, 11, 2):
             ProviderAvailability.objects.create(provider=p, date=today + timedelta(days=i))
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from services.models import OutboundEmail
+from services.notifications import MAX_ATTEMPTS, send_outbox
+from services.sharding import schedule_databases
+
+
+class Command(BaseCommand):
+    help = "Send outbox emails that no worker delivered, and delete old sent ones (safe to rerun)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-age", type=int, default=60,
+            help="Seconds to leave new emails to the worker that queued them",
+        )
+        parser.add_argument("--keep-days", type=int, default=7, help="Days to keep sent emails")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=4, help="Parallel SMTP connections")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        created_before = now - timedelta(seconds=options["min_age"])
+        sent = failed = swept = given_up = 0
+        for alias in schedule_databases():
+            while True:
+                batch_sent, batch_failed = send_outbox(
+                    using=alias, created_before=created_before,
+                    limit=options["batch_size"], concurrency=options["concurrency"],
+                )
+                sent, failed = sent + batch_sent, failed + batch_failed
+                # Failed rows are released, so only a batch with successes can reveal new work.
+                if batch_sent < options["batch_size"] or batch_failed:
+                    break
+            outbox = OutboundEmail.objects.using(alias)
+            given_up += outbox.filter(sent_at__isnull=True, attempts__gte=MAX_ATTEMPTS).count()
+            cutoff = now - timedelta(days=options["keep_days"])
+            while True:
+                # Short deletes keep the outbox available to the transactions writing to it.
+                batch = list(outbox.filter(sent_at__lt=cutoff).order_by("sent_at", "id").values_list("pk", flat=True)[:1000])
+                if not batch:
+                    break
+                swept += outbox.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {sent} email(s); {failed} failed; {given_up} given up after {MAX_ATTEMPTS} attempts; "
+            f"deleted {swept} sent email(s)."
+        ))
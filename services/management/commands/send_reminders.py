@@ -0,0 +1,123 @@
+import uuid
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from services.models import Booking, ReminderDispatch, ServiceProvider
+from services.notifications import send_batch
+from services.sharding import schedule_databases
+
+
+def _chunks(items, size=500):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Command(BaseCommand):
+    help = "Email customers a reminder and providers a daily digest for upcoming bookings (safe to rerun)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Booking date to remind about (YYYY-MM-DD, default: tomorrow)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=4, help="Parallel SMTP connections")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be sent")
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options["date"]) if options["date"] else timezone.now().date() + timedelta(days=1)
+        except ValueError:
+            raise CommandError("--date must be YYYY-MM-DD")
+
+        customers, providers = self.collect(day, options["batch_size"])
+        messages = {}
+        for email, (name, rows) in customers.items():
+            lines = "\n".join(f"- {provider} on {day}" for provider in sorted(rows))
+            messages[f"reminder:{day}:{email}"] = EmailMessage(
+                "EcoConnect: Upcoming booking reminder",
+                f"Hi {name},\n\nThis is a reminder of your upcoming booking(s):\n{lines}\n",
+                settings.DEFAULT_FROM_EMAIL,
+                [email],
+            )
+        for email, (name, rows) in providers.items():
+            lines = "\n".join(f"- {customer}" for customer in sorted(rows))
+            messages[f"digest:{day}:{email}"] = EmailMessage(
+                f"EcoConnect: {len(rows)} booking(s) on {day}",
+                f"Hi {name},\n\nYou have {len(rows)} booking(s) on {day}:\n{lines}\n",
+                settings.DEFAULT_FROM_EMAIL,
+                [email],
+            )
+
+        if options["dry_run"]:
+            already = set()
+            for chunk in _chunks(list(messages)):
+                already.update(ReminderDispatch.objects.filter(key__in=chunk).values_list("key", flat=True))
+            self.stdout.write(f"Would send {len(messages) - len(already)} message(s) for {day}.")
+            return
+
+        keys = self.claim(messages)
+        try:
+            flags = send_batch("reminder", [messages[k] for k in keys], options["concurrency"])
+        except BaseException:
+            # Nothing is confirmed sent: release the claims so a rerun retries the day.
+            for chunk in _chunks(keys):
+                ReminderDispatch.objects.filter(key__in=chunk, sent_at__isnull=True).delete()
+            raise
+        sent = [k for k, ok in zip(keys, flags) if ok]
+        failed = [k for k, ok in zip(keys, flags) if not ok]
+        now = timezone.now()
+        for chunk in _chunks(sent):
+            ReminderDispatch.objects.filter(key__in=chunk).update(sent_at=now)
+        # Release failed claims so the next run retries them.
+        for chunk in _chunks(failed):
+            ReminderDispatch.objects.filter(key__in=chunk).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {len(sent)} message(s) for {day}; {len(failed)} failed; "
+            f"{len(messages) - len(keys)} already sent."
+        ))
+
+    def collect(self, day, batch_size):
+        """Group the day's bookings per recipient address, scanning in keyset batches.
+
+        Returns ``{email: (name, rows)}`` for customers and for provider owners;
+        accounts sharing an address get one message, as its key is per address.
+        Each schedule database is scanned in turn; the customers and providers
+        of a batch are then fetched from ``default`` by id.
+        """
+        customers, providers = {}, {}
+        for alias in schedule_databases():
+            rows = Booking.objects.using(alias).filter(booking_date=day).order_by("booking_date", "id").values_list(
+                "id", "customer_id", "provider_id"
+            )
+            last_id = 0
+            while True:
+                batch = list(rows.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                users = User.objects.in_bulk({c for _, c, _ in batch})
+                owners = ServiceProvider.objects.select_related("user").in_bulk({p for _, _, p in batch})
+                for _, customer_id, provider_id in batch:
+                    customer, provider = users.get(customer_id), owners.get(provider_id)
+                    if customer is None or provider is None:
+                        continue
+                    if customer.email:
+                        customers.setdefault(customer.email, (customer.username, []))[1].append(provider.name)
+                    if provider.user.email:
+                        owner = provider.user
+                        providers.setdefault(owner.email, (owner.username, []))[1].append(customer.username)
+        return customers, providers
+
+    def claim(self, messages):
+        """Insert claims for every message; return the keys this run now owns."""
+        run_id = uuid.uuid4().hex
+        ReminderDispatch.objects.bulk_create(
+            [ReminderDispatch(key=k, run_id=run_id, recipient=m.to[0]) for k, m in messages.items()],
+            ignore_conflicts=True,
+            batch_size=500,
+        )
+        owned = set(ReminderDispatch.objects.filter(run_id=run_id).values_list("key", flat=True))
+        return [k for k in messages if k in owned]
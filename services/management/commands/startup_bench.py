@@ -0,0 +1,74 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported or cached.
+PROBE = r"""
+import json, sys, time
+from wsgiref.util import setup_testing_defaults
+
+started = time.perf_counter()
+from ecoconnect.wsgi import application
+imported = time.perf_counter()
+
+warmup = 0.0
+if sys.argv[2] == "1":
+    from services.warmup import warm_up
+    warm_up()
+    warmup = time.perf_counter() - imported
+
+def request(path):
+    environ = {}
+    setup_testing_defaults(environ)
+    environ["PATH_INFO"] = path
+    status = []
+    t = time.perf_counter()
+    body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    b"".join(body)
+    return status[0], time.perf_counter() - t
+
+first_status, first = request(sys.argv[1])
+_, second = request(sys.argv[1])
+print(json.dumps({
+    "import": imported - started,
+    "warmup": warmup,
+    "first_response": first,
+    "second_response": second,
+    "status": first_status,
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure Django import time and time to first response in fresh processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/", help="URL path to request (default: /)")
+        parser.add_argument("--runs", type=int, default=3, help="Number of fresh processes to sample")
+        parser.add_argument("--warmup", action="store_true", help="Run services.warmup before the first request")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "ecoconnect.settings"))
+        samples = []
+        for _ in range(options["runs"]):
+            started = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, "-c", PROBE, options["path"], "1" if options["warmup"] else "0"],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(f"Probe process failed:\n{proc.stderr}")
+            sample = json.loads(proc.stdout.strip().splitlines()[-1])
+            sample["process_total"] = time.perf_counter() - started
+            samples.append(sample)
+
+        self.stdout.write(f"{options['runs']} run(s) of {options['path']} (status {samples[0]['status']})")
+        for key in ["import", "warmup", "first_response", "second_response", "process_total"]:
+            values = [s[key] * 1000 for s in samples]
+            self.stdout.write(f"  {key:<16} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from services.analytics import update_dirty_days
+
+
+class Command(BaseCommand):
+    help = "Recompute demand rollups for days changed since the last run (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Dirty marks consumed per batch")
+
+    def handle(self, *args, **options):
+        marks = days = 0
+        while True:
+            consumed, recomputed = update_dirty_days(options["batch_size"])
+            if not consumed:
+                break
+            marks += consumed
+            days += recomputed
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {days} day(s) from {marks} change mark(s)."))
@@ -0,0 +1,327 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and fixed-bucket histograms are plain dictionaries guarded by
+one lock, so recording a value costs a dictionary update. Under gunicorn each
+worker has its own registry; when ``settings.METRICS_MULTIPROC_DIR`` is set,
+every process periodically writes a snapshot to ``<dir>/<pid>-<start>.json``
+and the ``/metrics/`` endpoint merges all snapshots. The start time keeps a
+recycled worker whose pid is reused from overwriting its predecessor's
+totals. Counters and histograms of exited workers are kept (they are
+cumulative): the next collection folds them into ``archive.json`` and removes
+their files. Their gauges are dropped.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0  # seconds between snapshot writes in multiprocess mode
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_SNAPSHOT_NAME = re.compile(r"^(\d+)-(\d+)$")
+ARCHIVE = "archive.json"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        REGISTRY.maybe_flush()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+        REGISTRY.maybe_flush()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        REGISTRY.maybe_flush()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            # [per-bucket counts..., +Inf count, sum]; made cumulative only on export.
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+        REGISTRY.maybe_flush()
+
+
+def _merge_into(merged, metrics, snapshot, gauges=True):
+    for name, series in snapshot.items():
+        metric = metrics.get(name)
+        if metric is None or (metric.kind == "gauge" and not gauges):
+            continue
+        target = merged.setdefault(name, {})
+        for key, value in series:
+            key = tuple(key)
+            if metric.kind == "histogram":
+                current = target.setdefault(key, [0] * len(value))
+                target[key] = [a + b for a, b in zip(current, value)]
+            else:
+                target[key] = target.get(key, 0) + value
+
+
+def _as_snapshot(merged):
+    return {name: [[list(k), v] for k, v in series.items()] for name, series in merged.items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._next_flush = 0.0
+        self._pid = None
+        self._started = None
+
+    def identity(self):
+        """``<pid>-<start>`` of this process, renewed (with the values reset) in a forked child."""
+        pid = os.getpid()
+        if pid != self._pid:
+            with _lock:
+                if self._pid is not None:
+                    # Forked from a process that reports its own values.
+                    for metric in self.metrics.values():
+                        metric.values.clear()
+                self._pid, self._started = pid, time.time_ns()
+        return f"{self._pid}-{self._started}"
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    @staticmethod
+    def directory():
+        path = getattr(settings, "METRICS_MULTIPROC_DIR", None)
+        return Path(path) if path else None
+
+    def snapshot(self):
+        with _lock:
+            return {
+                name: [[list(k), v if not isinstance(v, list) else list(v)] for k, v in m.values.items()]
+                for name, m in self.metrics.items()
+            }
+
+    def maybe_flush(self):
+        now = time.monotonic()
+        if now < self._next_flush:
+            return
+        self._next_flush = now + FLUSH_INTERVAL
+        self.flush()
+
+    def flush(self):
+        directory = self.directory()
+        if directory is None:
+            return
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            identity = self.identity()
+            tmp = directory / f".{identity}.json.tmp"
+            tmp.write_text(json.dumps(self.snapshot()))
+            os.replace(tmp, directory / f"{identity}.json")
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot: {e}")
+
+    def _snapshot_files(self, directory):
+        """``{path: alive}`` for every other process's snapshot file."""
+        found = {}
+        for path in directory.glob("*.json"):
+            match = _SNAPSHOT_NAME.match(path.stem)
+            if match and path.stem != self.identity():
+                found[path] = (int(match[1]), int(match[2]))
+        # Of several files with one pid, only the newest can belong to a running process.
+        newest = {}
+        for pid, started in found.values():
+            newest[pid] = max(started, newest.get(pid, 0))
+        return {
+            # A file with this process's pid but another start is from a predecessor.
+            path: started == newest[pid] and pid != os.getpid() and _pid_alive(pid)
+            for path, (pid, started) in found.items()
+        }
+
+    def _fold_exited(self, directory, files):
+        """Add exited processes' snapshots to the archive and remove their files."""
+        exited = [path for path, alive in files.items() if not alive]
+        if not exited:
+            return
+        # One folder at a time, or two collections could archive the same file twice.
+        with open(directory / ".archive.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = {}
+            try:
+                _merge_into(archive, self.metrics, json.loads((directory / ARCHIVE).read_text()))
+            except FileNotFoundError:
+                pass
+            folded = []
+            for path in exited:
+                try:
+                    _merge_into(archive, self.metrics, json.loads(path.read_text()), gauges=False)
+                except FileNotFoundError:
+                    continue  # folded by another process while we waited for the lock
+                except (OSError, ValueError):
+                    continue
+                folded.append(path)
+            tmp = directory / f".{ARCHIVE}.tmp"
+            tmp.write_text(json.dumps(_as_snapshot(archive)))
+            os.replace(tmp, directory / ARCHIVE)
+            for path in folded:
+                path.unlink(missing_ok=True)
+
+    def _snapshots(self):
+        """This process's live values, the archive of exited processes and every live process's last snapshot."""
+        yield True, self.snapshot()
+        directory = self.directory()
+        if directory is None or not directory.is_dir():
+            return
+        try:
+            self._fold_exited(directory, self._snapshot_files(directory))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to archive metrics of exited workers: {e}")
+        for path, alive in self._snapshot_files(directory).items():
+            try:
+                yield alive, json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+        try:
+            yield False, json.loads((directory / ARCHIVE).read_text())
+        except (OSError, ValueError):
+            pass
+
+    def collect(self):
+        """Merge snapshots into ``{name: {labels: value}}``."""
+        merged = {name: {} for name in self.metrics}
+        for alive, snapshot in self._snapshots():
+            _merge_into(merged, self.metrics, snapshot, gauges=alive)
+        return merged
+
+    def exposition(self):
+        lines = []
+        for name, series in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(series.items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+# ---------- Application metrics ----------
+
+REQUEST_LATENCY = Histogram(
+    "ecoconnect_http_request_duration_seconds", "Request latency by URL name.", ["view", "method"]
+)
+REQUESTS = Counter("ecoconnect_http_requests_total", "Responses by URL name and status code.", ["view", "status"])
+DB_QUERIES = Counter("ecoconnect_db_queries_total", "Database queries executed, by URL name.", ["view"])
+BOOKINGS = Counter(
+    "ecoconnect_bookings_total", "Booking attempts by outcome (success, conflict, invalid, failure).", ["outcome"]
+)
+EMAILS = Counter("ecoconnect_emails_sent_total", "Notification emails handed to the mail backend.", ["kind"])
+EMAIL_QUEUE_DEPTH = Gauge("ecoconnect_email_queue_depth", "Notification emails waiting to be sent.")
+CACHE_REQUESTS = Counter(
+    "ecoconnect_cache_requests_total", "Read-through cache lookups by result (hit, stale, miss).", ["result"]
+)
+
+
+class MetricsMiddleware:
+    """Record latency, status and query count for every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connections["default"].execute_wrapper(count):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unresolved"
+        REQUEST_LATENCY.observe(elapsed, view=view, method=request.method)
+        REQUESTS.inc(view=view, status=response.status_code)
+        if queries[0]:
+            DB_QUERIES.inc(queries[0], view=view)
+        return response
+
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-19 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0004_auto_20250812_1509'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='provideravailability',
+            index=models.Index(fields=['date', 'provider'], name='avail_date_provider_idx'),
+        ),
+    ]
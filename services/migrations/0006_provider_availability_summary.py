@@ -0,0 +1,51 @@
+# Generated by Django 5.0.6 on 2026-10-19 05:01
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def backfill_summary(apps, schema_editor):
+    ServiceProvider = apps.get_model("services", "ServiceProvider")
+    ProviderAvailability = apps.get_model("services", "ProviderAvailability")
+    Booking = apps.get_model("services", "Booking")
+    alias = schema_editor.connection.alias
+    open_dates = ProviderAvailability.objects.filter(
+        provider=OuterRef("pk"), date__gte=timezone.now().date()
+    ).exclude(
+        Exists(Booking.objects.filter(provider=OuterRef("provider"), booking_date=OuterRef("date")))
+    )
+    ServiceProvider.objects.using(alias).update(
+        next_free_date=Subquery(open_dates.order_by("date").values("date")[:1]),
+        open_slot_count=Coalesce(
+            Subquery(open_dates.order_by().values("provider").annotate(n=Count("pk")).values("n")), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_availability_date_provider_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceprovider',
+            name='next_free_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='serviceprovider',
+            name='open_slot_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='serviceprovider',
+            index=models.Index(fields=['next_free_date', '-created_at'], name='provider_next_free_idx'),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
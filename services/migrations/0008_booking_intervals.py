@@ -0,0 +1,108 @@
+from datetime import datetime, time, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_intervals(apps, schema_editor):
+    """Existing bookings were whole-day bookings; give them the matching interval."""
+    Booking = apps.get_model("services", "Booking")
+    bookings = Booking.objects.using(schema_editor.connection.alias)
+    batch = []
+    for booking in bookings.only("id", "booking_date").iterator(chunk_size=2000):
+        start = timezone.make_aware(datetime.combine(booking.booking_date, time.min))
+        booking.starts_at = start
+        booking.ends_at = start + timedelta(days=1)
+        booking.end_date = booking.booking_date
+        batch.append(booking)
+        if len(batch) >= 2000:
+            bookings.bulk_update(batch, ["starts_at", "ends_at", "end_date"])
+            batch = []
+    bookings.bulk_update(batch, ["starts_at", "ends_at", "end_date"])
+
+
+EXCLUSION_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "ALTER TABLE services_booking ADD CONSTRAINT booking_no_overlap "
+    "EXCLUDE USING gist (provider_id WITH =, tstzrange(starts_at, ends_at, '[)') WITH &&)",
+]
+
+
+def add_exclusion_constraint(apps, schema_editor):
+    # PostgreSQL enforces non-overlap itself; other backends rely on the check in Booking.save().
+    if schema_editor.connection.vendor == "postgresql":
+        for sql in EXCLUSION_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("ALTER TABLE services_booking DROP CONSTRAINT IF EXISTS booking_no_overlap")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0007_booking_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provideravailability',
+            name='start_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='provideravailability',
+            name='end_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='starts_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='ends_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='end_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(backfill_intervals, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='booking',
+            name='starts_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='ends_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='end_date',
+            field=models.DateField(),
+        ),
+        migrations.RemoveConstraint(
+            model_name='booking',
+            name='uniq_provider_booking_date',
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.CheckConstraint(check=models.Q(('ends_at__gt', models.F('starts_at'))), name='booking_ends_after_start'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['provider', 'starts_at'], name='booking_provider_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['provider', 'booking_date', 'end_date'], name='booking_provider_days_idx'),
+        ),
+        migrations.RunPython(add_exclusion_constraint, drop_exclusion_constraint),
+    ]
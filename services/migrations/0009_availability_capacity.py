@@ -0,0 +1,85 @@
+# Generated by Django 5.0.6 on 2026-10-19 05:11
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_capacity(apps, schema_editor):
+    """Days that already hold several (timed) bookings keep them; booked days start full."""
+    Booking = apps.get_model("services", "Booking")
+    ProviderAvailability = apps.get_model("services", "ProviderAvailability")
+    booked = (
+        Booking.objects.filter(
+            provider=OuterRef("provider"), booking_date__lte=OuterRef("date"), end_date__gte=OuterRef("date")
+        )
+        .order_by()
+        .values("provider")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    days = ProviderAvailability.objects.using(schema_editor.connection.alias)
+    days.update(capacity=Greatest(Coalesce(Subquery(booked), 0), 1))
+    days.update(
+        remaining=Greatest(F("capacity") - Coalesce(Subquery(booked), 0), 0)
+    )
+
+
+def swap_exclusion_constraint(apps, schema_editor):
+    # Overlap is now forbidden per crew rather than per provider.
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("ALTER TABLE services_booking DROP CONSTRAINT IF EXISTS booking_no_overlap")
+        schema_editor.execute(
+            "ALTER TABLE services_booking ADD CONSTRAINT booking_no_overlap "
+            "EXCLUDE USING gist (provider_id WITH =, crew WITH =, tstzrange(starts_at, ends_at, '[)') WITH &&)"
+        )
+
+
+def restore_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("ALTER TABLE services_booking DROP CONSTRAINT IF EXISTS booking_no_overlap")
+        schema_editor.execute(
+            "ALTER TABLE services_booking ADD CONSTRAINT booking_no_overlap "
+            "EXCLUDE USING gist (provider_id WITH =, tstzrange(starts_at, ends_at, '[)') WITH &&)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0008_booking_intervals'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_provider_start_idx',
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='crew',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='provideravailability',
+            name='capacity',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='provideravailability',
+            name='crews',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='provideravailability',
+            name='remaining',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['provider', 'crew', 'starts_at'], name='booking_crew_start_idx'),
+        ),
+        migrations.RunPython(backfill_capacity, migrations.RunPython.noop),
+        migrations.RunPython(swap_exclusion_constraint, restore_exclusion_constraint),
+    ]
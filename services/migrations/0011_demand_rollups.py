@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-19 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0010_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('service_type', models.CharField(max_length=50)),
+                ('location', models.CharField(max_length=100)),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('offered', models.PositiveIntegerField(default=0)),
+                ('filled', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupDirtyDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='demandrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'service_type', 'location'), name='uniq_demand_rollup'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# SQLite: an external-content FTS5 index over the provider table, kept in sync by triggers
+# (so bulk_create/update stay indexed too). Rows are stored once; FTS5 keeps only the index.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE services_provider_fts USING fts5("
+    "name, bio, price_note, content='services_serviceprovider', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    "CREATE TRIGGER services_provider_fts_ai AFTER INSERT ON services_serviceprovider BEGIN "
+    "INSERT INTO services_provider_fts(rowid, name, bio, price_note) "
+    "VALUES (new.id, new.name, new.bio, new.price_note); END",
+    "CREATE TRIGGER services_provider_fts_ad AFTER DELETE ON services_serviceprovider BEGIN "
+    "INSERT INTO services_provider_fts(services_provider_fts, rowid, name, bio, price_note) "
+    "VALUES ('delete', old.id, old.name, old.bio, old.price_note); END",
+    "CREATE TRIGGER services_provider_fts_au AFTER UPDATE OF name, bio, price_note ON services_serviceprovider BEGIN "
+    "INSERT INTO services_provider_fts(services_provider_fts, rowid, name, bio, price_note) "
+    "VALUES ('delete', old.id, old.name, old.bio, old.price_note); "
+    "INSERT INTO services_provider_fts(rowid, name, bio, price_note) "
+    "VALUES (new.id, new.name, new.bio, new.price_note); END",
+    "INSERT INTO services_provider_fts(services_provider_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS services_provider_fts_au",
+    "DROP TRIGGER IF EXISTS services_provider_fts_ad",
+    "DROP TRIGGER IF EXISTS services_provider_fts_ai",
+    "DROP TABLE IF EXISTS services_provider_fts",
+]
+
+# PostgreSQL: a weighted tsvector the database recomputes on every write, with a GIN index.
+POSTGRES_FORWARD = [
+    "ALTER TABLE services_serviceprovider ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(bio, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(price_note, '')), 'C')) STORED",
+    "CREATE INDEX provider_search_vector_idx ON services_serviceprovider USING gin (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS provider_search_vector_idx",
+    "ALTER TABLE services_serviceprovider DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0012_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            _run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-19 05:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0013_provider_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('booked', 'Booked'), ('cancelled', 'Cancelled'), ('availability_added', 'Availability added'), ('availability_removed', 'Availability removed')], max_length=32)),
+                ('provider_id', models.PositiveIntegerField(db_index=True)),
+                ('booking_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('customer_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('date', models.DateField()),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('recorded_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-19 05:47
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+search_index = import_module("services.migrations.0013_provider_search_index")
+
+
+def restore_search_triggers(apps, schema_editor):
+    # SQLite adds this column by rebuilding the provider table, which drops its FTS triggers.
+    if schema_editor.connection.vendor == "sqlite":
+        for sql in search_index.SQLITE_BACKWARD[:3] + search_index.SQLITE_FORWARD[1:]:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0014_booking_event_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='serviceprovider',
+            name='shard',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='booking',
+            name='customer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='provider',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='services.serviceprovider'),
+        ),
+        migrations.AlterField(
+            model_name='provideravailability',
+            name='provider',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='services.serviceprovider'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-19 05:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0015_region_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('provider', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='services.serviceprovider')),
+            ],
+            options={
+                'ordering': ('id',),
+                'indexes': [models.Index(fields=['provider', 'date', 'id'], name='waitlist_queue_idx'), models.Index(fields=['customer', 'date'], name='waitlist_customer_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistentry',
+            constraint=models.UniqueConstraint(fields=('provider', 'date', 'customer'), name='uniq_waitlist_entry'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-19 06:18
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0016_booking_waitlist'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='provideravailability',
+            name='capacity',
+            field=models.PositiveSmallIntegerField(blank=True, default=None, help_text='Leave blank for one booking per crew, or per crew and hour of a timed window.', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-19 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0018_outbound_email'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='provideravailability',
+            name='avail_date_provider_idx',
+        ),
+        migrations.AddIndex(
+            model_name='provideravailability',
+            index=models.Index(condition=models.Q(('remaining__gt', 0)), fields=['date', 'provider'], name='avail_open_date_provider_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-19 06:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_stamp(apps, schema_editor):
+    DirectoryStamp = apps.get_model("services", "DirectoryStamp")
+    DirectoryStamp.objects.using(schema_editor.connection.alias).get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0019_open_availability_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryStamp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deletions', models.PositiveBigIntegerField(default=0)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='serviceprovider',
+            index=models.Index(fields=['updated_at'], name='provider_updated_idx'),
+        ),
+        migrations.RunPython(create_stamp, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.6 on 2026-10-19 06:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+
+class AlterFieldOutsideShards(migrations.AlterField):
+    """Restore the foreign key constraints dropped in 0015, in ``default`` only.
+
+    Every other database is a schedule shard (see ``services.sharding``), whose
+    rows reference users and providers that live in ``default``.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0020_directory_stamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AlterFieldOutsideShards(
+            model_name='booking',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterFieldOutsideShards(
+            model_name='booking',
+            name='provider',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='services.serviceprovider'),
+        ),
+        AlterFieldOutsideShards(
+            model_name='provideravailability',
+            name='provider',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='services.serviceprovider'),
+        ),
+        AlterFieldOutsideShards(
+            model_name='waitlistentry',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterFieldOutsideShards(
+            model_name='waitlistentry',
+            name='provider',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='services.serviceprovider'),
+        ),
+    ]
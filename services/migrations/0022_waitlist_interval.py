@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0021_schedule_constraints_off_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:10
+
+from django.db import migrations
+from django.db.models import Max
+
+
+def start_version(apps, schema_editor):
+    DirectoryStamp = apps.get_model("services", "DirectoryStamp")
+    ServiceProvider = apps.get_model("services", "ServiceProvider")
+    alias = schema_editor.connection.alias
+    stamp, _ = DirectoryStamp.objects.using(alias).get_or_create(pk=1)
+    changed = ServiceProvider.objects.using(alias).aggregate(changed=Max("updated_at"))["changed"]
+    # A new version, so snapshots and ETags from the old scheme are never taken as current.
+    stamp.version += 1
+    stamp.changed_at = max(filter(None, (stamp.changed_at, changed)), default=None)
+    stamp.save(using=alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0022_waitlist_interval'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='directorystamp',
+            old_name='deletions',
+            new_name='version',
+        ),
+        migrations.RenameField(
+            model_name='directorystamp',
+            old_name='deleted_at',
+            new_name='changed_at',
+        ),
+        migrations.RemoveIndex(
+            model_name='serviceprovider',
+            name='provider_updated_idx',
+        ),
+        migrations.RunPython(start_version, migrations.RunPython.noop),
+    ]
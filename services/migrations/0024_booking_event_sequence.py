@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:44
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_events(apps, schema_editor):
+    BookingEvent = apps.get_model("services", "BookingEvent")
+    BookingEventSequence = apps.get_model("services", "BookingEventSequence")
+    alias = schema_editor.connection.alias
+    # Sequence = id, so cursors consumers saved from the id-ordered feed stay valid.
+    BookingEvent.objects.using(alias).update(sequence=F("id"))
+    last = BookingEvent.objects.using(alias).aggregate(last=Max("id"))["last"] or 0
+    BookingEventSequence.objects.using(alias).create(pk=1, last=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0023_directory_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingEventSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bookingevent',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_events, migrations.RunPython.noop),
+    ]
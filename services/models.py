@@ -1,17 +1,59 @@
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
 from django.contrib.auth.models import User
-from django.core.validators import FileExtensionValidator
+from django.core.validators import FileExtensionValidator, MinValueValidator
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Coalesce, Greatest
+from datetime import date
 import os
 
+from . import sharding
+
 def validate_file_size(value):
     """Validate that uploaded files are not too large (max 5MB)"""
     filesize = value.size
     if filesize > 5 * 1024 * 1024:  # 5MB
         raise ValidationError("File size cannot exceed 5MB.")
 
+class ServiceProviderQuerySet(models.QuerySet):
+    def refresh_availability_summary(self, today=None):
+        """Recompute ``next_free_date``/``open_slot_count`` for these providers; return how many changed.
+
+        One UPDATE that only writes providers whose summary moved. Most bookings
+        leave their date open, so they touch neither the provider row nor the
+        directory's version (``DirectoryStamp``), which is bumped in the same
+        transaction only when something did change.
+        """
+        today = today or timezone.now().date()
+        if sharding.is_enabled():
+            # Schedules live on other databases, so correlated subqueries can't reach them.
+            changed = sharding.refresh_summaries(self, today)
+        else:
+            open_dates = ProviderAvailability.objects.open().filter(
+                provider=models.OuterRef("pk"), date__gte=today
+            )
+            next_free = models.Subquery(open_dates.order_by("date").values("date")[:1])
+            open_slots = Coalesce(
+                models.Subquery(
+                    open_dates.order_by().values("provider").annotate(n=models.Count("pk")).values("n")
+                ),
+                0,
+            )
+            # A sentinel for "no date", so a date going to or from NULL counts as a change.
+            no_date = models.Value(date.min)
+            stale = self.alias(
+                current_next=Coalesce("next_free_date", no_date), fresh_next=Coalesce(next_free, no_date),
+                fresh_slots=open_slots,
+            ).filter(~models.Q(current_next=models.F("fresh_next")) | ~models.Q(open_slot_count=models.F("fresh_slots")))
+            changed = stale.update(updated_at=timezone.now(), next_free_date=next_free, open_slot_count=open_slots)
+        if changed:
+            DirectoryStamp.bump(self._db or router.db_for_write(self.model))
+        return changed
+
 class ServiceProvider(models.Model):
+    # Denormalized from availability and bookings; only written by refresh_availability_summary().
+    SUMMARY_FIELDS = ("next_free_date", "open_slot_count")
+
     SERVICE_TYPES = [
         ("solar", "Solar Installation"),
         ("insulation", "Home Insulation"),
@@ -36,6 +78,12 @@ class ServiceProvider(models.Model):
     price_note = models.CharField(max_length=120, blank=True, default="")
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
+    next_free_date = models.DateField(null=True, blank=True, editable=False)
+    open_slot_count = models.PositiveIntegerField(default=0, editable=False)
+    # Database alias holding this provider's schedule, pinned at creation ("" = default; see services.sharding).
+    shard = models.CharField(max_length=50, blank=True, default="", editable=False)
+
+    objects = ServiceProviderQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.name} - {self.service_type}"
@@ -43,42 +91,431 @@ class ServiceProvider(models.Model):
     def save(self, *args, **kwargs):
         if not self.created_at:
             self.created_at = timezone.now()
+        if self._state.adding and not self.shard:
+            self.shard = sharding.shard_for_location(self.location)
+        if not self._state.adding and not kwargs.get("update_fields"):
+            # Never write back a stale in-memory copy of the maintained summary.
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.SUMMARY_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # "Available soonest" ordering and the "has open dates" filter.
+            models.Index(fields=["next_free_date", "-created_at"], name="provider_next_free_idx"),
+            # Default "newest first" directory listing, unfiltered and by service type.
+            models.Index(fields=["-created_at"], name="provider_created_idx"),
+            models.Index(fields=["service_type", "-created_at"], name="provider_type_created_idx"),
+        ]
+
+class DirectoryStamp(models.Model):
+    """A single row versioning the provider directory (see ``services.httpcache``).
+
+    Every write that changes what the directory lists bumps it in the same
+    transaction, so readers learn whether anything changed from one
+    primary-key lookup. Schedule writes only bump it when a provider's
+    summary moves (see ``refresh_availability_summary``).
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def bump(cls, using=None):
+        now = timezone.now()
+        stamp = cls.objects.using(using).filter(pk=1)
+        if not stamp.update(version=models.F("version") + 1, changed_at=now):
+            _, created = cls.objects.using(using).get_or_create(pk=1, defaults={"version": 1, "changed_at": now})
+            if not created:
+                stamp.update(version=models.F("version") + 1, changed_at=now)
+
+class ScheduleQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # A plain queryset has no row to route by, so send new rows to their provider's shard here.
+        provider = kwargs.get("provider", kwargs.get("provider_id"))
+        if self._db is None and provider is not None and sharding.is_enabled():
+            return self.using(sharding.shard_for(provider)).create(**kwargs)
+        return super().create(**kwargs)
+
+class ProviderAvailabilityQuerySet(ScheduleQuerySet):
+    def open(self):
+        """Availability dates with capacity left for at least one more booking."""
+        return self.filter(remaining__gt=0)
+
+    @staticmethod
+    def _expected_remaining():
+        booked = (
+            Booking.objects.filter(
+                provider=models.OuterRef("provider"),
+                booking_date__lte=models.OuterRef("date"),
+                end_date__gte=models.OuterRef("date"),
+            )
+            .order_by()
+            .values("provider")
+            .annotate(n=models.Count("pk"))
+            .values("n")
+        )
+        return Greatest(models.F("capacity") - Coalesce(models.Subquery(booked), 0), 0)
+
+    def with_expected_remaining(self):
+        """Annotate ``expected_remaining``: capacity minus the bookings touching each date."""
+        return self.annotate(expected_remaining=self._expected_remaining())
+
+    def recount_remaining(self):
+        """Reset ``remaining`` from the bookings in one UPDATE."""
+        return self.update(remaining=self._expected_remaining())
+
+    def between(self, start, end):
+        return self.filter(date__gte=start, date__lte=end)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .scheduling import default_capacity
+
+        objs = list(objs)
+        for obj in objs:
+            # What save() would derive; a new row's counter starts full.
+            if obj.capacity is None:
+                obj.capacity = obj.remaining = default_capacity(obj.crews, obj.start_time, obj.end_time)
+        return super().bulk_create(objs, *args, **kwargs)
 
 class ProviderAvailability(models.Model):
-    """Specific dates a provider is available to take bookings."""
+    """Specific dates a provider is available to take bookings.
+
+    ``start_time``/``end_time`` narrow the date to a working window; leaving
+    them empty makes the whole day available.
+
+    ``capacity`` is how many bookings the provider takes on the date and
+    ``crews`` how many of them may run at the same time; left blank, it is
+    derived from the window (see ``scheduling.default_capacity``).
+    ``remaining`` is a counter claimed by ``Booking.save()`` with a
+    conditional decrement and given back when a booking is deleted.
+    """
+    # Only written by the booking primitive and recount_remaining().
+    COUNTER_FIELDS = ("remaining",)
+
+    # Constrained in ``default`` only: a shard's rows reference providers in ``default`` (migration 0021).
     provider = models.ForeignKey(ServiceProvider, on_delete=models.CASCADE, related_name="availability")
     date = models.DateField(db_index=True)
+    start_time = models.TimeField(null=True, blank=True)
+    end_time = models.TimeField(null=True, blank=True)
+    capacity = models.PositiveSmallIntegerField(
+        default=None, blank=True, validators=[MinValueValidator(1)],
+        help_text="Leave blank for one booking per crew, or per crew and hour of a timed window.",
+    )
+    crews = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)])
+    remaining = models.PositiveSmallIntegerField(default=1, editable=False)
+
+    objects = ProviderAvailabilityQuerySet.as_manager()
 
     class Meta:
         unique_together = ("provider", "date")
         ordering = ("date",)
+        indexes = [
+            # Cross-provider "who is free in this range" lookups read only this index.
+            models.Index(
+                fields=["date", "provider"], name="avail_open_date_provider_idx", condition=models.Q(remaining__gt=0)
+            ),
+        ]
+
+    def clean(self):
+        if self.start_time and self.end_time and self.end_time <= self.start_time:
+            raise ValidationError("The end time must be after the start time.")
+
+    def save(self, *args, **kwargs):
+        from .scheduling import default_capacity
+
+        adding = self._state.adding
+        if self.capacity is None:
+            self.capacity = default_capacity(self.crews, self.start_time, self.end_time)
+        if adding:
+            self.remaining = self.capacity
+        elif not kwargs.get("update_fields"):
+            # The in-memory counter may be stale; recount it from the bookings instead.
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
+        using = kwargs.get("using") or router.db_for_write(ProviderAvailability, instance=self)
+        # One transaction, so the post_save receivers (summary, event log) commit with the row.
+        with transaction.atomic(using=using), sharding.use_shard(using):
+            super().save(*args, **kwargs)
+            if not adding:
+                ProviderAvailability.objects.using(using).filter(pk=self.pk).recount_remaining()
+
+    @property
+    def booked(self):
+        return self.capacity - self.remaining
 
     def __str__(self):
         return f"{self.provider.name} available on {self.date}"
 
 class Booking(models.Model):
+    """A provider booked for ``[starts_at, ends_at)``.
+
+    ``booking_date`` and ``end_date`` are the first and last calendar days the
+    interval touches. They are derived on save and used by day-based queries.
+    A booking created with only ``booking_date`` covers that day's whole
+    availability window (see ``services.scheduling``).
+
+    Creating a booking claims one unit of ``ProviderAvailability.remaining``
+    on every day it touches and assigns it to a ``crew`` that is free for the
+    whole interval; deleting it gives the capacity back.
+    """
+    # Constrained in ``default`` only: a shard's rows reference users and providers in ``default`` (migration 0021).
     customer = models.ForeignKey(User, on_delete=models.CASCADE)
     provider = models.ForeignKey(ServiceProvider, on_delete=models.CASCADE)
     booking_date = models.DateField()
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    end_date = models.DateField()
+    crew = models.PositiveSmallIntegerField(default=0)
+
+    objects = ScheduleQuerySet.as_manager()
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(
-                fields=["provider", "booking_date"], name="uniq_provider_booking_date"
-            )
+            models.CheckConstraint(check=models.Q(ends_at__gt=models.F("starts_at")), name="booking_ends_after_start"),
         ]
         ordering = ("-booking_date",)
+        indexes = [
+            # Date-window scans (reminders, reports) walk booking_date then id as a keyset.
+            models.Index(fields=["booking_date", "id"], name="booking_date_id_idx"),
+            # Overlap checks: latest booking of a provider's crew starting before a given instant.
+            models.Index(fields=["provider", "crew", "starts_at"], name="booking_crew_start_idx"),
+            # "Is this provider booked on day D" (booking_date <= D <= end_date).
+            models.Index(fields=["provider", "booking_date", "end_date"], name="booking_provider_days_idx"),
+            # A customer's booking history, newest first.
+            models.Index(fields=["customer", "-booking_date"], name="booking_customer_date_idx"),
+        ]
 
     def clean(self):
-        if self.booking_date and self.booking_date < timezone.now().date():
-            raise ValidationError("Booking date must be in the future.")
-        # Must be a date the provider is available
-        if self.booking_date and self.provider and not ProviderAvailability.objects.filter(provider=self.provider, date=self.booking_date).exists():
-            raise ValidationError("Selected date is not available for this provider.")
+        from .scheduling import interval_for_days, validate_interval
+
+        if not self.provider_id:
+            return
+        if self.starts_at is None or self.ends_at is None:
+            if not self.booking_date:
+                return
+            self.starts_at, self.ends_at = interval_for_days(self.provider_id, self.booking_date)
+        validate_interval(self.provider, self.starts_at, self.ends_at)
+
+    def save(self, *args, **kwargs):
+        from .scheduling import (
+            claim_capacity, find_overlap, free_crew, interval_for_days, last_day, release_capacity, span_days,
+        )
+
+        using = kwargs.get("using") or router.db_for_write(Booking, instance=self)
+        with transaction.atomic(using=using), sharding.use_shard(using):
+            previous = None
+            if not self._state.adding:
+                previous = Booking.objects.using(using).filter(pk=self.pk).values(
+                    "provider_id", "booking_date", "end_date", "starts_at", "ends_at"
+                ).first()
+            if (
+                previous and self.booking_date != previous["booking_date"]
+                and (self.starts_at, self.ends_at) == (previous["starts_at"], previous["ends_at"])
+            ):
+                # Only the date was edited: move the booking's whole days there.
+                final_day = self.booking_date + (previous["end_date"] - previous["booking_date"])
+                self.starts_at, self.ends_at = interval_for_days(self.provider_id, self.booking_date, final_day)
+            if self.starts_at is None or self.ends_at is None:
+                self.starts_at, self.ends_at = interval_for_days(self.provider_id, self.booking_date)
+            self.booking_date = timezone.localtime(self.starts_at).date()
+            self.end_date = last_day(self.ends_at)
+            moved = previous is not None and (
+                (previous["provider_id"], previous["starts_at"], previous["ends_at"])
+                != (self.provider_id, self.starts_at, self.ends_at)
+            )
+            self._previous_days = []
+            if moved:
+                # Give the old interval back first, so a move within the same days can reuse it.
+                self._previous_days = span_days(previous["starts_at"], previous["ends_at"])
+                release_capacity(previous["provider_id"], self._previous_days, using=using)
+            if previous is None or moved:
+                # The conditional decrement row-locks each day, so concurrent bookings
+                # of the same days queue here and pick crews one at a time.
+                days = span_days(self.starts_at, self.ends_at)
+                crews = claim_capacity(self.provider_id, days, using=using)
+                if crews is None:
+                    raise IntegrityError("The provider is fully booked on the requested dates.")
+                self.crew = free_crew(
+                    self.provider_id, self.starts_at, self.ends_at, crews, exclude_pk=self.pk, using=using
+                )
+                if self.crew is None:
+                    raise IntegrityError("Every crew of this provider is booked at that time.")
+            # Insert first, then look for a clash: the write lock taken by the insert
+            # serializes concurrent bookings on SQLite, where there is no exclusion
+            # constraint to do it for us.
+            super().save(*args, **kwargs)
+            if find_overlap(
+                self.provider_id, self.starts_at, self.ends_at, crew=self.crew, exclude_pk=self.pk, using=using
+            ):
+                raise IntegrityError("Booking overlaps an existing booking for this provider.")
 
     def __str__(self):
         return f"{self.customer.username} booked {self.provider.name} on {self.booking_date}"
+
+class WaitlistEntry(models.Model):
+    """A customer waiting for a place on a fully booked provider date (see ``services.waitlist``).
+
+    Waiters are served first come, first served, in ``id`` order within the
+    provider and date. Entries live next to the provider's bookings, so a
+    promotion commits together with the cancellation that made room.
+
+    ``starts_at``/``ends_at`` hold the interval the customer asked for, starting
+    on ``date``. When they are null, the entry is for the provider's whole window on ``date``.
+    """
+    # Constrained in ``default`` only, like ``Booking``.
+    provider = models.ForeignKey(ServiceProvider, on_delete=models.CASCADE, related_name="waitlist")
+    customer = models.ForeignKey(User, on_delete=models.CASCADE)
+    date = models.DateField()
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = ScheduleQuerySet.as_manager()
+
+    class Meta:
+        ordering = ("id",)
+        constraints = [
+            models.UniqueConstraint(fields=["provider", "date", "customer"], name="uniq_waitlist_entry"),
+        ]
+        indexes = [
+            # The queue for one date, oldest first.
+            models.Index(fields=["provider", "date", "id"], name="waitlist_queue_idx"),
+            # A customer's entries, for their booking history page.
+            models.Index(fields=["customer", "date"], name="waitlist_customer_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.customer.username} waiting for {self.provider.name} on {self.date}"
+
+class ReminderDispatch(models.Model):
+    """A reminder or digest claimed (and then sent) by ``send_reminders``.
+
+    The unique key makes reruns idempotent: a message whose key already exists
+    is never sent again, even if the earlier run died before confirming it.
+    """
+    key = models.CharField(max_length=200, unique=True)
+    run_id = models.CharField(max_length=32, db_index=True)
+    recipient = models.EmailField()
+    claimed_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.key
+
+class OutboundEmail(models.Model):
+    """An email written in the same transaction as the change it reports (see ``services.notifications``).
+
+    Rows live on the schedule database of that change, so a rollback never
+    sends them and a worker exiting before delivery doesn't lose them:
+    ``send_outbox`` picks up anything still unsent. ``claim`` marks the
+    sender working on a row, the way ``ReminderDispatch.run_id`` does.
+    """
+    kind = models.CharField(max_length=50)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    created_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True, default="")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Unsent rows, oldest first, for the retry job; sent ones by age for the sweep.
+            models.Index(fields=["sent_at", "id"], name="outbox_sent_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {', '.join(self.to)}"
+
+class IdempotencyKey(models.Model):
+    """The recorded outcome of a POST carrying an ``Idempotency-Key`` (see ``services.idempotency``).
+
+    ``status`` is null while the first request is still running.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    location = models.CharField(max_length=500, blank=True, default="")
+    messages = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+class DemandRollup(models.Model):
+    """Per day, service type and location: bookings started and capacity offered/filled.
+
+    Maintained by ``services.analytics``; reporting reads only this table.
+    """
+    day = models.DateField()
+    service_type = models.CharField(max_length=50)
+    location = models.CharField(max_length=100)
+    bookings = models.PositiveIntegerField(default=0)
+    offered = models.PositiveIntegerField(default=0)
+    filled = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "service_type", "location"], name="uniq_demand_rollup"),
+        ]
+
+    @property
+    def fill_rate(self):
+        return self.filled / self.offered if self.offered else None
+
+    def __str__(self):
+        return f"{self.day} {self.service_type} {self.location}"
+
+class RollupDirtyDay(models.Model):
+    """A day whose rollups are out of date; written on every schedule change, consumed by the rollup job."""
+    day = models.DateField()
+
+class BookingEvent(models.Model):
+    """An entry in the append-only change feed of bookings and availability (see ``services.events``).
+
+    Rows are written in the same transaction as the change. Apart from
+    ``sequence``, which is numbered after commit and is the consumers' cursor,
+    they are never updated. Providers, bookings and customers are referenced
+    by plain ids so the history outlives the rows it describes.
+    """
+    BOOKED = "booked"
+    CANCELLED = "cancelled"
+    AVAILABILITY_ADDED = "availability_added"
+    AVAILABILITY_REMOVED = "availability_removed"
+    KINDS = [
+        (BOOKED, "Booked"),
+        (CANCELLED, "Cancelled"),
+        (AVAILABILITY_ADDED, "Availability added"),
+        (AVAILABILITY_REMOVED, "Availability removed"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=32, choices=KINDS)
+    provider_id = models.PositiveIntegerField(db_index=True)
+    booking_id = models.PositiveIntegerField(null=True, blank=True)
+    customer_id = models.PositiveIntegerField(null=True, blank=True)
+    date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    recorded_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # Commit order, assigned by services.events.sequence_events(); null until then.
+    sequence = models.BigIntegerField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        ordering = ("id",)
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} provider {self.provider_id} on {self.date}"
+
+class BookingEventSequence(models.Model):
+    """The last ``BookingEvent.sequence`` handed out on this database; a single row, locked while numbering."""
+    last = models.BigIntegerField(default=0)
@@ -0,0 +1,158 @@
+"""Batched email delivery over pooled connections.
+
+``send_batch`` sends and waits. ``queue_batch`` hands the batch to a
+background thread, so a request can return before SMTP has finished.
+
+``enqueue`` is the durable variant for emails that report a schedule change:
+it writes them to the ``OutboundEmail`` outbox inside the change's
+transaction and has the background thread send them once it commits. Rows
+a worker never got to (it was recycled or crashed) are sent by
+``send_outbox``, which cron runs every few minutes.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import EMAIL_QUEUE_DEPTH, EMAILS
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# One background sender per process; batches are delivered in the order they were queued.
+_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notifications")
+
+
+def _send_chunk(kind, messages):
+    sent = []
+    # One connection per worker thread, reused for every message in its chunk.
+    try:
+        with get_connection() as connection:
+            for message in messages:
+                message.connection = connection
+                try:
+                    ok = message.send() == 1
+                except Exception as e:
+                    logger.error(f"Failed to send {kind} email to {message.to}: {e}")
+                    ok = False
+                if ok:
+                    EMAILS.inc(kind=kind)
+                EMAIL_QUEUE_DEPTH.dec()
+                sent.append(ok)
+    except Exception as e:
+        # The connection could not be opened (or broke): the rest of the chunk is failed, not lost.
+        logger.error(f"Failed to send {len(messages) - len(sent)} {kind} email(s): {e}")
+    unsent = len(messages) - len(sent)
+    if unsent:
+        EMAIL_QUEUE_DEPTH.dec(unsent)
+    return sent + [False] * unsent
+
+
+def send_batch(kind, messages, concurrency=4):
+    """Send ``messages`` using up to ``concurrency`` connections; return a sent flag per message."""
+    messages = list(messages)
+    EMAIL_QUEUE_DEPTH.inc(len(messages))
+    return _deliver(kind, messages, concurrency)
+
+
+def _deliver(kind, messages, concurrency):
+    if not messages:
+        return []
+    concurrency = max(1, min(concurrency, len(messages)))
+    # Contiguous chunks keep the returned flags in input order.
+    size = -(-len(messages) // concurrency)
+    chunks = [messages[i:i + size] for i in range(0, len(messages), size)]
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        results = pool.map(lambda chunk: _send_chunk(kind, chunk), chunks)
+        return [ok for chunk in results for ok in chunk]
+
+
+def queue_batch(kind, messages, concurrency=4):
+    """Send ``messages`` in the background; return a future resolving to the sent flags."""
+    messages = list(messages)
+    EMAIL_QUEUE_DEPTH.inc(len(messages))
+
+    def run():
+        try:
+            return _deliver(kind, messages, concurrency)
+        except Exception as e:
+            logger.error(f"Failed to send queued {kind} emails: {e}")
+            return [False] * len(messages)
+
+    return _queue.submit(run)
+
+
+def wait_for_queued():
+    """Block until every batch queued so far has been sent."""
+    _queue.submit(lambda: None).result()
+
+
+# A claim older than this is presumed to belong to a dead sender.
+CLAIM_LEASE = timedelta(minutes=10)
+MAX_ATTEMPTS = 5
+
+
+def enqueue(kind, messages, using=DEFAULT_DB_ALIAS):
+    """Write ``messages`` to the outbox in the current transaction on ``using``; send them after it commits."""
+    rows = OutboundEmail.objects.using(using).bulk_create(
+        [
+            OutboundEmail(kind=kind, subject=m.subject, body=m.body, from_email=m.from_email, to=list(m.to))
+            for m in messages
+        ],
+        batch_size=500,
+    )
+    ids = [row.pk for row in rows]
+    if ids:
+        transaction.on_commit(lambda: _queue.submit(_send_outbox_in_background, ids, using), using=using)
+    return len(ids)
+
+
+def _send_outbox_in_background(ids, using):
+    try:
+        return send_outbox(using=using, ids=ids)
+    except Exception as e:
+        logger.error(f"Failed to send outbox emails on {using}; send_outbox will retry: {e}")
+    finally:
+        # This thread outlives the request, so it must not keep a connection open.
+        connections.close_all()
+
+
+def send_outbox(using=DEFAULT_DB_ALIAS, ids=None, created_before=None, limit=500, concurrency=4):
+    """Claim and send up to ``limit`` unsent outbox emails; return ``(sent, failed)``.
+
+    ``ids`` limits it to those rows, ``created_before`` to rows written before then.
+
+    Failed emails are released for the next run, up to ``MAX_ATTEMPTS`` tries.
+    """
+    token, now = uuid.uuid4().hex, timezone.now()
+    claimable = OutboundEmail.objects.using(using).filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_LEASE),
+        sent_at__isnull=True, attempts__lt=MAX_ATTEMPTS,
+    )
+    if ids is not None:
+        claimable = claimable.filter(pk__in=ids)
+    if created_before is not None:
+        claimable = claimable.filter(created_at__lt=created_before)
+    batch = list(claimable.order_by("id").values_list("pk", flat=True)[:limit])
+    # The conditional update is the claim: a concurrent sender that got there first wins the row.
+    claimable.filter(pk__in=batch).update(claim=token, claimed_at=now)
+    by_kind = defaultdict(list)
+    for row in OutboundEmail.objects.using(using).filter(claim=token, sent_at__isnull=True).order_by("id"):
+        by_kind[row.kind].append(row)
+
+    sent, failed = [], []
+    for kind, rows in by_kind.items():
+        messages = [EmailMessage(r.subject, r.body, r.from_email, r.to) for r in rows]
+        for row, ok in zip(rows, send_batch(kind, messages, concurrency)):
+            (sent if ok else failed).append(row.pk)
+    OutboundEmail.objects.using(using).filter(pk__in=sent).update(sent_at=timezone.now())
+    OutboundEmail.objects.using(using).filter(pk__in=failed).update(
+        claim="", claimed_at=None, attempts=F("attempts") + 1
+    )
+    return len(sent), len(failed)
@@ -0,0 +1,156 @@
+"""Opt-in sampling profiler for production requests.
+
+When ``settings.PROFILING["ENABLED"]`` is false the middleware raises
+``MiddlewareNotUsed`` and is dropped from the chain entirely, so it costs
+nothing. When enabled it profiles a random ``SAMPLE_RATE`` fraction of
+requests, plus any request whose path starts with one of ``PATHS`` or whose
+``HEADER`` header carries the ``SECRET`` (the header is ignored while no
+secret is set, so clients can't make the server profile at will). Each sample
+writes a cProfile dump and a small JSON sidecar (SQL and template time, and
+the count and time of each distinct SQL statement) under ``DIR/<url name>/``,
+keeping the newest ``MAX_SAMPLES`` per view; the ``profile_report`` command
+merges them.
+"""
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 0.01,
+    "HEADER": "X-Profile",
+    "SECRET": "",
+    "PATHS": [],
+    "DIR": None,
+    "MAX_SAMPLES": 200,
+}
+
+
+def profiling_settings():
+    conf = dict(DEFAULTS, **getattr(settings, "PROFILING", {}))
+    conf["DIR"] = Path(conf["DIR"] or Path(settings.BASE_DIR) / "logs" / "profiles")
+    return conf
+
+
+# Statements that differ only in literals, IN-list length or paging are one statement.
+_LITERAL = re.compile(r"'(?:[^']|'')*'|(?<![\w\"])\d+(?:\.\d+)?(?![\w\"])")
+_IN_LIST = re.compile(r"\bIN \((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """``sql`` with literals and placeholders as ``?`` and IN lists as ``IN (...)``."""
+    sql = " ".join(sql.split()).replace("%s", "?")
+    return _IN_LIST.sub("IN (...)", _LITERAL.sub("?", sql))
+
+
+def template_seconds(stats):
+    """Cumulative time spent in ``django.template.base.Template.render`` in a pstats profile.
+
+    cProfile does not double count recursive calls, so templates rendered via
+    ``{% include %}`` inside another render are only counted once.
+    """
+    code = Template.render.__code__
+    for (filename, line, funcname), (_, _, _, cumtime, _) in stats.stats.items():
+        if filename == code.co_filename and line == code.co_firstlineno and funcname == code.co_name:
+            return cumtime
+    return 0.0
+
+
+class SamplingProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = profiling_settings()
+        if not self.conf["ENABLED"]:
+            raise MiddlewareNotUsed()
+        self.header = "HTTP_" + self.conf["HEADER"].upper().replace("-", "_")
+
+    def should_profile(self, request):
+        secret = self.conf["SECRET"]
+        if secret and hmac.compare_digest(request.META.get(self.header, ""), secret):
+            return True
+        if any(request.path.startswith(p) for p in self.conf["PATHS"]):
+            return True
+        return random.random() < self.conf["SAMPLE_RATE"]
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sql = {"count": 0, "seconds": 0.0, "statements": {}}
+
+        def time_sql(execute, query, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(query, params, many, context)
+            finally:
+                seconds = time.perf_counter() - started
+                sql["count"] += 1
+                sql["seconds"] += seconds
+                statement = sql["statements"].setdefault(normalize_sql(query), [0, 0.0])
+                statement[0] += 1
+                statement[1] += seconds
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(time_sql))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        try:
+            self._write(request, profiler, elapsed, sql)
+        except OSError as e:
+            logger.error(f"Failed to write request profile: {e}")
+        return response
+
+    def _write(self, request, profiler, elapsed, sql):
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unresolved"
+        directory = self.conf["DIR"] / view
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        profiler.dump_stats(directory / f"{stem}.prof")
+        stats = pstats.Stats(profiler)
+        meta = {
+            "view": view,
+            "path": request.path,
+            "method": request.method,
+            "seconds": elapsed,
+            "sql_count": sql["count"],
+            "sql_seconds": sql["seconds"],
+            # {normalized SQL: [count, seconds]}
+            "statements": sql["statements"],
+            "template_seconds": template_seconds(stats),
+        }
+        (directory / f"{stem}.json").write_text(json.dumps(meta))
+        self._prune(directory)
+
+    def _prune(self, directory):
+        # Stems start with the timestamp, so name order is age order.
+        samples = sorted(directory.glob("*.json"))
+        for sidecar in samples[:max(0, len(samples) - self.conf["MAX_SAMPLES"])]:
+            sidecar.with_suffix(".prof").unlink(missing_ok=True)
+            sidecar.unlink(missing_ok=True)
+
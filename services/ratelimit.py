@@ -0,0 +1,149 @@
+"""Admission control for the expensive POST endpoints.
+
+``rate_limit`` applies token buckets (per user, per client IP and global) kept
+in the Django cache so every worker shares them; if the cache is unreachable
+the buckets fall back to this process. ``limit_concurrency`` caps how many
+requests a worker runs through a view at once. Both reject immediately with
+``Retry-After`` instead of letting requests queue until the server times out.
+"""
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_local_buckets = {}
+_local_lock = threading.Lock()
+_semaphores = {}
+
+
+def parse_rate(rate):
+    """Turn ``"20/m"`` into ``(capacity, refill_per_second)``."""
+    count, period = rate.split("/")
+    return int(count), int(count) / _PERIODS[period.strip().lower()[0]]
+
+
+def _refill(state, capacity, per_second, now):
+    tokens, updated = state if state else (capacity, now)
+    return min(capacity, tokens + (now - updated) * per_second)
+
+
+def _admit(buckets, states, now):
+    """``(rejecting key, seconds to wait)`` or ``(None, new states)`` once every bucket has a token.
+
+    Buckets are checked narrowest first and nothing is debited unless all of
+    them admit, so requests one client gets rejected for don't drain the
+    buckets it shares with everyone else.
+    """
+    refilled = {}
+    for key, capacity, per_second in buckets:
+        tokens = _refill(states.get(key), capacity, per_second, now)
+        if tokens < 1:
+            return key, (1 - tokens) / per_second
+        refilled[key] = (tokens - 1, now)
+    return None, refilled
+
+
+def _take_shared(buckets, now):
+    # get/set is not atomic across workers, so a burst can overshoot a bucket by
+    # roughly the number of workers; that is acceptable for load shedding.
+    rejected, result = _admit(buckets, cache.get_many([key for key, _, _ in buckets]), now)
+    if rejected:
+        return rejected, result
+    for key, capacity, per_second in buckets:
+        cache.set(key, result[key], math.ceil(capacity / per_second) + 1)
+    return None, 0
+
+
+def _take_local(buckets, now):
+    with _local_lock:
+        rejected, result = _admit(buckets, _local_buckets, now)
+        if rejected:
+            return rejected, result
+        _local_buckets.update(result)
+        return None, 0
+
+
+def take_tokens(limits):
+    """Consume one token from each ``(key, rate)`` bucket, or from none of them.
+
+    Returns ``(None, 0)`` when admitted, else the first bucket that is out of
+    tokens and the seconds until it has one.
+    """
+    now = time.time()
+    buckets = [(key, *parse_rate(rate)) for key, rate in limits]
+    try:
+        return _take_shared(buckets, now)
+    except Exception as e:
+        logger.warning(f"Rate limit cache unavailable, using in-process bucket: {e}")
+        return _take_local(buckets, now)
+
+
+def _client_ip(request):
+    return request.META.get("REMOTE_ADDR", "unknown")
+
+
+def _bucket_keys(scope, request):
+    # Narrowest first, so a rejection names the bucket the client actually exhausted.
+    limits = getattr(settings, "RATE_LIMITS", {}).get(scope, {})
+    if "user" in limits and request.user.is_authenticated:
+        yield f"ratelimit:{scope}:user:{request.user.pk}", limits["user"]
+    if "ip" in limits:
+        yield f"ratelimit:{scope}:ip:{_client_ip(request)}", limits["ip"]
+    if "global" in limits:
+        yield f"ratelimit:{scope}:global", limits["global"]
+
+
+def _reject(status, message, retry_after):
+    response = HttpResponse(message, status=status, content_type="text/plain")
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limit(scope, methods=("POST",)):
+    """Reject requests over the ``settings.RATE_LIMITS[scope]`` budgets with 429."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method in methods and getattr(settings, "RATELIMIT_ENABLED", True):
+                key, retry_after = take_tokens(list(_bucket_keys(scope, request)))
+                if key:
+                    logger.info(f"Rate limited {scope} on {key}")
+                    return _reject(429, "Too many requests. Please try again shortly.", retry_after)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def _semaphore(scope, limit):
+    with _local_lock:
+        if (scope, limit) not in _semaphores:
+            _semaphores[(scope, limit)] = threading.BoundedSemaphore(limit)
+        return _semaphores[(scope, limit)]
+
+
+def limit_concurrency(scope, setting_name, methods=("POST",)):
+    """Allow at most ``settings.<setting_name>`` concurrent requests per worker; 503 beyond that."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in methods:
+                return view(request, *args, **kwargs)
+            semaphore = _semaphore(scope, getattr(settings, setting_name))
+            if not semaphore.acquire(blocking=False):
+                logger.info(f"Shedding {scope}: too many requests in flight")
+                return _reject(503, "The service is busy. Please try again shortly.", 1)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                semaphore.release()
+        return wrapped
+    return decorator
@@ -0,0 +1,173 @@
+"""Booking intervals: availability windows, day-booking compatibility and overlap checks.
+
+A booking occupies ``[starts_at, ends_at)``. Day-based callers (the original
+``book_service`` flow, ``Booking.objects.create(booking_date=...)``) still work:
+a booking given only a date takes the provider's whole availability window for
+that day.
+
+Each day's ``ProviderAvailability.remaining`` counter caps how many bookings
+touch that day; ``claim_capacity`` takes one unit per day with a conditional
+``UPDATE`` and ``release_capacity`` gives it back.
+
+Within a day, ``crews`` bookings may run in parallel. Every booking belongs to
+one crew, and bookings of one crew never overlap, so checking a new interval
+only needs the single existing booking of that crew with the latest start
+before the new end. With the ``(provider, crew, starts_at)`` index that lookup
+is logarithmic in the number of bookings. On PostgreSQL an exclusion
+constraint enforces the same rule in the database as well.
+
+Every helper reads the provider's own schedule database (see
+``services.sharding``) unless ``using`` names one.
+"""
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .sharding import shard_for
+
+
+def day_bounds(day):
+    """Aware datetimes for the start of ``day`` and the start of the next day."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def window_bounds(day, start_time=None, end_time=None):
+    """Aware datetimes for an availability window on ``day`` (whole day if times are unset)."""
+    day_start, day_end = day_bounds(day)
+    start = timezone.make_aware(datetime.combine(day, start_time)) if start_time else day_start
+    end = timezone.make_aware(datetime.combine(day, end_time)) if end_time else day_end
+    return start, end
+
+
+def last_day(ends_at):
+    """The last calendar day an interval ending (exclusively) at ``ends_at`` touches."""
+    return (timezone.localtime(ends_at) - timedelta(microseconds=1)).date()
+
+
+def span_days(starts_at, ends_at):
+    """Every calendar day the interval ``[starts_at, ends_at)`` touches."""
+    first, final = timezone.localtime(starts_at).date(), last_day(ends_at)
+    return [first + timedelta(days=i) for i in range((final - first).days + 1)]
+
+
+def default_capacity(crews, start_time=None, end_time=None):
+    """Bookings a date takes when the provider leaves ``capacity`` blank.
+
+    One per crew on a whole-day window, so whole-day bookings fill it; one
+    per crew and whole hour on a timed window, so hourly slots can share it.
+    """
+    crews = crews or 1
+    if not (start_time or end_time):
+        return crews
+    start, end = window_bounds(timezone.localdate(), start_time, end_time)
+    hours = max(1, int((end - start).total_seconds()) // 3600)
+    return min(crews * hours, 32767)
+
+
+def interval_for_days(provider_id, first_day, final_day=None):
+    """Compatibility layer: the interval covering whole availability windows from ``first_day`` to ``final_day``."""
+    from .models import ProviderAvailability
+
+    final_day = final_day or first_day
+    windows = dict(
+        (row[0], row[1:])
+        for row in ProviderAvailability.objects.using(shard_for(provider_id)).filter(
+            provider_id=provider_id, date__in=[first_day, final_day]
+        ).values_list("date", "start_time", "end_time")
+    )
+    start, _ = window_bounds(first_day, *windows.get(first_day, (None, None)))
+    _, end = window_bounds(final_day, *windows.get(final_day, (None, None)))
+    return start, end
+
+
+def latest_starting_before(provider_id, ends_at, crew=0, exclude_pk=None, using=None):
+    """``(pk, ends_at)`` of the crew's bookings starting before ``ends_at``, latest first."""
+    from .models import Booking
+
+    qs = Booking.objects.using(using or shard_for(provider_id))
+    candidates = qs.filter(provider_id=provider_id, crew=crew, starts_at__lt=ends_at)
+    if exclude_pk is not None:
+        candidates = candidates.exclude(pk=exclude_pk)
+    return candidates.order_by("-starts_at").values_list("pk", "ends_at")
+
+
+def availability_on(provider, day):
+    """The provider's ``ProviderAvailability`` row for ``day``, as a queryset."""
+    from .models import ProviderAvailability
+
+    return ProviderAvailability.objects.using(shard_for(provider)).filter(provider=provider, date=day)
+
+
+def open_days_in(provider, days):
+    """The provider's open ``ProviderAvailability`` rows among ``days``."""
+    from .models import ProviderAvailability
+
+    return ProviderAvailability.objects.using(shard_for(provider)).open().filter(provider=provider, date__in=days)
+
+
+def find_overlap(provider_id, starts_at, ends_at, crew=0, exclude_pk=None, using=None):
+    """Return the pk of a booking of this provider's crew overlapping ``[starts_at, ends_at)``, if any."""
+    latest = latest_starting_before(provider_id, ends_at, crew, exclude_pk, using).first()
+    if latest and latest[1] > starts_at:
+        return latest[0]
+    return None
+
+
+def free_crew(provider_id, starts_at, ends_at, crews, exclude_pk=None, using=None):
+    """The first of ``crews`` crews with nothing booked during ``[starts_at, ends_at)``, or None."""
+    for crew in range(crews):
+        if find_overlap(provider_id, starts_at, ends_at, crew=crew, exclude_pk=exclude_pk, using=using) is None:
+            return crew
+    return None
+
+
+def claim_capacity(provider_id, days, using=None):
+    """Take one unit of capacity on each of ``days``.
+
+    Returns the number of crews available on all of them, or None when any day
+    is missing or full. Must run inside a transaction that is rolled back on
+    None, since the days that did have room were already decremented.
+    """
+    from .models import ProviderAvailability
+
+    qs = ProviderAvailability.objects.using(using or shard_for(provider_id))
+    rows = qs.filter(provider_id=provider_id, date__in=days)
+    claimed = rows.filter(remaining__gt=0).update(remaining=F("remaining") - 1)
+    if claimed != len(set(days)):
+        return None
+    return rows.aggregate(crews=Min("crews"))["crews"]
+
+
+def release_capacity(provider_id, days, using=None):
+    """Give back the capacity a deleted booking held on ``days``."""
+    from .models import ProviderAvailability
+
+    qs = ProviderAvailability.objects.using(using or shard_for(provider_id))
+    return qs.filter(provider_id=provider_id, date__in=days, remaining__lt=F("capacity")).update(
+        remaining=F("remaining") + 1
+    )
+
+
+def validate_interval(provider, starts_at, ends_at):
+    """Raise ``ValidationError`` unless the interval is in the future and inside the provider's windows."""
+    from .models import ProviderAvailability
+
+    if ends_at <= starts_at:
+        raise ValidationError("The booking must end after it starts.")
+    if timezone.localtime(starts_at).date() < timezone.localdate():
+        raise ValidationError("Booking date must be in the future.")
+
+    days = span_days(starts_at, ends_at)
+    first, final = days[0], days[-1]
+    rows = ProviderAvailability.objects.using(shard_for(provider)).filter(provider=provider, date__in=days)
+    windows = {row[0]: window_bounds(*row) for row in rows.values_list("date", "start_time", "end_time")}
+    missing = [d for d in days if d not in windows]
+    if missing:
+        raise ValidationError(
+            f"This provider is not available on {', '.join(d.isoformat() for d in missing)}."
+        )
+    if starts_at < windows[first][0] or ends_at > windows[final][1]:
+        raise ValidationError("The selected times are outside the provider's available hours.")
@@ -0,0 +1,105 @@
+"""Ranked keyword search over provider name, bio and price note.
+
+The inverted index lives in the database (see migration 0013): an FTS5
+table on SQLite and a generated, GIN-indexed ``tsvector`` column on
+PostgreSQL. Both are maintained by the database on every write. Ranking
+weights name above bio above price note: BM25 on SQLite, ``ts_rank_cd`` on
+PostgreSQL. Snippets come back HTML-escaped with matches wrapped in
+``<mark>``.
+
+Only the top ``limit`` hits are ranked out and returned. Callers pass their
+own filtered queryset as ``within``, so the limit applies to matching
+providers only, and join the hits back to it by primary key.
+"""
+import logging
+import re
+
+from django.db import connection
+from django.utils.html import escape
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 500
+_START, _STOP = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def is_supported():
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def fts5_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix."""
+    tokens = _TOKEN.findall(text.lower())
+    if not tokens:
+        return ""
+    quoted = [f'"{t}"' for t in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def highlight(snippet):
+    """Escape a raw snippet and turn the match markers into ``<mark>`` tags."""
+    return escape(snippet or "").replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def _within(within):
+    """SQL restricting ``p.id`` to the primary keys of the queryset ``within``."""
+    if within is None:
+        return "", []
+    sql, params = within.order_by().values("pk").query.sql_with_params()
+    return f" AND p.id IN ({sql})", list(params)
+
+
+def _sqlite_search(text, within, limit):
+    query = fts5_query(text)
+    if not query:
+        return []
+    sql = (
+        "SELECT fts.rowid, bm25(services_provider_fts, 10.0, 3.0, 1.0) AS rank, "
+        "snippet(services_provider_fts, -1, %s, %s, '…', 12) "
+        "FROM services_provider_fts fts "
+        "JOIN services_serviceprovider p ON p.id = fts.rowid "
+        "WHERE services_provider_fts MATCH %s"
+    )
+    params = [_START, _STOP, query]
+    restriction, restriction_params = _within(within)
+    sql += restriction + " ORDER BY rank LIMIT %s"
+    params += restriction_params
+    params.append(limit)
+    return sql, params
+
+
+def _postgres_search(text, within, limit):
+    if not _TOKEN.search(text):
+        return []
+    # Rank and limit first; headlines are costly, so only build them for the rows returned.
+    inner = (
+        "SELECT p.id, ts_rank_cd(p.search_vector, q) AS rank, q, "
+        "concat_ws(' ', p.name, p.bio, p.price_note) AS body "
+        "FROM services_serviceprovider p, websearch_to_tsquery('english', %s) q "
+        "WHERE p.search_vector @@ q"
+    )
+    restriction, restriction_params = _within(within)
+    inner += restriction + " ORDER BY rank DESC LIMIT %s"
+    params = [text] + restriction_params
+    params.append(limit)
+    sql = f"SELECT id, rank, ts_headline('english', body, q, %s) FROM ({inner}) hits ORDER BY rank DESC"
+    options = f"StartSel={_START}, StopSel={_STOP}, MaxWords=20, MinWords=8, MaxFragments=1"
+    return sql, [options] + params
+
+
+def search_providers(text, within=None, limit=MAX_RESULTS):
+    """Best-first ``[(provider_id, snippet_html)]`` for ``text``, optionally among the providers in ``within``."""
+    if connection.vendor == "sqlite":
+        built = _sqlite_search(text, within, limit)
+    elif connection.vendor == "postgresql":
+        built = _postgres_search(text, within, limit)
+    else:
+        raise NotImplementedError(f"Keyword search is not available on {connection.vendor}.")
+    if not built:
+        return []
+    sql, params = built
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(pk, highlight(snippet)) for pk, _, snippet in cursor.fetchall()]
@@ -0,0 +1,260 @@
+"""Optional region sharding of provider schedules.
+
+With ``settings.DB_SHARDS`` empty (the default) every query goes to
+``default`` and none of this has any effect.
+
+When shards are configured, the catalog stays in ``default``: users,
+providers, search, rollups and idempotency keys. Each provider's schedule
+(``ProviderAvailability``, ``Booking``, its ``BookingEvent`` change feed and
+the feed's ``BookingEventSequence`` counter, the ``WaitlistEntry`` queues,
+the ``OutboundEmail`` outbox and the ``RollupDirtyDay`` marks) lives on one
+shard. The shard is chosen from
+the provider's region when the provider is created: its ``location`` up to
+the first comma, mapped through ``settings.SHARD_REGIONS`` or hashed over
+the shards. It is then pinned in ``ServiceProvider.shard``, so editing the
+location later never strands rows. Providers created before sharding keep
+``shard=""`` and their schedule stays in ``default``, which therefore is a
+schedule database too.
+
+``RegionRouter`` sends a schedule row to its provider's shard whenever it
+has the row or provider instance. Plain queries such as
+``Booking.objects.filter(...)`` carry no hint, so the code serving one
+provider selects the shard with ``use_shard(provider)``; without one the
+router raises rather than guess. Reads that span
+providers, such as a customer's history, run ``fan_out`` over
+``schedule_databases()`` in parallel and merge the results. Joins from
+schedule rows to users or providers are not possible across databases;
+those are looked up in ``default`` by id instead.
+"""
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SHARDED_MODELS = {
+    "services.provideravailability", "services.booking", "services.bookingevent", "services.bookingeventsequence",
+    "services.waitlistentry", "services.outboundemail", "services.rollupdirtyday",
+}
+
+_current = ContextVar("schedule_shard", default=None)
+_provider_shards = {}
+
+
+def is_enabled():
+    return bool(getattr(settings, "DB_SHARDS", None))
+
+
+def schedule_databases():
+    """Every database holding schedule rows: ``default`` (for unpinned providers) and the shards."""
+    if not is_enabled():
+        return [DEFAULT_DB_ALIAS]
+    return [DEFAULT_DB_ALIAS] + [alias for alias in settings.DB_SHARDS if alias != DEFAULT_DB_ALIAS]
+
+
+def region_for(location):
+    return (location or "").split(",")[0].strip().lower()
+
+
+def shard_for_location(location):
+    """The shard a new provider in ``location`` is placed on ("" when sharding is off)."""
+    if not is_enabled():
+        return ""
+    region = region_for(location)
+    mapped = getattr(settings, "SHARD_REGIONS", {}).get(region)
+    if mapped:
+        return mapped
+    return settings.DB_SHARDS[zlib.crc32(region.encode()) % len(settings.DB_SHARDS)]
+
+
+def shard_for(provider):
+    """Database alias holding the schedule of ``provider`` (an instance or a primary key)."""
+    if not is_enabled():
+        return DEFAULT_DB_ALIAS
+    shard = getattr(provider, "shard", None)
+    if shard is None:
+        # Pinned shards never change, so a lookup by id can be remembered for the process.
+        provider_id = int(provider)
+        shard = _provider_shards.get(provider_id)
+        if shard is None:
+            from .models import ServiceProvider
+
+            shard = ServiceProvider.objects.filter(pk=provider_id).values_list("shard", flat=True).first() or ""
+            _provider_shards[provider_id] = shard
+    return shard or DEFAULT_DB_ALIAS
+
+
+def forget_provider(provider_id):
+    _provider_shards.pop(provider_id, None)
+
+
+@contextmanager
+def use_shard(provider_or_alias):
+    """Route unhinted schedule queries in this block to a provider's shard (or to an alias)."""
+    alias = provider_or_alias if isinstance(provider_or_alias, str) else shard_for(provider_or_alias)
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def _run_on(fn):
+    def run(alias):
+        try:
+            with use_shard(alias):
+                return fn(alias)
+        finally:
+            # Pool threads don't outlive the call, so neither should their connections.
+            connections.close_all()
+    return run
+
+
+def fan_out(fn, aliases=None):
+    """``[fn(alias) for alias in aliases]``, run in parallel with each alias selected; defaults to every schedule database."""
+    aliases = list(aliases if aliases is not None else schedule_databases())
+    if len(aliases) <= 1:
+        # Stay on this thread (and its open transaction) when there is nothing to parallelize.
+        results = []
+        for alias in aliases:
+            with use_shard(alias):
+                results.append(fn(alias))
+        return results
+    with ThreadPoolExecutor(max_workers=len(aliases), thread_name_prefix="shard") as pool:
+        return list(pool.map(_run_on(fn), aliases))
+
+
+def availability_summaries(providers, today):
+    """``{provider_id: (next_free_date, open_slot_count)}`` from each provider's own schedule database.
+
+    ``providers`` is an iterable of ``(pk, shard)`` pairs.
+    """
+    from django.db.models import Count, Min
+
+    from .models import ProviderAvailability
+
+    by_db = {}
+    for pk, shard in providers:
+        by_db.setdefault(shard or DEFAULT_DB_ALIAS, []).append(pk)
+
+    def summarize(alias):
+        return list(
+            ProviderAvailability.objects.using(alias).open()
+            .filter(provider_id__in=by_db[alias], date__gte=today)
+            .order_by()
+            .values("provider_id")
+            .annotate(first=Min("date"), n=Count("pk"))
+            .values_list("provider_id", "first", "n")
+        )
+
+    summaries = {pk: (None, 0) for pks in by_db.values() for pk in pks}
+    for rows in fan_out(summarize, list(by_db)):
+        summaries.update((pk, (first, n)) for pk, first, n in rows)
+    return summaries
+
+
+def refresh_summaries(providers, today):
+    """``refresh_availability_summary()`` for a sharded setup: aggregate on the shards, write the
+    providers whose summary changed in ``default``; return how many that was."""
+    from django.utils import timezone
+
+    from .models import ServiceProvider
+
+    rows = list(providers.values_list("pk", "shard", "next_free_date", "open_slot_count"))
+    summaries = availability_summaries([(pk, shard) for pk, shard, _, _ in rows], today)
+    current = {pk: (first, n) for pk, _, first, n in rows}
+    now = timezone.now()
+    changed = [
+        ServiceProvider(pk=pk, next_free_date=first, open_slot_count=n, updated_at=now)
+        for pk, (first, n) in summaries.items()
+        if current[pk] != (first, n)
+    ]
+    ServiceProvider.objects.bulk_update(changed, ["next_free_date", "open_slot_count", "updated_at"], batch_size=500)
+    return len(changed)
+
+
+FREE_DATES_TABLE = "services_free_between"
+STAGE_BATCH = 500
+
+
+def stage_first_free_dates(start, end):
+    """Write each provider's first date with capacity left in start..end, from every schedule database,
+    into a temporary table on ``default``; return the table's name.
+
+    Queries in ``default`` join against the table instead of carrying one
+    parameter per provider, so their size doesn't grow with the directory.
+    The table belongs to this connection and is replaced on every call.
+    """
+    from django.db.models import Min
+
+    from .models import ProviderAvailability
+
+    def first_free(alias):
+        return list(
+            ProviderAvailability.objects.using(alias).open()
+            .filter(date__gte=start, date__lte=end)
+            .order_by()
+            .values("provider_id")
+            .annotate(first=Min("date"))
+            .values_list("provider_id", "first")
+        )
+
+    rows = [row for rows in fan_out(first_free) for row in rows]
+    connection = connections[DEFAULT_DB_ALIAS]
+    table = connection.ops.quote_name(FREE_DATES_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {table} (provider_id bigint PRIMARY KEY, first_free date NOT NULL)")
+        for i in range(0, len(rows), STAGE_BATCH):
+            cursor.executemany(
+                f"INSERT INTO {table} (provider_id, first_free) VALUES (%s, %s)",
+                [(pk, connection.ops.adapt_datefield_value(first)) for pk, first in rows[i:i + STAGE_BATCH]],
+            )
+    return FREE_DATES_TABLE
+
+
+class RegionRouter:
+    """Send schedule models to their provider's shard; everything else to ``default``."""
+
+    def _route(self, model, hints):
+        if not is_enabled():
+            return None
+        if model._meta.label_lower not in SHARDED_MODELS:
+            # Explicitly, or Django would follow an instance hint (a booking's provider) to its shard.
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        alias = _current.get()
+        if instance is not None:
+            same_model = model._meta.label_lower == instance._meta.label_lower
+            # An unsaved row's db may just be a guess made while assigning its foreign keys.
+            if instance._state.db and same_model and not instance._state.adding:
+                return instance._state.db
+            if instance._meta.label_lower == "services.serviceprovider":
+                return shard_for(instance)
+            provider_id = getattr(instance, "provider_id", None)
+            if provider_id is not None:
+                return shard_for(provider_id)
+            if not same_model:
+                # A related row (say, a booking's customer) says nothing about the shard; Django
+                # only asks while assigning the relation, and the row is routed again when saved.
+                return alias
+        if alias is None:
+            # Falling back to ``default`` would silently miss (or misplace) rows on the shards.
+            raise RuntimeError(
+                f"No shard selected for a {model._meta.label} query; wrap it in use_shard() or pass .using()."
+            )
+        return alias
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Schedule rows point at users and providers in ``default`` by id.
+        if {obj1._meta.label_lower, obj2._meta.label_lower} & SHARDED_MODELS:
+            return True
+        return None
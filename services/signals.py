@@ -0,0 +1,152 @@
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .analytics import mark_dirty, mark_provider_dirty
+from .cache import invalidate_provider
+from .events import event_for
+from .live import publish_availability
+from .models import Booking, BookingEvent, DirectoryStamp, ProviderAvailability, ServiceProvider, WaitlistEntry
+from .scheduling import release_capacity, span_days
+from .sharding import forget_provider, schedule_databases, shard_for, use_shard
+
+
+_deferred = threading.local()
+
+
+def _is_deferred():
+    return getattr(_deferred, "active", False)
+
+
+@contextmanager
+def deferred_schedule_updates(provider_ids):
+    """Skip per-row capacity and summary upkeep for bulk writes; refresh once on exit.
+
+    Change-feed events are buffered and inserted together on exit as well.
+
+    The caller is responsible for the capacity counters it touches (for example
+    with ``ProviderAvailability.objects.recount_remaining()``).
+    """
+    previous = _is_deferred()
+    _deferred.active = True
+    if not previous:
+        _deferred.events = []
+    try:
+        yield
+    finally:
+        _deferred.active = previous
+        events = [] if previous else _deferred.events
+        if not previous:
+            _deferred.events = None
+    BookingEvent.objects.bulk_create(events, batch_size=500)
+    ServiceProvider.objects.filter(pk__in=provider_ids).refresh_availability_summary()
+    for provider_id in provider_ids:
+        _invalidate(provider_id)
+
+
+def record_events(events):
+    """Append change-feed events for writes that send no signals, such as ``bulk_create``."""
+    if _is_deferred():
+        _deferred.events.extend(events)
+    else:
+        BookingEvent.objects.bulk_create(events, batch_size=500)
+
+
+def _invalidate(provider_id, using=None):
+    # Invalidate immediately and again once the surrounding transaction commits, so a
+    # reader that rebuilt the entry from pre-commit data cannot keep it alive. Live
+    # clients are told after that, so they get the committed dates. Schedule writes
+    # commit on the provider's shard, so that is the transaction to wait for.
+    using = using or shard_for(provider_id)
+    invalidate_provider(provider_id)
+    transaction.on_commit(lambda: invalidate_provider(provider_id), using=using)
+    transaction.on_commit(lambda: publish_availability(provider_id), using=using)
+
+
+@receiver([post_save, post_delete], sender=ServiceProvider)
+def provider_changed(sender, instance, using, **kwargs):
+    _invalidate(instance.pk, using)
+    DirectoryStamp.bump(using)
+
+
+@receiver(pre_save, sender=ServiceProvider)
+def remember_rollup_group(sender, instance, raw=False, **kwargs):
+    instance._previous_group = None
+    if instance.pk and not raw:
+        instance._previous_group = ServiceProvider.objects.filter(pk=instance.pk).values_list(
+            "service_type", "location"
+        ).first()
+
+
+@receiver(post_save, sender=ServiceProvider)
+def regroup_rollups(sender, instance, using, created=False, **kwargs):
+    previous = getattr(instance, "_previous_group", None)
+    if created or previous is None or previous == (instance.service_type, instance.location):
+        return
+    # Rollups group by the provider's current service type and location, so all of its days move.
+    transaction.on_commit(lambda: mark_provider_dirty(instance), using=using)
+
+
+@receiver(pre_delete, sender=ServiceProvider)
+def delete_sharded_schedule(sender, instance, **kwargs):
+    # The ORM cascade only reaches rows in the provider's own database.
+    alias = shard_for(instance)
+    if alias != DEFAULT_DB_ALIAS:
+        with use_shard(alias):
+            Booking.objects.filter(provider_id=instance.pk).delete()
+            ProviderAvailability.objects.filter(provider_id=instance.pk).delete()
+            WaitlistEntry.objects.filter(provider_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=ServiceProvider)
+def forget_deleted_provider(sender, instance, **kwargs):
+    forget_provider(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_bookings(sender, instance, **kwargs):
+    for alias in schedule_databases():
+        if alias != DEFAULT_DB_ALIAS:
+            with use_shard(alias):
+                Booking.objects.filter(customer_id=instance.pk).delete()
+                WaitlistEntry.objects.filter(customer_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, using, **kwargs):
+    if _is_deferred():
+        return
+    # Connected before provider_schedule_changed so the summary sees the returned capacity.
+    release_capacity(instance.provider_id, span_days(instance.starts_at, instance.ends_at), using=using)
+
+
+@receiver([post_save, post_delete], sender=ProviderAvailability)
+@receiver([post_save, post_delete], sender=Booking)
+def record_schedule_event(sender, instance, using, created=False, **kwargs):
+    if kwargs["signal"] is post_save and not created:
+        return
+    event = event_for(instance, created)
+    if _is_deferred():
+        _deferred.events.append(event)
+    else:
+        event.save(using=using)
+
+
+@receiver([post_save, post_delete], sender=ProviderAvailability)
+@receiver([post_save, post_delete], sender=Booking)
+def provider_schedule_changed(sender, instance, using, **kwargs):
+    if _is_deferred():
+        return
+    # Same transaction as the write, so the summary can't disagree with the rows.
+    ServiceProvider.objects.filter(pk=instance.provider_id).refresh_availability_summary()
+    _invalidate(instance.provider_id)
+    if sender is ProviderAvailability:
+        days = [instance.date]
+    else:
+        # A moved booking changes the days it left as well.
+        days = span_days(instance.starts_at, instance.ends_at) + getattr(instance, "_previous_days", [])
+    mark_dirty(days, using=using)
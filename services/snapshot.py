@@ -0,0 +1,294 @@
+"""Read-only provider directory snapshot, memory-mapped and shared by every worker.
+
+``build`` writes the directory as one compact file, and ``get_snapshot``
+maps it read-only. Every worker on the host maps the same file, so they
+share one copy through the page cache instead of each holding its own
+query results or cache entries.
+
+Layout (native byte order, recorded in the header):
+
+* a fixed header: magic, format version, byte order, the directory state
+  the file was built from (last change and version) and an offset/length
+  table of the sections below;
+* one array per column, one entry per provider. Rows are stored in the
+  directory's default order (newest first), so a row index doubles as a
+  sort key. Text columns are indexes into a shared string table, and
+  ``next_free_date`` is a date ordinal (0 for none);
+* ``soonest_rank``: each row's position in the "available soonest" order;
+* posting lists: the rows of each service type and of each distinct
+  location, in ascending row order.
+
+Text is decoded only for the rows of the page being rendered. ``build``
+writes to a temporary file and renames it over the old one, so readers see
+either the old file or the new one, never a partial write. A worker that
+still maps the old file keeps a valid view of it until it notices the
+swap on its next request.
+
+``ProviderListView`` uses the snapshot only while its stored state still
+matches the live ``directory_state()``, which the HTTP validators read
+anyway. Every change to what the directory lists bumps that state (a
+booking only when it fills or reopens a provider's date), so requests go
+back to the database until the snapshot is rebuilt;
+``build_directory_snapshot --watch`` rebuilds it within seconds of a
+change. Keyword and date-range searches always use the database.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from datetime import date
+
+from django.conf import settings
+from django.utils.text import Truncator
+
+from .models import DirectoryStamp, ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ECDS"
+VERSION = 3
+SECTIONS = [
+    # (name, array typecode); "B" sections are raw bytes.
+    ("id", "Q"), ("user_id", "Q"), ("name", "I"), ("service_type", "I"), ("location", "I"),
+    ("price_note", "I"), ("bio", "I"), ("next_free", "i"), ("open_slots", "I"), ("soonest_rank", "I"),
+    ("type_keys", "I"), ("type_offsets", "I"), ("type_rows", "I"),
+    ("location_keys", "I"), ("location_offsets", "I"), ("location_rows", "I"),
+    ("string_offsets", "I"), ("strings", "B"),
+]
+# magic, format version, little-endian flag, changed (µs since epoch, -1 for none), directory version
+_HEADER = struct.Struct("<4sIBxxxqQ")
+_SECTION = struct.Struct("<QQ")
+# Bio is only shown as a 25-word excerpt, so that is all the snapshot keeps.
+BIO_WORDS = 25
+
+
+def _micros(moment):
+    return -1 if moment is None else int(moment.timestamp() * 1_000_000)
+
+
+def directory_state():
+    """``(last change, version)`` of the provider directory, as stored in snapshot headers.
+
+    One primary-key lookup of the ``DirectoryStamp`` row, which every directory
+    write bumps.
+    """
+    row = DirectoryStamp.objects.filter(pk=1).values_list("changed_at", "version").first()
+    return row or (None, 0)
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.blob = bytearray()
+        self.offsets = array("I", [0])
+
+    def add(self, text):
+        text = text or ""
+        if text not in self.index:
+            self.index[text] = len(self.offsets) - 1
+            self.blob += text.encode()
+            self.offsets.append(len(self.blob))
+        return self.index[text]
+
+
+def _postings(keys_by_row):
+    """``(keys, offsets, rows)`` arrays: the rows of each key, ascending."""
+    groups = {}
+    for row, key in enumerate(keys_by_row):
+        groups.setdefault(key, array("I")).append(row)
+    keys, offsets, rows = array("I"), array("I", [0]), array("I")
+    for key, members in groups.items():
+        keys.append(key)
+        rows.extend(members)
+        offsets.append(len(rows))
+    return keys, offsets, rows
+
+
+def build(path=None):
+    """Write a fresh snapshot to ``path`` (default ``settings.DIRECTORY_SNAPSHOT_PATH``); return its row count."""
+    path = path or settings.DIRECTORY_SNAPSHOT_PATH
+    # Read before the rows: a change made during the build leaves the file stale, not wrongly current.
+    changed, version = directory_state()
+    rows = list(
+        ServiceProvider.objects.order_by("-created_at").values_list(
+            "id", "user_id", "name", "service_type", "location", "price_note", "bio",
+            "next_free_date", "open_slot_count", "created_at",
+        )
+    )
+    strings = _StringTable()
+    columns = {name: array(code) for name, code in SECTIONS if code != "B"}
+    for pk, user_id, name, service_type, location, price_note, bio, next_free, open_slots, _ in rows:
+        columns["id"].append(pk)
+        columns["user_id"].append(user_id)
+        columns["name"].append(strings.add(name))
+        columns["service_type"].append(strings.add(service_type))
+        columns["location"].append(strings.add(location))
+        columns["price_note"].append(strings.add(price_note))
+        columns["bio"].append(strings.add(Truncator(bio).words(BIO_WORDS)))
+        columns["next_free"].append(next_free.toordinal() if next_free else 0)
+        columns["open_slots"].append(open_slots)
+
+    # "Available soonest": next free date ascending with undated rows last, then newest first.
+    soonest = sorted(range(len(rows)), key=lambda r: (columns["next_free"][r] or sys.maxsize, r))
+    rank = array("I", bytes(4 * len(rows)))
+    for position, row in enumerate(soonest):
+        rank[row] = position
+    columns["soonest_rank"] = rank
+    columns["type_keys"], columns["type_offsets"], columns["type_rows"] = _postings(columns["service_type"])
+    columns["location_keys"], columns["location_offsets"], columns["location_rows"] = _postings(columns["location"])
+    columns["string_offsets"] = strings.offsets
+
+    payloads = [columns[name].tobytes() if code != "B" else bytes(strings.blob) for name, code in SECTIONS]
+    offset = _HEADER.size + _SECTION.size * len(SECTIONS)
+    table = []
+    for payload in payloads:
+        offset += -offset % 8  # keep every array aligned
+        table.append((offset, len(payload)))
+        offset += len(payload)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, sys.byteorder == "little", _micros(changed), version))
+        for entry in table:
+            f.write(_SECTION.pack(*entry))
+        for (start, _), payload in zip(table, payloads):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic on POSIX: a reader opens either the old file or the complete new one.
+    os.replace(tmp, path)
+    logger.info(f"Wrote directory snapshot of {len(rows)} provider(s) to {path}")
+    return len(rows)
+
+
+class DirectorySnapshot:
+    """A mapped snapshot file. Columns are zero-copy views of the mapping."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_format, little, changed, version = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or file_format != VERSION or bool(little) != (sys.byteorder == "little"):
+            raise ValueError(f"{path} is not a version {VERSION} directory snapshot for this platform")
+        self.changed, self.version = changed, version
+        view = memoryview(self._map)
+        for i, (name, code) in enumerate(SECTIONS):
+            start, length = _SECTION.unpack_from(self._map, _HEADER.size + i * _SECTION.size)
+            section = view[start:start + length]
+            setattr(self, name, section if code == "B" else section.cast(code))
+        self._postings = {
+            "type": self._posting_index("type"),
+            "location": self._posting_index("location"),
+        }
+
+    def _posting_index(self, kind):
+        keys, offsets = getattr(self, f"{kind}_keys"), getattr(self, f"{kind}_offsets")
+        return {self.string(key): (offsets[i], offsets[i + 1]) for i, key in enumerate(keys)}
+
+    def string(self, index):
+        return str(self.strings[self.string_offsets[index]:self.string_offsets[index + 1]], "utf-8")
+
+    def matches(self, state):
+        """Whether the snapshot was built from the directory state ``(changed, version)``."""
+        changed, version = state
+        return (self.changed, self.version) == (_micros(changed), version)
+
+    def _rows(self, kind, key):
+        start, end = self._postings[kind].get(key, (0, 0))
+        return getattr(self, f"{kind}_rows")[start:end]
+
+    def select(self, service_type=None, location=None, open_from=None, soonest=False):
+        """Row indexes matching the directory filters, in the directory's order.
+
+        ``location`` matches case-insensitively anywhere in the location, like
+        the ORM's ``icontains``: it is tested once per distinct location and
+        the matching posting lists are merged.
+        """
+        candidates = None
+        if service_type:
+            candidates = set(self._rows("type", service_type))
+        if location:
+            needle = location.lower()
+            found = set()
+            for text in self._postings["location"]:
+                if needle in text.lower():
+                    found.update(self._rows("location", text))
+            candidates = found if candidates is None else candidates & found
+        rows = range(len(self.id)) if candidates is None else sorted(candidates)
+        if open_from:
+            # Undated rows are stored as 0, which is never on or after a real date.
+            ordinal = open_from.toordinal()
+            rows = [r for r in rows if self.next_free[r] >= ordinal]
+        if soonest:
+            rows = sorted(rows, key=self.soonest_rank.__getitem__)
+        return rows
+
+    def provider(self, row):
+        """An unsaved ``ServiceProvider`` carrying the listed fields of ``row``, for display only."""
+        next_free = self.next_free[row]
+        return ServiceProvider(
+            id=self.id[row],
+            user_id=self.user_id[row],
+            name=self.string(self.name[row]),
+            service_type=self.string(self.service_type[row]),
+            location=self.string(self.location[row]),
+            price_note=self.string(self.price_note[row]),
+            bio=self.string(self.bio[row]),
+            next_free_date=date.fromordinal(next_free) if next_free else None,
+            open_slot_count=self.open_slots[row],
+        )
+
+
+class SnapshotRows:
+    """A list-like of providers for ``Paginator``: only the sliced page is decoded."""
+
+    def __init__(self, snapshot, rows):
+        self.snapshot = snapshot
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.snapshot.provider(row) for row in self.rows[index]]
+        return self.snapshot.provider(self.rows[index])
+
+    def __iter__(self):
+        return (self.snapshot.provider(row) for row in self.rows)
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def get_snapshot():
+    """This process's mapping of the current snapshot file, or None when there is none (or it is unreadable).
+
+    One ``stat`` per call notices a rebuild; the new file is mapped and the old
+    mapping is left to the garbage collector once no request uses it.
+    """
+    global _current
+    path = getattr(settings, "DIRECTORY_SNAPSHOT_PATH", "")
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    snapshot = _current
+    if snapshot is not None and (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+        return snapshot
+    with _lock:
+        try:
+            _current = DirectorySnapshot(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Ignoring directory snapshot {path}: {e}")
+            _current = None
+        return _current
@@ -1,9 +1,20 @@
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
-from .models import ServiceProvider, ProviderAvailability, Booking
+from django.utils.text import Truncator
+from .cache import get_free_dates, get_provider, invalidate_provider, read_through
+from .models import ServiceProvider, ProviderAvailability, Booking, ReminderDispatch, WaitlistEntry
+from .views import ProviderListView
 from datetime import date, timedelta
+from io import StringIO
+import os
+import shutil
+import tempfile
+import threading
+import time
 
 class ServiceProviderModelTest(TestCase):
     def setUp(self):
@@ -160,3 +171,2127 @@ class FormsTest(TestCase):
         form_data['name'] = 'A'  # Too short
         form = ProviderRegistrationForm(data=form_data)
         self.assertFalse(form.is_valid())
+
+class ProviderAvailabilitySearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        customer = User.objects.create_user(username='customer', password='testpass123')
+        self.today = timezone.now().date()
+        self.early = ServiceProvider.objects.create(
+            user=owner, name="Early Solar", service_type="solar", location="Windsor"
+        )
+        self.late = ServiceProvider.objects.create(
+            user=owner, name="Late Solar", service_type="solar", location="Windsor"
+        )
+        self.booked = ServiceProvider.objects.create(
+            user=owner, name="Booked Compost", service_type="compost", location="Windsor"
+        )
+        ProviderAvailability.objects.create(provider=self.early, date=self.today + timedelta(days=1))
+        ProviderAvailability.objects.create(provider=self.late, date=self.today + timedelta(days=3))
+        ProviderAvailability.objects.create(provider=self.booked, date=self.today + timedelta(days=1))
+        Booking.objects.create(customer=customer, provider=self.booked, booking_date=self.today + timedelta(days=1))
+
+    def _search(self, **params):
+        response = self.client.get(reverse('providers'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['providers'])
+
+    def test_range_returns_only_open_providers_soonest_first(self):
+        providers = self._search(
+            available_from=(self.today + timedelta(days=1)).isoformat(),
+            available_to=(self.today + timedelta(days=5)).isoformat(),
+        )
+        self.assertEqual(providers, [self.early, self.late])
+        self.assertEqual(providers[0].first_free_date, self.today + timedelta(days=1))
+
+    def test_single_date_excludes_booked_and_unavailable(self):
+        providers = self._search(available_from=(self.today + timedelta(days=1)).isoformat())
+        self.assertEqual(providers, [self.early])
+
+    def test_combines_with_service_type(self):
+        providers = self._search(
+            q="compost",
+            available_from=(self.today + timedelta(days=1)).isoformat(),
+            available_to=(self.today + timedelta(days=5)).isoformat(),
+        )
+        self.assertEqual(providers, [])
+
+    def test_unfiltered_directory_lists_everyone(self):
+        self.assertEqual(len(self._search()), 3)
+
+    def test_inverted_range_is_rejected(self):
+        providers = self._search(
+            available_from=(self.today + timedelta(days=5)).isoformat(),
+            available_to=(self.today + timedelta(days=1)).isoformat(),
+        )
+        self.assertEqual(providers, [])
+
+    def test_search_is_a_single_query(self):
+        params = {
+            'available_from': (self.today + timedelta(days=1)).isoformat(),
+            'available_to': (self.today + timedelta(days=5)).isoformat(),
+        }
+        view = ProviderListView()
+        view.request = RequestFactory().get(reverse('providers'), params)
+        with self.assertNumQueries(1):
+            list(view.get_queryset())
+
+class ReadThroughCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Cached Solar", service_type="solar", location="Windsor"
+        )
+        self.tomorrow = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.provider, date=self.tomorrow)
+
+    def test_serves_stale_value_while_another_request_rebuilds(self):
+        calls = []
+        read_through('k', lambda: calls.append(1) or 'old', ttl=0, stale_ttl=60)
+        cache.add('k:lock', 1)  # another worker is rebuilding
+        self.assertEqual(read_through('k', lambda: calls.append(1) or 'new', ttl=0), 'old')
+        self.assertEqual(len(calls), 1)
+
+    def test_expired_entry_is_rebuilt_once_lock_is_free(self):
+        read_through('k', lambda: 'old', ttl=0, stale_ttl=60)
+        self.assertEqual(read_through('k', lambda: 'new'), 'new')
+        self.assertEqual(read_through('k', lambda: 'newer'), 'new')
+
+    def test_slow_rebuild_leaves_a_newer_lock_alone(self):
+        def slow():
+            # Our lock expired mid-rebuild and another worker took it.
+            cache.set('k:lock', 'theirs')
+            return 'value'
+        self.assertEqual(read_through('k', slow), 'value')
+        self.assertEqual(cache.get('k:lock'), 'theirs')
+
+    def test_free_dates_are_cached_and_invalidated_by_booking(self):
+        self.assertEqual(get_free_dates(self.provider.id), [self.tomorrow])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_free_dates(self.provider.id), [self.tomorrow])
+        Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.tomorrow)
+        self.assertEqual(get_free_dates(self.provider.id), [])
+
+    def test_provider_lookup_is_cached_and_invalidated_on_save(self):
+        self.assertEqual(get_provider(self.provider.id).name, "Cached Solar")
+        with self.assertNumQueries(0):
+            get_provider(self.provider.id)
+        self.provider.name = "Renamed Solar"
+        self.provider.save()
+        self.assertEqual(get_provider(self.provider.id).name, "Renamed Solar")
+
+    def test_unknown_provider_is_404(self):
+        from django.http import Http404
+        with self.assertRaises(Http404):
+            get_provider(999999)
+        with self.assertRaises(Http404):
+            get_provider("not-a-number")
+
+class ReadThroughConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Popular Solar", service_type="solar", location="Windsor"
+        )
+        ProviderAvailability.objects.create(provider=self.provider, date=timezone.now().date() + timedelta(days=1))
+
+    def _hammer(self, workers=8):
+        """Fetch the provider's free dates from many threads at once; return availability queries run."""
+        queries = []
+        barrier = threading.Barrier(workers)
+
+        def count(execute, sql, params, many, context):
+            if 'services_provideravailability' in sql:
+                queries.append(sql)
+            return execute(sql, params, many, context)
+
+        def worker():
+            try:
+                with connection.execute_wrapper(count):
+                    barrier.wait()
+                    get_free_dates(self.provider.id)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return len(queries)
+
+    def test_one_backend_query_per_expiry(self):
+        self.assertEqual(self._hammer(), 1)
+        self.assertEqual(self._hammer(), 0)
+        invalidate_provider(self.provider.id)
+        self.assertEqual(self._hammer(), 1)
+
+class AdmissionControlTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+
+    @override_settings(RATE_LIMITS={"register": {"ip": "1/m"}})
+    def test_register_burst_gets_429_with_retry_after(self):
+        response = self.client.post(reverse('register'), {})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('register'), {})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    @override_settings(RATE_LIMITS={"register": {"ip": "1/m"}})
+    def test_get_requests_are_not_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('register')).status_code, 200)
+
+    @override_settings(RATE_LIMITS={"book": {"user": "1/m"}})
+    def test_per_user_bucket_is_independent(self):
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_login(self.user)
+        self.client.post(reverse('book_service'), {})
+        self.assertEqual(self.client.post(reverse('book_service'), {}).status_code, 429)
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(reverse('book_service'), {}).status_code, 200)
+
+    @override_settings(RATE_LIMITS={"register": {"ip": "1/m", "global": "2/m"}})
+    def test_rejected_requests_do_not_drain_the_global_bucket(self):
+        for _ in range(5):
+            self.client.post(reverse('register'), {}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(self.client.post(reverse('register'), {}, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(BOOKING_MAX_IN_FLIGHT=0)
+    def test_booking_over_in_flight_cap_gets_503(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('book_service'), {})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+class AdminPerformanceTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123', email='a@test.com')
+        self.client.force_login(self.admin)
+        self.provider = ServiceProvider.objects.create(
+            user=self.admin, name="Admin Solar", service_type="solar", location="Windsor"
+        )
+        self.other = ServiceProvider.objects.create(
+            user=self.admin, name="Other Solar", service_type="solar", location="Toronto"
+        )
+        tomorrow = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.provider, date=tomorrow)
+        Booking.objects.create(customer=self.admin, provider=self.provider, booking_date=tomorrow)
+
+    def test_changelists_render(self):
+        for name in ['serviceprovider', 'booking', 'provideravailability']:
+            response = self.client.get(reverse(f'admin:services_{name}_changelist'))
+            self.assertEqual(response.status_code, 200, name)
+
+    def test_change_forms_do_not_render_full_fk_selects(self):
+        booking = Booking.objects.get()
+        response = self.client.get(reverse('admin:services_booking_change', args=[booking.id]))
+        self.assertEqual(response.status_code, 200)
+        # Autocomplete only renders the current value, not every provider.
+        self.assertNotContains(response, 'Other Solar')
+
+    def test_booking_change_form_checks_capacity(self):
+        from .scheduling import day_bounds
+        booking = Booking.objects.get()
+        day = booking.booking_date + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.provider, date=day)
+        Booking.objects.create(customer=self.admin, provider=self.provider, booking_date=day)
+        url = reverse('admin:services_booking_change', args=[booking.id])
+        form = self.client.get(url).context['adminform'].form
+        self.assertFalse({'booking_date', 'end_date', 'crew'} & set(form.fields))
+
+        def move_to(target, crew='3'):
+            starts_at, ends_at = (timezone.localtime(t) for t in day_bounds(target))
+            return self.client.post(url, {
+                'customer': self.admin.pk, 'provider': self.provider.pk, 'crew': crew,
+                'starts_at_0': starts_at.date().isoformat(), 'starts_at_1': starts_at.strftime('%H:%M:%S'),
+                'ends_at_0': ends_at.date().isoformat(), 'ends_at_1': ends_at.strftime('%H:%M:%S'),
+            })
+
+        response = move_to(day)
+        self.assertContains(response, 'The provider is fully booked at that time.')
+        booking.refresh_from_db()
+        self.assertEqual(booking.booking_date, day - timedelta(days=1))
+        # Saving it where it is still works, and the posted crew is ignored.
+        self.assertEqual(move_to(booking.booking_date).status_code, 302)
+        booking.refresh_from_db()
+        self.assertEqual(booking.crew, 0)
+
+    def test_location_prefix_filter(self):
+        response = self.client.get(reverse('admin:services_serviceprovider_changelist'), {'location': 'Wind'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.provider])
+
+    def test_paginator_uses_estimate_for_unfiltered_big_tables(self):
+        from .admin import EstimatedCountPaginator
+        paginator = EstimatedCountPaginator(ServiceProvider.objects.all(), 10)
+        paginator.exact_count_threshold = 0
+        with self.assertNumQueries(1):
+            self.assertGreaterEqual(paginator.count, 2)
+        filtered = EstimatedCountPaginator(ServiceProvider.objects.filter(location="Windsor"), 10)
+        filtered.exact_count_threshold = 0
+        self.assertEqual(filtered.count, 1)
+
+class WarmupTest(TestCase):
+    def test_warmup_compiles_every_app_template(self):
+        from .warmup import template_names, warm_up
+        timings = warm_up()
+        self.assertEqual(timings['templates_failed'], 0)
+        self.assertEqual(timings['templates_compiled'], len(template_names()))
+        self.assertIn('services/book_service.html', template_names())
+
+    def test_startup_bench_reports_timings(self):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('startup_bench', runs=1, stdout=out)
+        self.assertIn('first_response', out.getvalue())
+        self.assertIn('200 OK', out.getvalue())
+
+class SamplingProfilerTest(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+    def _settings(self, **overrides):
+        conf = {
+            "ENABLED": True, "SAMPLE_RATE": 0.0, "HEADER": "X-Profile", "SECRET": "s3cret",
+            "PATHS": [], "DIR": self.profile_dir,
+        }
+        conf.update(overrides)
+        return override_settings(PROFILING=conf)
+
+    def test_disabled_middleware_removes_itself(self):
+        from django.core.exceptions import MiddlewareNotUsed
+        from .profiling import SamplingProfilerMiddleware
+        with override_settings(PROFILING={"ENABLED": False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                SamplingProfilerMiddleware(lambda request: None)
+
+    def test_header_triggers_profile_and_report(self):
+        from io import StringIO
+        from django.core.management import call_command
+        with self._settings():
+            Client().get(reverse('providers'))
+            self.assertEqual(os.listdir(self.profile_dir), [])
+            Client().get(reverse('providers'), HTTP_X_PROFILE='guess')
+            self.assertEqual(os.listdir(self.profile_dir), [])
+            Client().get(reverse('providers'), HTTP_X_PROFILE='s3cret')
+            self.assertEqual(len(os.listdir(os.path.join(self.profile_dir, 'providers'))), 2)
+            out = StringIO()
+            call_command('profile_report', stdout=out)
+        self.assertIn('== providers (1 samples)', out.getvalue())
+        self.assertIn('queries', out.getvalue())
+        self.assertIn('FROM "services_serviceprovider"', out.getvalue())
+
+    def test_report_ranks_statements_by_total_time(self):
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        from .profiling import normalize_sql
+        self.assertEqual(
+            normalize_sql('SELECT * FROM "t" WHERE "id" IN (%s, %s)  AND x = \'a\' LIMIT 20 OFFSET 40'),
+            'SELECT * FROM "t" WHERE "id" IN (...) AND x = ? LIMIT ? OFFSET ?',
+        )
+        os.makedirs(os.path.join(self.profile_dir, 'providers'))
+        with self._settings(PATHS=['/about/']):
+            Client().get(reverse('about'))
+        dump = next(p for p in os.listdir(os.path.join(self.profile_dir, 'about')) if p.endswith('.prof'))
+        for i, statements in enumerate([{'SELECT a': [1, 0.001], 'SELECT b': [3, 0.009]}, {'SELECT a': [2, 0.004]}]):
+            shutil.copy(os.path.join(self.profile_dir, 'about', dump),
+                        os.path.join(self.profile_dir, 'providers', f'{i}.prof'))
+            with open(os.path.join(self.profile_dir, 'providers', f'{i}.json'), 'w') as f:
+                json.dump({'seconds': 0.1, 'sql_count': 0, 'sql_seconds': 0.0, 'template_seconds': 0.0,
+                           'statements': statements}, f)
+        out = StringIO()
+        call_command('profile_report', dir=self.profile_dir, view='providers', statements=1, stdout=out)
+        lines = [line for line in out.getvalue().splitlines() if ' ms SQL ' in line]
+        self.assertEqual(len(lines), 1)
+        self.assertIn('4.50 ms SQL      1.5 calls  SELECT b', lines[0])
+
+    def test_path_prefix_triggers_profile(self):
+        with self._settings(PATHS=['/about/']):
+            Client().get(reverse('about'))
+        self.assertEqual(os.listdir(self.profile_dir), ['about'])
+
+    def test_header_is_ignored_without_a_secret(self):
+        with self._settings(SECRET=''):
+            Client().get(reverse('about'), HTTP_X_PROFILE='')
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_only_newest_samples_are_kept(self):
+        with self._settings(PATHS=['/about/'], MAX_SAMPLES=2):
+            for _ in range(4):
+                Client().get(reverse('about'))
+        self.assertEqual(len(os.listdir(os.path.join(self.profile_dir, 'about'))), 4)
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_endpoint_reports_latency_by_url_name(self):
+        self.client.get(reverse('providers'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE ecoconnect_http_request_duration_seconds histogram', body)
+        self.assertIn('ecoconnect_http_request_duration_seconds_bucket{view="providers",method="GET",le="+Inf"}', body)
+        self.assertIn('ecoconnect_db_queries_total{view="providers"}', body)
+
+    def test_endpoint_is_local_only(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 404)
+
+    def test_booking_outcomes_are_counted(self):
+        from .metrics import BOOKINGS
+        user = User.objects.create_user(username='customer', password='testpass123')
+        provider = ServiceProvider.objects.create(user=user, name="Metered", service_type="solar", location="Windsor")
+        tomorrow = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=provider, date=tomorrow)
+        before = dict(BOOKINGS.values)
+        self.client.force_login(user)
+        data = {'provider': provider.id, 'booking_date': tomorrow.isoformat()}
+        self.client.post(reverse('book_service'), data)
+        self.client.post(reverse('book_service'), data)
+        self.assertEqual(BOOKINGS.values[('success',)] - before.get(('success',), 0), 1)
+        self.assertEqual(BOOKINGS.values[('conflict',)] - before.get(('conflict',), 0), 1)
+
+    def test_snapshots_from_other_workers_are_merged(self):
+        from .metrics import REGISTRY, REQUESTS
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        dead_pid = 2 ** 22 + 1  # above the default pid_max, so never a live process
+        with open(os.path.join(directory, f'{dead_pid}-1.json'), 'w') as f:
+            f.write('{"ecoconnect_http_requests_total": [[["merged-view", "200"], 5]],'
+                    ' "ecoconnect_email_queue_depth": [[[], 3]]}')
+        with override_settings(METRICS_MULTIPROC_DIR=directory):
+            REQUESTS.inc(view='merged-view', status=200)
+            merged = REGISTRY.collect()
+        self.assertEqual(merged['ecoconnect_http_requests_total'][('merged-view', '200')], 6)
+        # Gauges from exited workers are dropped.
+        self.assertEqual(merged['ecoconnect_email_queue_depth'].get((), 0), 0)
+
+    def test_exited_workers_are_archived_and_reused_pids_keep_totals(self):
+        from .metrics import REGISTRY, REQUESTS
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Two generations of a recycled worker whose pid is still in use by the second one.
+        for started, count in [(1, 5), (2, 7)]:
+            with open(os.path.join(directory, f'{os.getppid()}-{started}.json'), 'w') as f:
+                f.write(f'{{"ecoconnect_http_requests_total": [[["archived-view", "200"], {count}]]}}')
+        with override_settings(METRICS_MULTIPROC_DIR=directory):
+            first = REGISTRY.collect()['ecoconnect_http_requests_total'][('archived-view', '200')]
+            self.assertEqual(
+                {n for n in os.listdir(directory) if not n.startswith('.')}, {'archive.json', f'{os.getppid()}-2.json'}
+            )
+            # Archived totals are counted once, however often the endpoint is scraped.
+            second = REGISTRY.collect()['ecoconnect_http_requests_total'][('archived-view', '200')]
+        self.assertEqual((first, second), (12, 12))
+
+class AvailabilitySummaryTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=self.owner, name="Summary Solar", service_type="solar", location="Windsor"
+        )
+        self.today = timezone.now().date()
+
+    def _summary(self, provider=None):
+        provider = provider or self.provider
+        provider.refresh_from_db()
+        return provider.next_free_date, provider.open_slot_count
+
+    def test_write_paths_keep_summary_current(self):
+        d1, d2 = self.today + timedelta(days=1), self.today + timedelta(days=2)
+        ProviderAvailability.objects.create(provider=self.provider, date=d2)
+        avail = ProviderAvailability.objects.create(provider=self.provider, date=d1)
+        self.assertEqual(self._summary(), (d1, 2))
+        booking = Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=d1)
+        self.assertEqual(self._summary(), (d2, 1))
+        booking.delete()
+        self.assertEqual(self._summary(), (d1, 2))
+        avail.delete()
+        self.assertEqual(self._summary(), (d2, 1))
+
+    def test_saving_a_stale_instance_does_not_clobber_summary(self):
+        stale = ServiceProvider.objects.get(pk=self.provider.pk)
+        ProviderAvailability.objects.create(provider=self.provider, date=self.today + timedelta(days=1))
+        stale.bio = "Updated bio"
+        stale.save()
+        self.assertEqual(self._summary(), (self.today + timedelta(days=1), 1))
+
+    def test_roll_forward_advances_past_dates(self):
+        from django.core.management import call_command
+        ProviderAvailability.objects.create(provider=self.provider, date=self.today + timedelta(days=4))
+        ProviderAvailability.objects.bulk_create([ProviderAvailability(provider=self.provider, date=self.today - timedelta(days=1))])
+        ServiceProvider.objects.filter(pk=self.provider.pk).update(
+            next_free_date=self.today - timedelta(days=1), open_slot_count=2
+        )
+        call_command('roll_availability', stdout=StringIO())
+        self.assertEqual(self._summary(), (self.today + timedelta(days=4), 1))
+
+    def test_reconcile_repairs_drift(self):
+        from django.core.management import call_command
+        ProviderAvailability.objects.create(provider=self.provider, date=self.today + timedelta(days=1))
+        ServiceProvider.objects.filter(pk=self.provider.pk).update(next_free_date=None, open_slot_count=0)
+        out = StringIO()
+        call_command('reconcile_availability', dry_run=True, stdout=out)
+        self.assertIn('Found 1 with drift', out.getvalue())
+        self.assertEqual(self._summary(), (None, 0))
+        out = StringIO()
+        call_command('reconcile_availability', batch_size=1, stdout=out)
+        self.assertIn('Repaired 1 with drift', out.getvalue())
+        self.assertEqual(self._summary(), (self.today + timedelta(days=1), 1))
+
+    def test_directory_sorts_and_filters_on_summary(self):
+        later = ServiceProvider.objects.create(user=self.owner, name="Later", service_type="solar", location="Windsor")
+        idle = ServiceProvider.objects.create(user=self.owner, name="Idle", service_type="solar", location="Windsor")
+        ProviderAvailability.objects.create(provider=self.provider, date=self.today + timedelta(days=1))
+        ProviderAvailability.objects.create(provider=later, date=self.today + timedelta(days=5))
+        response = Client().get(reverse('providers'), {'sort': 'soonest'})
+        self.assertEqual(list(response.context['providers']), [self.provider, later, idle])
+        response = Client().get(reverse('providers'), {'has_open_dates': 'on'})
+        self.assertEqual(set(response.context['providers']), {self.provider, later})
+
+class ReminderSchedulerTest(TestCase):
+    def setUp(self):
+        self.tomorrow = timezone.now().date() + timedelta(days=1)
+        owner = User.objects.create_user(username='owner', password='testpass123', email='owner@test.com')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Busy Compost", service_type="compost", location="Windsor"
+        )
+        crews = [self.provider] + [
+            ServiceProvider.objects.create(user=owner, name=f"Crew {i}", service_type="compost", location="Windsor")
+            for i in range(2)
+        ]
+        for i, crew in enumerate(crews):
+            customer = User.objects.create_user(username=f'customer{i}', password='testpass123', email=f'c{i}@test.com')
+            ProviderAvailability.objects.create(provider=crew, date=self.tomorrow)
+            Booking.objects.create(customer=customer, provider=crew, booking_date=self.tomorrow)
+
+    def test_groups_per_recipient_and_is_idempotent(self):
+        from django.core import mail
+        from django.core.management import call_command
+        call_command('send_reminders', concurrency=2, batch_size=2, stdout=StringIO())
+        subjects = sorted(m.subject for m in mail.outbox)
+        # Three customer reminders and a single digest for the provider owner.
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(subjects.count("EcoConnect: 3 booking(s) on %s" % self.tomorrow), 1)
+        call_command('send_reminders', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(ReminderDispatch.objects.filter(sent_at__isnull=True).exists())
+
+    def test_failed_sends_are_released_for_retry(self):
+        from unittest import mock
+        from django.core import mail
+        from django.core.management import call_command
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError("smtp down")):
+            call_command('send_reminders', stdout=StringIO())
+        self.assertEqual(ReminderDispatch.objects.count(), 0)
+        call_command('send_reminders', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_unreachable_mail_server_releases_claims(self):
+        from unittest import mock
+        from django.core import mail
+        from django.core.management import call_command
+        from .metrics import EMAIL_QUEUE_DEPTH
+        depth = EMAIL_QUEUE_DEPTH.values.get((), 0)
+        with mock.patch('services.notifications.get_connection', side_effect=OSError("smtp down")):
+            out = StringIO()
+            call_command('send_reminders', stdout=out)
+        self.assertIn('0 message(s)', out.getvalue())
+        self.assertEqual(ReminderDispatch.objects.count(), 0)
+        self.assertEqual(EMAIL_QUEUE_DEPTH.values.get((), 0), depth)
+        call_command('send_reminders', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_accounts_sharing_an_address_get_one_reminder(self):
+        from django.core import mail
+        from django.core.management import call_command
+        User.objects.filter(username='customer1').update(email='c0@test.com')
+        call_command('send_reminders', stdout=StringIO())
+        shared = [m for m in mail.outbox if m.to == ['c0@test.com']]
+        self.assertEqual(len(shared), 1)
+        self.assertEqual(shared[0].body.count('- '), 2)
+
+class IntervalBookingTest(TestCase):
+    def setUp(self):
+        from datetime import time
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Hourly Compost", service_type="compost", location="Windsor"
+        )
+        self.day = timezone.now().date() + timedelta(days=1)
+        # One crew selling up to eight slots that day.
+        ProviderAvailability.objects.create(
+            provider=self.provider, date=self.day, start_time=time(8), end_time=time(17), capacity=8
+        )
+        for i in (1, 2):
+            ProviderAvailability.objects.create(provider=self.provider, date=self.day + timedelta(days=i))
+
+    def _at(self, hour, day=None):
+        from datetime import datetime, time
+        return timezone.make_aware(datetime.combine(day or self.day, time(hour)))
+
+    def _form(self, **extra):
+        from .forms import BookingForm
+        data = {'provider': self.provider.id, 'booking_date': self.day.isoformat()}
+        data.update(extra)
+        return BookingForm(data=data)
+
+    def test_day_booking_takes_the_availability_window(self):
+        booking = Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.day)
+        self.assertEqual((booking.starts_at, booking.ends_at), (self._at(8), self._at(17)))
+        self.assertEqual(booking.end_date, self.day)
+
+    def test_hourly_slots_share_a_day_but_cannot_overlap(self):
+        from django.db import IntegrityError
+        Booking.objects.create(customer=self.customer, provider=self.provider, starts_at=self._at(9), ends_at=self._at(10))
+        Booking.objects.create(customer=self.customer, provider=self.provider, starts_at=self._at(10), ends_at=self._at(11))
+        with self.assertRaises(IntegrityError):
+            Booking.objects.create(customer=self.customer, provider=self.provider, starts_at=self._at(8), ends_at=self._at(12))
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_form_books_slot_and_reports_conflicts(self):
+        form = self._form(start_time='09:00', end_time='10:00')
+        self.assertTrue(form.is_valid(), form.errors)
+        booking = form.save(commit=False)
+        booking.customer = self.customer
+        booking.save()
+        self.assertTrue(self._form(start_time='10:00', end_time='11:00').is_valid())
+        clash = self._form(start_time='09:30', end_time='10:30')
+        self.assertFalse(clash.is_valid())
+        self.assertTrue(clash.has_error('__all__', 'booked'))
+
+    def test_form_rejects_times_outside_window(self):
+        self.assertFalse(self._form(start_time='06:00', end_time='09:00').is_valid())
+
+    def test_multi_day_booking_closes_every_day_it_spans(self):
+        form = self._form(end_date=(self.day + timedelta(days=2)).isoformat())
+        self.assertTrue(form.is_valid(), form.errors)
+        booking = form.save(commit=False)
+        booking.customer = self.customer
+        booking.save()
+        self.assertEqual(booking.end_date, self.day + timedelta(days=2))
+        self.assertEqual(
+            list(ProviderAvailability.objects.open().filter(provider=self.provider).values_list('date', 'remaining')),
+            [(self.day, 7)],
+        )
+        # The first day still has capacity, but its only crew is busy all day.
+        self.assertTrue(self._form(start_time='15:00', end_time='16:00').has_error('__all__', 'booked'))
+
+    def test_multi_day_booking_needs_availability_on_every_day(self):
+        form = self._form(end_date=(self.day + timedelta(days=3)).isoformat())
+        self.assertFalse(form.is_valid())
+
+    def test_blank_capacity_on_timed_window_sells_hourly_slots(self):
+        from datetime import time
+        day = self.day + timedelta(days=5)
+        slot = ProviderAvailability.objects.create(provider=self.provider, date=day, start_time=time(9), end_time=time(12))
+        self.assertEqual((slot.capacity, slot.remaining), (3, 3))
+        for hour in (9, 10, 11):
+            Booking.objects.create(
+                customer=self.customer, provider=self.provider, starts_at=self._at(hour, day), ends_at=self._at(hour + 1, day)
+            )
+        self.assertFalse(ProviderAvailability.objects.open().filter(date=day).exists())
+
+    def test_moving_a_booking_rechecks_capacity_and_crews(self):
+        from django.db import IntegrityError
+        first = Booking.objects.create(customer=self.customer, provider=self.provider, starts_at=self._at(9), ends_at=self._at(10))
+        Booking.objects.create(customer=self.customer, provider=self.provider, starts_at=self._at(11), ends_at=self._at(12))
+        first.starts_at, first.ends_at = self._at(11), self._at(13)
+        with self.assertRaises(IntegrityError):
+            first.save()
+        # Moved to the next (whole-day) date: that day's capacity is claimed and this one's returned.
+        first = Booking.objects.get(pk=first.pk)
+        first.booking_date = self.day + timedelta(days=1)
+        first.save()
+        first.refresh_from_db()
+        self.assertEqual((first.starts_at, first.ends_at), (self._at(0, first.booking_date), self._at(0, self.day + timedelta(days=2))))
+        remaining = dict(ProviderAvailability.objects.values_list('date', 'remaining'))
+        self.assertEqual((remaining[self.day], remaining[self.day + timedelta(days=1)]), (7, 0))
+        other = User.objects.create_user(username='other', password='testpass123')
+        with self.assertRaises(IntegrityError):
+            Booking.objects.create(customer=other, provider=self.provider, booking_date=self.day + timedelta(days=1))
+
+    def test_overlap_lookup_is_a_single_query(self):
+        from .scheduling import find_overlap
+        Booking.objects.create(customer=self.customer, provider=self.provider, starts_at=self._at(9), ends_at=self._at(10))
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(find_overlap(self.provider.id, self._at(9), self._at(12)))
+        with self.assertNumQueries(1):
+            self.assertIsNone(find_overlap(self.provider.id, self._at(10), self._at(12)))
+
+class DailyCapacityTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Big Insulation", service_type="insulation", location="Windsor"
+        )
+        self.day = timezone.now().date() + timedelta(days=1)
+        self.availability = ProviderAvailability.objects.create(
+            provider=self.provider, date=self.day, capacity=2, crews=2
+        )
+        self.customers = [User.objects.create_user(username=f'c{i}', password='testpass123') for i in range(3)]
+
+    def _book(self, customer):
+        return Booking.objects.create(customer=customer, provider=self.provider, booking_date=self.day)
+
+    def test_two_crews_take_two_whole_day_bookings(self):
+        from django.db import IntegrityError
+        first, second = self._book(self.customers[0]), self._book(self.customers[1])
+        self.assertEqual((first.crew, second.crew), (0, 1))
+        with self.assertRaises(IntegrityError):
+            self._book(self.customers[2])
+        self.availability.refresh_from_db()
+        self.assertEqual(self.availability.remaining, 0)
+        self.assertFalse(ProviderAvailability.objects.open().exists())
+
+    def test_cancellation_gives_capacity_back(self):
+        booking = self._book(self.customers[0])
+        self._book(self.customers[1])
+        booking.delete()
+        self.availability.refresh_from_db()
+        self.assertEqual(self.availability.remaining, 1)
+        self.provider.refresh_from_db()
+        self.assertEqual(self.provider.next_free_date, self.day)
+        self.assertEqual(self._book(self.customers[2]).crew, 0)
+
+    def test_editing_capacity_recounts_remaining(self):
+        self._book(self.customers[0])
+        self.availability.capacity = 5
+        self.availability.save()
+        self.availability.refresh_from_db()
+        self.assertEqual(self.availability.remaining, 4)
+
+    def test_reconcile_repairs_drifted_counters(self):
+        from django.core.management import call_command
+        self._book(self.customers[0])
+        ProviderAvailability.objects.update(remaining=2)
+        out = StringIO()
+        call_command('reconcile_availability', stdout=out)
+        self.assertIn('1 drifted capacity counter', out.getvalue())
+        self.availability.refresh_from_db()
+        self.assertEqual(self.availability.remaining, 1)
+
+
+class CapacityStressTest(TransactionTestCase):
+    def test_concurrent_bookings_never_overbook(self):
+        from django.db import IntegrityError, OperationalError
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        provider = ServiceProvider.objects.create(
+            user=owner, name="Busy Solar", service_type="solar", location="Windsor"
+        )
+        day = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=provider, date=day, capacity=3, crews=3)
+        customers = [User.objects.create_user(username=f'c{i}', password='testpass123') for i in range(12)]
+
+        outcomes = []
+        barrier = threading.Barrier(len(customers))
+
+        def worker(customer):
+            try:
+                barrier.wait()
+                for _ in range(50):
+                    try:
+                        Booking.objects.create(customer=customer, provider=provider, booking_date=day)
+                        outcomes.append('booked')
+                    except IntegrityError:
+                        outcomes.append('full')
+                    except OperationalError:
+                        # SQLite's shared-cache test database reports lock contention
+                        # instead of waiting; try again.
+                        time.sleep(0.01)
+                        continue
+                    return
+                outcomes.append('gave up')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(c,)) for c in customers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(outcomes.count('booked'), 3)
+        self.assertEqual(outcomes.count('full'), len(customers) - 3)
+        self.assertEqual(Booking.objects.filter(provider=provider).count(), 3)
+        self.assertEqual(
+            sorted(Booking.objects.filter(provider=provider).values_list('crew', flat=True)), [0, 1, 2]
+        )
+        self.assertEqual(ProviderAvailability.objects.get(provider=provider).remaining, 0)
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='customer', password='testpass123', email='c@example.com')
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Retry Solar", service_type="solar", location="Windsor"
+        )
+        self.day = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day, capacity=5, crews=5)
+        self.client.force_login(self.user)
+        self.data = {'provider': self.provider.id, 'booking_date': self.day.isoformat()}
+
+    def _book(self, key, **extra):
+        return self.client.post(reverse('book_service'), dict(self.data, **extra), HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_booking_replays_without_touching_bookings(self):
+        from django.core import mail
+        first = self._book('abc')
+        self.assertRedirects(first, reverse('user_history'), fetch_redirect_response=False)
+        with self.assertNumQueries(2):  # session and user only; the outcome comes from the cache
+            retry = self._book('abc')
+        self.assertEqual(retry.status_code, 302)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_database_fallback_when_cache_is_cold(self):
+        self._book('abc')
+        cache.clear()
+        self.assertEqual(self._book('abc')['Idempotent-Replayed'], 'true')
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_form_token_and_new_keys(self):
+        self.client.post(reverse('book_service'), dict(self.data, idempotency_key='form-1'))
+        self.client.post(reverse('book_service'), dict(self.data, idempotency_key='form-1'))
+        self.assertEqual(Booking.objects.count(), 1)
+        self._book('form-2')
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_reused_key_with_different_payload_is_rejected(self):
+        self._book('abc')
+        response = self._book('abc', end_time='12:00')
+        self.assertEqual(response.status_code, 422)
+
+    def test_in_flight_key_gets_409(self):
+        from .idempotency import _digest
+        from .models import IdempotencyKey
+        from .idempotency import request_fingerprint
+        request = RequestFactory().post(reverse('book_service'), self.data)
+        IdempotencyKey.objects.create(
+            key=_digest('book', self.user.pk, 'abc'),
+            fingerprint=request_fingerprint(request),
+            expires_at=timezone.now() + timedelta(minutes=1),
+        )
+        self.assertEqual(self._book('abc').status_code, 409)
+        self.assertEqual(Booking.objects.count(), 0)
+
+    def test_failed_attempt_can_be_retried_with_the_same_key(self):
+        ProviderAvailability.objects.update(remaining=0)
+        self.assertEqual(self._book('abc').status_code, 200)
+        ProviderAvailability.objects.update(remaining=5)
+        self.assertEqual(self._book('abc').status_code, 302)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_retried_cancellation_replays_instead_of_404(self):
+        booking = Booking.objects.create(customer=self.user, provider=self.provider, booking_date=self.day)
+        url = reverse('cancel_booking', args=[booking.id])
+        first = self.client.post(url, {'idempotency_key': f'k-{booking.id}'})
+        retry = self.client.post(url, {'idempotency_key': f'k-{booking.id}'})
+        self.assertEqual((first.status_code, retry.status_code), (302, 302))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+    def test_failed_cancellation_is_not_replayed(self):
+        from unittest import mock
+        booking = Booking.objects.create(customer=self.user, provider=self.provider, booking_date=self.day)
+        url = reverse('cancel_booking', args=[booking.id])
+        with mock.patch('services.waitlist.promote', side_effect=RuntimeError("db went away")):
+            failed = self.client.post(url, {'idempotency_key': 'cancel-1'})
+        self.assertEqual(failed.status_code, 503)
+        self.assertContains(failed, 'Failed to cancel booking', status_code=503)
+        self.assertTrue(Booking.objects.filter(pk=booking.pk).exists())
+        retry = self.client.post(url, {'idempotency_key': 'cancel-1'})
+        self.assertEqual(retry.status_code, 302)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertFalse(Booking.objects.filter(pk=booking.pk).exists())
+
+    def test_sweeper_deletes_expired_keys_in_batches(self):
+        from django.core.management import call_command
+        from .models import IdempotencyKey
+        now = timezone.now()
+        IdempotencyKey.objects.bulk_create(
+            [IdempotencyKey(key=f'old{i}', fingerprint='x', status=302, expires_at=now - timedelta(hours=1)) for i in range(5)]
+            + [IdempotencyKey(key='fresh', fingerprint='x', status=302, expires_at=now + timedelta(hours=1))]
+        )
+        out = StringIO()
+        call_command('sweep_idempotency_keys', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+
+class ProviderClosureTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=self.owner, name="Closing Solar", service_type="solar", location="Windsor"
+        )
+        self.today = timezone.now().date()
+        for i in range(1, 8):
+            ProviderAvailability.objects.create(
+                provider=self.provider, date=self.today + timedelta(days=i), capacity=50, crews=50
+            )
+        self.customers = User.objects.bulk_create(
+            [User(username=f'c{i}', email=f'c{i}@example.com') for i in range(40)]
+        )
+        day = self.today + timedelta(days=2)
+        for customer in self.customers:
+            Booking.objects.create(customer=customer, provider=self.provider, booking_date=day)
+        # A three-day job starting before the closure and a booking after it.
+        self.spanning = Booking.objects.create(
+            customer=self.customers[0], provider=self.provider,
+            booking_date=self.today + timedelta(days=1), end_date=self.today + timedelta(days=3),
+            starts_at=self._at(1), ends_at=self._at(4),
+        )
+        self.kept = Booking.objects.create(
+            customer=self.customers[1], provider=self.provider, booking_date=self.today + timedelta(days=6)
+        )
+
+    def _at(self, days):
+        from datetime import datetime, time
+        return timezone.make_aware(datetime.combine(self.today + timedelta(days=days), time.min))
+
+    def test_close_dates_uses_set_based_writes(self):
+        from django.core import mail
+        from .closures import close_dates
+        from .notifications import send_outbox
+        # Constant in the number of bookings: no per-row signal work.
+        with self.captureOnCommitCallbacks(), self.assertNumQueries(14):
+            summary = close_dates(self.provider, self.today + timedelta(days=2), self.today + timedelta(days=4))
+        self.assertEqual(send_outbox(), (40, 0))
+
+        self.assertEqual(summary, {'bookings': 41, 'dates': 3, 'customers': 40})
+        self.assertEqual(list(Booking.objects.values_list('pk', flat=True)), [self.kept.pk])
+        self.assertEqual(len(mail.outbox), 40)
+        remaining = dict(ProviderAvailability.objects.values_list('date', 'remaining'))
+        # The spanning booking's first day got its capacity back; the later booking keeps its claim.
+        self.assertEqual(remaining[self.today + timedelta(days=1)], 50)
+        self.assertEqual(remaining[self.today + timedelta(days=6)], 49)
+        self.provider.refresh_from_db()
+        self.assertEqual(self.provider.open_slot_count, 4)
+
+    def test_closure_emails_are_kept_until_sent(self):
+        from unittest import mock
+        from django.core import mail
+        from django.core.management import call_command
+        from .closures import close_dates
+        from .models import OutboundEmail
+        with self.captureOnCommitCallbacks():
+            close_dates(self.provider, self.today + timedelta(days=2), self.today + timedelta(days=2))
+        with mock.patch('services.notifications.get_connection', side_effect=OSError("smtp down")):
+            call_command('send_outbox', min_age=0, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.filter(sent_at__isnull=True, attempts=1).count(), 40)
+
+        out = StringIO()
+        call_command('send_outbox', min_age=0, stdout=out)
+        self.assertEqual(len(mail.outbox), 40)
+        self.assertIn('Sent 40 email(s); 0 failed', out.getvalue())
+        self.assertFalse(OutboundEmail.objects.filter(sent_at__isnull=True).exists())
+
+    def test_rolled_back_closure_sends_nothing(self):
+        from .closures import close_dates
+        from .models import OutboundEmail
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            close_dates(self.provider, self.today + timedelta(days=2), self.today + timedelta(days=4))
+            raise RuntimeError
+        self.assertFalse(OutboundEmail.objects.exists())
+        self.assertEqual(Booking.objects.count(), 42)
+
+    def test_owner_closes_dates_from_the_availability_page(self):
+        self.client.force_login(self.owner)
+        url = reverse('close_availability', args=[self.provider.id])
+        data = {
+            'start_date': (self.today + timedelta(days=1)).isoformat(),
+            'end_date': (self.today + timedelta(days=7)).isoformat(),
+            'idempotency_key': 'close-1',
+        }
+        response = self.client.post(url, data, follow=True)
+        self.assertContains(response, 'cancelled 42 booking(s), removed 7 date(s) and notified 40 customer(s)')
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def test_other_users_cannot_close_dates(self):
+        intruder = User.objects.create_user(username='intruder', password='testpass123')
+        self.client.force_login(intruder)
+        url = reverse('close_availability', args=[self.provider.id])
+        response = self.client.post(url, {'start_date': self.today.isoformat(), 'end_date': self.today.isoformat()})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Booking.objects.count(), 42)
+
+
+class DemandRollupTest(TestCase):
+    def setUp(self):
+        from .models import RollupDirtyDay
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        self.solar = ServiceProvider.objects.create(user=owner, name="Sun", service_type="solar", location="Windsor")
+        self.compost = ServiceProvider.objects.create(user=owner, name="Heap", service_type="compost", location="Windsor")
+        self.day = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.solar, date=self.day, capacity=4, crews=4)
+        ProviderAvailability.objects.create(provider=self.compost, date=self.day, capacity=2, crews=2)
+        Booking.objects.create(customer=self.customer, provider=self.solar, booking_date=self.day)
+        self.RollupDirtyDay = RollupDirtyDay
+
+    def _rollups(self):
+        from .models import DemandRollup
+        return {
+            r.service_type: (r.bookings, r.offered, r.filled)
+            for r in DemandRollup.objects.filter(day=self.day)
+        }
+
+    def test_writes_mark_days_and_job_recomputes_them(self):
+        from django.core.management import call_command
+        self.assertTrue(self.RollupDirtyDay.objects.filter(day=self.day).exists())
+        out = StringIO()
+        call_command('update_demand_rollups', stdout=out)
+        self.assertIn('Recomputed 1 day(s) from 3 change mark(s)', out.getvalue())
+        self.assertEqual(self._rollups(), {'solar': (1, 4, 1), 'compost': (0, 2, 0)})
+        self.assertFalse(self.RollupDirtyDay.objects.exists())
+
+        Booking.objects.filter(provider=self.solar).first().delete()
+        call_command('update_demand_rollups', stdout=StringIO())
+        self.assertEqual(self._rollups()['solar'], (0, 4, 0))
+
+    def test_marks_written_during_a_run_survive(self):
+        from .analytics import update_dirty_days
+        from unittest import mock
+        from . import analytics
+        original = analytics.recompute_days
+
+        def recompute_then_write(days):
+            original(days)
+            Booking.objects.create(customer=self.customer, provider=self.compost, booking_date=self.day)
+
+        with mock.patch.object(analytics, 'recompute_days', recompute_then_write):
+            update_dirty_days()
+        self.assertTrue(self.RollupDirtyDay.objects.exists())
+        update_dirty_days()
+        self.assertEqual(self._rollups()['compost'], (1, 2, 1))
+
+    def test_changing_a_providers_group_moves_its_history(self):
+        from .analytics import update_dirty_days
+        update_dirty_days()
+        self.solar.service_type = 'wind'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.solar.save()
+        update_dirty_days()
+        self.assertEqual(self._rollups(), {'wind': (1, 4, 1), 'compost': (0, 2, 0)})
+
+    def test_backfill_rebuilds_in_chunks(self):
+        from django.core.management import call_command
+        self.RollupDirtyDay.objects.all().delete()
+        out = StringIO()
+        call_command('backfill_demand_rollups', chunk_days=1, stdout=out)
+        self.assertIn('Rebuilt 2 rollup row(s)', out.getvalue())
+        self.assertEqual(self._rollups(), {'solar': (1, 4, 1), 'compost': (0, 2, 0)})
+
+    def test_staff_report_reads_only_rollups(self):
+        from .analytics import recompute_days
+        recompute_days([self.day])
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_login(staff)
+        url = reverse('demand_report') + f'?start={self.day}&end={self.day}'
+        tables = []
+
+        def record(execute, sql, params, many, context):
+            tables.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.client.get(url)
+        self.assertContains(response, '25%')
+        self.assertFalse([sql for sql in tables if 'services_booking' in sql])
+
+    def test_report_is_staff_only(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse('demand_report')).status_code, 302)
+
+    def test_report_range_is_capped(self):
+        from .forms import DemandReportForm
+        end = self.day + timedelta(days=DemandReportForm.MAX_RANGE_DAYS - 1)
+        self.assertTrue(DemandReportForm({'start': self.day, 'end': end}).is_valid())
+        form = DemandReportForm({'start': self.day, 'end': end + timedelta(days=1)})
+        self.assertFalse(form.is_valid())
+        self.assertIn('at most 366 days', str(form.non_field_errors()))
+
+
+class IndexAdvisorTest(TestCase):
+    def test_hot_queries_use_indexes(self):
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('index_advisor', fail_on_issues=True, stdout=out)
+        self.assertIn('0 of', out.getvalue())
+
+    def test_flags_full_scans_and_temp_sorts(self):
+        from .management.commands.index_advisor import plan_issues
+        plan = "5 0 0 SCAN services_booking\n9 0 0 SEARCH services_booking USING INDEX x (customer_id=?)\n" \
+               "12 0 0 SCAN services_serviceprovider USING INDEX provider_created_idx\n" \
+               "15 0 0 SCAN services_serviceprovider USING COVERING INDEX provider_created_idx\n" \
+               "20 0 0 USE TEMP B-TREE FOR ORDER BY"
+        self.assertEqual(
+            [issue.split(':')[0] for issue in plan_issues(plan, 'sqlite')], ['full scan', 'index scan', 'temp sort']
+        )
+        pg = "Limit\n  ->  Sort\n        ->  Seq Scan on services_serviceprovider"
+        self.assertEqual(len(plan_issues(pg, 'postgresql')), 2)
+
+    def test_accepted_sort_does_not_hide_a_full_scan(self):
+        from unittest import mock
+        from django.core.management import CommandError, call_command
+        plan = mock.Mock()
+        plan.explain.return_value = "5 0 0 SCAN services_serviceprovider\n98 0 0 USE TEMP B-TREE FOR ORDER BY"
+        with mock.patch(
+            'services.management.commands.index_advisor.hot_queries',
+            return_value=[('providers: free in date range', plan)],
+        ):
+            with self.assertRaisesMessage(CommandError, '1 of 1 hot queries flagged'):
+                call_command('index_advisor', fail_on_issues=True, stdout=StringIO())
+
+    def test_flags_a_scan_through_an_unselective_index(self):
+        from unittest import mock
+        from django.core.management import CommandError, call_command
+        scan = ServiceProvider.objects.filter(location__icontains='Wind').order_by('-created_at')[:20]
+        out = StringIO()
+        with mock.patch(
+            'services.management.commands.index_advisor.hot_queries', return_value=[('directory: by region', scan)],
+        ):
+            with self.assertRaisesMessage(CommandError, '1 of 1 hot queries flagged'):
+                call_command('index_advisor', fail_on_issues=True, stdout=out)
+        self.assertIn('index scan: ', out.getvalue())
+
+
+class LiveAvailabilityTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Live Solar", service_type="solar", location="Windsor"
+        )
+        self.day = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day)
+
+    def test_fan_out_shares_one_event_per_channel(self):
+        import asyncio
+        from .live import InProcessBroker
+
+        async def scenario():
+            broker = InProcessBroker()
+            subscriptions = [broker.subscribe('c') for _ in range(2000)]
+            self.assertEqual(len(broker._channels), 1)
+            waiters = [asyncio.ensure_future(s.next(5)) for s in subscriptions]
+            await asyncio.sleep(0)
+            # Published from another thread, as an on_commit hook in a sync view would.
+            thread = threading.Thread(target=broker.publish, args=('c', lambda: ['2030-01-01']))
+            thread.start()
+            results = await asyncio.gather(*waiters)
+            thread.join()
+            self.assertTrue(all(r == (1, ['2030-01-01']) for r in results))
+            for s in subscriptions:
+                s.close()
+            self.assertFalse(broker.has_subscribers('c'))
+            self.assertFalse(broker.publish('c', lambda: self.fail('producer ran without listeners')))
+
+        asyncio.run(scenario())
+
+    async def test_stream_sends_snapshot_then_updates_from_other_workers(self):
+        from unittest import mock
+        from . import live
+        with mock.patch.object(live, '_broker', live.CacheBroker(poll_seconds=0.01)):
+            response = await self.async_client.get(reverse('availability_stream', args=[self.provider.id]))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = response.streaming_content
+            self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+            self.assertIn(self.day.isoformat().encode(), await anext(chunks))
+
+            # Another worker process, sharing only the cache.
+            other_worker = live.CacheBroker(poll_seconds=0.01)
+            self.assertTrue(other_worker.publish(live.provider_channel(self.provider.id), lambda: []))
+            update = await anext(chunks)
+            self.assertIn(b'id: 1\nevent: availability\n', update)
+            self.assertIn(b'"free_dates": []', update)
+            await chunks.aclose()
+
+    def test_cache_broker_polls_once_per_channel_while_subscribed(self):
+        import asyncio
+        from .live import CacheBroker
+
+        async def scenario():
+            broker = CacheBroker(poll_seconds=0.01)
+            self.assertFalse(broker.publish('c', lambda: self.fail('producer ran without listeners')))
+            subscriptions = [broker.subscribe('c') for _ in range(3)]
+            self.assertEqual(len(broker._pollers), 1)
+            for s in subscriptions:
+                s.close()
+            self.assertEqual(broker._pollers, {})
+
+        asyncio.run(scenario())
+
+    def test_wsgi_stream_sends_one_snapshot_and_closes(self):
+        response = self.client.get(reverse('availability_stream', args=[self.provider.id]))
+        self.assertFalse(response.streaming)
+        body = response.content.decode()
+        self.assertTrue(body.startswith('retry: 10000\n\n'))
+        self.assertIn(self.day.isoformat(), body)
+
+    def test_schedule_changes_publish_after_commit(self):
+        from unittest import mock
+        from . import live
+        with mock.patch.object(live, 'get_broker') as get_broker, self.captureOnCommitCallbacks(execute=True):
+            customer = User.objects.create_user(username='customer', password='testpass123')
+            Booking.objects.create(customer=customer, provider=self.provider, booking_date=self.day)
+        channel, producer = get_broker.return_value.publish.call_args.args
+        self.assertEqual(channel, live.provider_channel(self.provider.id))
+        self.assertEqual(producer(), [])
+
+
+class ProviderKeywordSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.by_name = ServiceProvider.objects.create(
+            user=owner, name="Heat Pump Pros", service_type="solar", location="Windsor",
+            bio="Family business since 1998.",
+        )
+        self.by_bio = ServiceProvider.objects.create(
+            user=owner, name="Green Home Co", service_type="solar", location="Windsor",
+            bio="Panels, batteries and the occasional heat pump install.",
+        )
+        self.compost = ServiceProvider.objects.create(
+            user=owner, name="Pump Track Compost", service_type="compost", location="Windsor",
+            price_note="Free quote <b>within</b> a day",
+        )
+
+    def _search(self, **params):
+        response = self.client.get(reverse('providers'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['providers'])
+
+    def test_name_matches_rank_above_bio_matches(self):
+        self.assertEqual(self._search(keywords="heat pumps"), [self.by_name, self.by_bio])
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self._search(keywords="batt"), [self.by_bio])
+
+    def test_combines_with_service_type(self):
+        self.assertEqual(self._search(keywords="pump", q="compost"), [self.compost])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        response = self.client.get(reverse('providers'), {'keywords': 'quote'})
+        snippet = response.context['providers'][0].search_snippet
+        self.assertIn('<mark>quote</mark>', snippet)
+        self.assertIn('&lt;b&gt;within&lt;/b&gt;', snippet)
+        self.assertContains(response, '<mark>quote</mark>')
+
+    def test_index_follows_updates_and_deletes(self):
+        from .search import search_providers
+        ServiceProvider.objects.filter(pk=self.by_bio.pk).update(bio="Insulation and windows.")
+        self.assertEqual([pk for pk, _ in search_providers("pump")], [self.by_name.pk, self.compost.pk])
+        self.by_name.delete()
+        self.assertEqual([pk for pk, _ in search_providers("pump")], [self.compost.pk])
+        self.assertEqual([pk for pk, _ in search_providers("windows")], [self.by_bio.pk])
+
+    def test_filters_apply_before_the_top_hits_are_cut(self):
+        from .search import search_providers
+        owner = self.by_name.user
+        wanted = ServiceProvider.objects.create(
+            user=owner, name="Tiny Outfit", service_type="solar", location="Leeds", bio="We fit a heat pump now and then."
+        )
+        leeds = ServiceProvider.objects.filter(location__icontains="leeds")
+        self.assertEqual([pk for pk, _ in search_providers("pump", within=leeds, limit=1)], [wanted.pk])
+        self.assertEqual(self._search(keywords="pump", location="Leeds"), [wanted])
+
+    def test_fallback_without_full_text_search_matches_price_note(self):
+        from unittest import mock
+        with mock.patch('services.search.is_supported', return_value=False):
+            self.assertEqual(self._search(keywords="quote"), [self.compost])
+
+    def test_punctuation_only_query_matches_nothing(self):
+        self.assertEqual(self._search(keywords='"*)'), [])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(username='admin', password='testpass123', email='a@test.com')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:services_serviceprovider_changelist'), {'q': 'batteries'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.by_bio])
+
+
+class HttpCachingTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=self.owner, name="Cached Solar", service_type="solar", location="Windsor",
+            bio="Rooftop panels. " * 100,
+        )
+
+    def _revalidate(self, response, **params):
+        return self.client.get(
+            reverse('providers'), params,
+            HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+
+    def test_unchanged_directory_is_a_304_without_rendering(self):
+        first = self.client.get(reverse('providers'))
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('public', first['Cache-Control'])
+        self.assertIn('Cookie', first['Vary'])
+        with self.assertNumQueries(1):
+            second = self._revalidate(first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.templates, [])
+        self.assertEqual(second.content, b'')
+
+    def test_validators_change_with_the_directory(self):
+        first = self.client.get(reverse('providers'))
+        # Availability only moves the denormalized summary, not the profile fields.
+        ProviderAvailability.objects.create(provider=self.provider, date=timezone.now().date() + timedelta(days=1))
+        self.assertEqual(self._revalidate(first).status_code, 200)
+
+        second = self.client.get(reverse('providers'))
+        ServiceProvider.objects.create(user=self.owner, name="Newcomer", service_type="solar", location="Windsor")
+        self.assertEqual(self._revalidate(second).status_code, 200)
+
+        third = self.client.get(reverse('providers'))
+        ServiceProvider.objects.filter(name="Newcomer").delete()
+        self.assertEqual(self._revalidate(third).status_code, 200)
+
+    def test_deletions_move_last_modified(self):
+        from .models import DirectoryStamp
+        ServiceProvider.objects.create(user=self.owner, name="Newcomer", service_type="solar", location="Windsor")
+        DirectoryStamp.objects.update(changed_at=timezone.now() - timedelta(days=1))
+        first = self.client.get(reverse('providers'))
+        ServiceProvider.objects.filter(name="Newcomer").delete()
+        response = self.client.get(reverse('providers'), HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_bookings_that_change_the_listing_move_the_version(self):
+        from .snapshot import directory_state
+        day = timezone.now().date() + timedelta(days=2)
+        ProviderAvailability.objects.create(provider=self.provider, date=day, capacity=2, crews=2)
+        before = directory_state()
+        Booking.objects.create(customer=self.owner, provider=self.provider, booking_date=day)
+        # Still open on that date: the provider row and the version stay as they were.
+        self.assertEqual(directory_state(), before)
+        customer = User.objects.create_user(username='customer', password='testpass123')
+        Booking.objects.create(customer=customer, provider=self.provider, booking_date=day)
+        self.assertNotEqual(directory_state(), before)
+        self.provider.refresh_from_db()
+        self.assertEqual((self.provider.next_free_date, self.provider.open_slot_count), (None, 0))
+
+    def test_etag_depends_on_filters_and_user(self):
+        first = self.client.get(reverse('providers'))
+        self.assertEqual(self._revalidate(first, q='solar').status_code, 200)
+        self.client.force_login(self.owner)
+        signed_in = self._revalidate(first)
+        self.assertEqual(signed_in.status_code, 200)
+        self.assertIn('private', signed_in['Cache-Control'])
+        self.assertNotIn('public', signed_in['Cache-Control'])
+
+    def test_history_is_private(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('user_history'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_static_pages_revalidate_by_body_hash(self):
+        first = self.client.get(reverse('about'))
+        self.assertIn('max-age=3600', first['Cache-Control'])
+        second = self.client.get(reverse('about'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_compression_threshold_and_event_streams(self):
+        response = self.client.get(reverse('providers'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        with override_settings(GZIP_MIN_LENGTH=10 ** 6):
+            response = self.client.get(reverse('providers'), HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+        from django.http import StreamingHttpResponse
+        from .httpcache import ThresholdGZipMiddleware
+        stream = StreamingHttpResponse(iter([b'data: 1\n\n']), content_type='text/event-stream')
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(ThresholdGZipMiddleware(lambda r: stream)(request).has_header('Content-Encoding'))
+
+    def test_pending_messages_are_not_hidden_by_a_304(self):
+        first = self.client.get(reverse('providers'))
+        from django.contrib.messages import constants
+        from django.contrib.messages.storage.cookie import CookieStorage
+        from django.http import HttpResponse
+        storage = CookieStorage(RequestFactory().get('/'))
+        carrier = HttpResponse()
+        storage.add(constants.INFO, 'Saved')
+        storage.update(carrier)
+        self.client.cookies['messages'] = carrier.cookies['messages'].value
+        response = self._revalidate(first)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Saved')
+
+
+class BookingEventFeedTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name="Feed Solar", service_type="solar", location="Windsor"
+        )
+        self.day = timezone.now().date() + timedelta(days=2)
+
+    def _kinds(self, after=0):
+        from .events import read_events
+        return [(e.kind, e.date) for e in read_events(after)]
+
+    def test_changes_append_events_in_order(self):
+        slot = ProviderAvailability.objects.create(provider=self.provider, date=self.day, capacity=2)
+        booking = Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.day)
+        slot.capacity = 3
+        slot.save()  # updates are not part of the feed
+        booking_id = booking.pk
+        booking.delete()
+        slot.delete()
+        self.assertEqual(self._kinds(), [
+            ('availability_added', self.day), ('booked', self.day),
+            ('cancelled', self.day), ('availability_removed', self.day),
+        ])
+        from .models import BookingEvent
+        cancelled = BookingEvent.objects.get(kind='cancelled')
+        self.assertEqual((cancelled.booking_id, cancelled.customer_id), (booking_id, self.customer.pk))
+
+    def test_event_rolls_back_with_the_change(self):
+        from django.db import IntegrityError, transaction
+        from .models import BookingEvent
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.day)
+        self.assertFalse(BookingEvent.objects.exists())
+
+    def test_cursor_returns_only_the_delta(self):
+        from .events import read_events
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day)
+        cursor = read_events()[-1].sequence
+        self.assertEqual(read_events(cursor), [])
+        Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.day)
+        self.assertEqual(self._kinds(cursor), [('booked', self.day)])
+
+    def test_event_committed_late_with_a_lower_id_is_not_skipped(self):
+        from .events import read_events
+        from .models import BookingEvent
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day)
+        first = BookingEvent.objects.get().id
+        # A long transaction took first + 1, a quick one took first + 2 and committed first.
+        BookingEvent.objects.create(id=first + 2, kind='booked', provider_id=self.provider.pk, date=self.day)
+        cursor = read_events()[-1].sequence
+        BookingEvent.objects.create(id=first + 1, kind='cancelled', provider_id=self.provider.pk, date=self.day)
+        late = read_events(cursor)
+        self.assertEqual([(e.id, e.kind) for e in late], [(first + 1, 'cancelled')])
+        self.assertGreater(late[0].sequence, cursor)
+        self.assertEqual(read_events(late[0].sequence), [])
+
+    def test_closure_writes_events_in_one_batch(self):
+        from django.test.utils import CaptureQueriesContext
+        from .closures import close_dates
+        from .models import BookingEvent
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day, capacity=3, crews=3)
+        for _ in range(3):
+            Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.day)
+        with self.captureOnCommitCallbacks(execute=False), CaptureQueriesContext(connection) as queries:
+            close_dates(self.provider, self.day, self.day)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "services_bookingevent"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(BookingEvent.objects.filter(kind='cancelled').count(), 3)
+        self.assertEqual(BookingEvent.objects.filter(kind='availability_removed').count(), 1)
+
+    def test_http_feed_and_command(self):
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day)
+        Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=self.day)
+        response = self.client.get(reverse('booking_events'), {'after': 0, 'kind': 'booked'})
+        body = response.json()
+        self.assertEqual([e['kind'] for e in body['events']], ['booked'])
+        self.assertEqual(body['next'], body['events'][0]['sequence'])
+        self.assertEqual(self.client.get(reverse('booking_events'), {'after': 'x'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(reverse('booking_events'), REMOTE_ADDR='10.0.0.9').status_code, 404
+        )
+
+        from django.core.management import call_command
+        cursor_file = os.path.join(tempfile.mkdtemp(), 'cursor')
+        self.addCleanup(shutil.rmtree, os.path.dirname(cursor_file))
+        out = StringIO()
+        call_command('booking_events', cursor_file=cursor_file, stdout=out, stderr=StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        out = StringIO()
+        call_command('booking_events', cursor_file=cursor_file, stdout=out, stderr=StringIO())
+        self.assertEqual(out.getvalue(), '')
+
+    def test_expiry_deletes_old_events_in_batches(self):
+        from django.core.management import call_command
+        from .models import BookingEvent
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day)
+        BookingEvent.objects.bulk_create([
+            BookingEvent(kind='booked', provider_id=self.provider.pk, date=self.day,
+                         recorded_at=timezone.now() - timedelta(days=100))
+            for _ in range(5)
+        ])
+        out = StringIO()
+        call_command('expire_booking_events', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5 booking event(s)', out.getvalue())
+        self.assertEqual(list(BookingEvent.objects.values_list('kind', flat=True)), ['availability_added'])
+
+
+class AvailabilityCalendarTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.customer = User.objects.create_user(username='customer', password='testpass123')
+        self.provider = ServiceProvider.objects.create(
+            user=self.owner, name="Calendar Solar", service_type="solar", location="Windsor"
+        )
+        self.client.force_login(self.owner)
+        self.next_month = (timezone.now().date().replace(day=1) + timedelta(days=32)).replace(day=1)
+        self.url = reverse('manage_availability', args=[self.provider.id])
+
+    def _page(self, months):
+        return self.client.get(self.url, {'month': self.next_month.strftime('%Y-%m'), 'months': months})
+
+    def _cells(self, response):
+        return {
+            cell['date']: cell
+            for m in response.context['calendar'] for week in m['weeks'] for cell in week if cell['in_month']
+        }
+
+    def test_grid_merges_availability_and_bookings(self):
+        from .availability_calendar import add_months
+        day = self.next_month + timedelta(days=9)
+        ProviderAvailability.objects.create(provider=self.provider, date=day, capacity=2)
+        ProviderAvailability.objects.create(provider=self.provider, date=day + timedelta(days=1))
+        Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=day)
+        cells = self._cells(self._page(1))
+        self.assertEqual(len(cells), (add_months(self.next_month, 1) - self.next_month).days)
+        self.assertEqual((cells[day]['slot'].booked, cells[day]['bookings']), (1, ['customer']))
+        self.assertEqual(cells[day + timedelta(days=1)]['bookings'], [])
+        self.assertIsNone(cells[day + timedelta(days=2)]['slot'])
+
+    def test_query_count_does_not_grow_with_the_window(self):
+        from django.test.utils import CaptureQueriesContext
+        self._page(1)  # session and user lookups are warmed the same way for both
+        with CaptureQueriesContext(connection) as one_month:
+            self._page(1)
+        days = [self.next_month + timedelta(days=i) for i in range(85)]
+        ProviderAvailability.objects.bulk_create(
+            [ProviderAvailability(provider=self.provider, date=d, remaining=1) for d in days]
+        )
+        with CaptureQueriesContext(connection) as quarter:
+            response = self._page(3)
+        self.assertEqual(len(quarter), len(one_month))
+        self.assertEqual(sum(1 for c in self._cells(response).values() if c['slot']), 85)
+
+    def test_batched_toggle_opens_and_closes_days(self):
+        from .models import BookingEvent
+        days = [self.next_month + timedelta(days=i) for i in range(3)]
+        toggle = reverse('toggle_availability', args=[self.provider.id])
+        response = self.client.post(toggle, {
+            'action': 'open', 'days': [d.isoformat() for d in days], 'capacity': 2, 'crews': 1,
+            'month': self.next_month.strftime('%Y-%m'), 'months': 3,
+        })
+        self.assertRedirects(response, f"{self.url}?month={self.next_month.strftime('%Y-%m')}&months=3")
+        self.assertEqual(
+            list(ProviderAvailability.objects.values_list('date', 'capacity', 'remaining')),
+            [(d, 2, 2) for d in days],
+        )
+        self.provider.refresh_from_db()
+        self.assertEqual(self.provider.open_slot_count, 3)
+        self.assertEqual(BookingEvent.objects.filter(kind='availability_added').count(), 3)
+
+        Booking.objects.create(customer=self.customer, provider=self.provider, booking_date=days[1])
+        response = self.client.post(
+            toggle, {'action': 'close', 'days': [d.isoformat() for d in days]}, follow=True
+        )
+        self.assertContains(response, 'Closed 2 day(s).')
+        self.assertContains(response, f'Kept 1 booked day(s): {days[1].isoformat()}')
+        self.assertEqual(list(ProviderAvailability.objects.values_list('date', flat=True)), [days[1]])
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(BookingEvent.objects.filter(kind='availability_removed').count(), 2)
+
+    def test_toggle_rejects_past_days_and_other_providers(self):
+        toggle = reverse('toggle_availability', args=[self.provider.id])
+        yesterday = timezone.now().date() - timedelta(days=1)
+        response = self.client.post(toggle, {'action': 'open', 'days': [yesterday.isoformat()]}, follow=True)
+        self.assertContains(response, 'Past days cannot be changed.')
+        self.assertFalse(ProviderAvailability.objects.exists())
+
+        stranger = User.objects.create_user(username='stranger', password='testpass123')
+        self.client.force_login(stranger)
+        response = self.client.post(toggle, {'action': 'open', 'days': [self.next_month.isoformat()]})
+        self.assertEqual(response.status_code, 404)
+
+    def test_toggle_ignores_blank_days_and_reports_bad_ones(self):
+        toggle = reverse('toggle_availability', args=[self.provider.id])
+        response = self.client.post(toggle, {'action': 'open', 'days': ['', self.next_month.isoformat()]}, follow=True)
+        self.assertContains(response, 'Opened 1 day(s).')
+        response = self.client.post(toggle, {'action': 'open', 'days': ['']}, follow=True)
+        self.assertContains(response, 'Please pick days from the calendar.')
+        response = self.client.post(toggle, {'action': 'close', 'days': ['tomorrow']}, follow=True)
+        self.assertContains(response, 'Enter a valid date.')
+        self.assertEqual(ProviderAvailability.objects.count(), 1)
+
+
+@override_settings(
+    DB_SHARDS=['shard_eu', 'shard_us'], SHARD_REGIONS={'lyon': 'shard_eu', 'austin': 'shard_us'},
+)
+class RegionShardingTest(TransactionTestCase):
+    """Schedules on two SQLite file shards; the catalog stays in default."""
+    shards = ['shard_eu', 'shard_us']
+    databases = {'default', *shards}
+
+    @classmethod
+    def setUpClass(cls):
+        from django.core.management import call_command
+        from django.db import connections
+        cls.shard_dir = tempfile.mkdtemp()
+        for alias in cls.shards:
+            connections.settings[alias] = {
+                **connections.settings['default'], 'NAME': os.path.join(cls.shard_dir, f'{alias}.sqlite3'),
+            }
+            # As deployed: the shards are migrated with sharding already switched on.
+            with override_settings(DB_SHARDS=cls.shards):
+                call_command('migrate', database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        from django.db import connections
+        super().tearDownClass()
+        for alias in cls.shards:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        shutil.rmtree(cls.shard_dir)
+
+    def setUp(self):
+        from . import sharding
+        cache.clear()
+        sharding._provider_shards.clear()
+        self.day = timezone.now().date() + timedelta(days=3)
+        self.customer = User.objects.create_user(username='cust', password='testpass123', email='c@example.com')
+        owner = User.objects.create_user(username='owner', password='testpass123', email='o@example.com')
+        self.lyon = ServiceProvider.objects.create(
+            user=owner, name='Rhone Solar', service_type='solar', location='Lyon, France'
+        )
+        self.austin = ServiceProvider.objects.create(
+            user=owner, name='Lone Star Wind', service_type='wind', location='Austin, TX'
+        )
+
+    def _count(self, model, alias):
+        return model.objects.using(alias).count()
+
+    def test_data_migrations_run_on_a_new_shard(self):
+        from django.core.management import call_command
+        from django.db import connections
+        from django.db.migrations.executor import MigrationExecutor
+        alias = 'shard_new'
+        connections.settings[alias] = {
+            **connections.settings['default'], 'NAME': os.path.join(self.shard_dir, f'{alias}.sqlite3'),
+        }
+
+        def drop_connection():
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        self.addCleanup(drop_connection)
+        with self.settings(DB_SHARDS=[*self.shards, alias]):
+            call_command('migrate', 'services', '0007', database=alias, verbosity=0)
+            # A booking from before intervals, written with the models of that time.
+            old = MigrationExecutor(connections[alias]).loader.project_state(('services', '0007_booking_reminders')).apps
+            user = old.get_model('auth', 'User').objects.using(alias).create(username='early')
+            provider = old.get_model('services', 'ServiceProvider').objects.using(alias).create(
+                user_id=user.pk, name='Early Solar', service_type='solar', location='Lyon, France'
+            )
+            old.get_model('services', 'Booking').objects.using(alias).create(
+                provider_id=provider.pk, customer_id=user.pk, booking_date=self.day
+            )
+            call_command('migrate', database=alias, verbosity=0)
+        booking = Booking.objects.using(alias).get()
+        self.assertEqual((booking.booking_date, booking.end_date), (self.day, self.day))
+        self.assertIsNotNone(booking.starts_at)
+
+    def test_providers_are_pinned_to_their_region_shard(self):
+        self.assertEqual((self.lyon.shard, self.austin.shard), ('shard_eu', 'shard_us'))
+        self.lyon.location = 'Austin, TX'
+        self.lyon.save()
+        self.lyon.refresh_from_db()
+        self.assertEqual(self.lyon.shard, 'shard_eu')
+
+    def test_schedule_rows_are_written_to_the_provider_shard(self):
+        from .models import BookingEvent
+        ProviderAvailability.objects.create(provider=self.lyon, date=self.day, capacity=2)
+        Booking.objects.create(customer=self.customer, provider=self.lyon, booking_date=self.day)
+
+        for model in (ProviderAvailability, Booking):
+            self.assertEqual(
+                [self._count(model, alias) for alias in ('default', 'shard_eu', 'shard_us')], [0, 1, 0]
+            )
+        self.assertEqual(
+            list(BookingEvent.objects.using('shard_eu').values_list('kind', flat=True)),
+            ['availability_added', 'booked'],
+        )
+        self.assertEqual(ProviderAvailability.objects.using('shard_eu').get().remaining, 1)
+        # The summary used by the directory is kept in default.
+        self.lyon.refresh_from_db()
+        self.assertEqual((self.lyon.next_free_date, self.lyon.open_slot_count), (self.day, 1))
+        self.assertEqual(get_free_dates(self.lyon.id), [self.day])
+
+    def test_history_spans_shards_and_cancel_targets_the_right_one(self):
+        for provider, offset in ((self.lyon, 0), (self.austin, 1)):
+            ProviderAvailability.objects.create(provider=provider, date=self.day + timedelta(days=offset))
+            Booking.objects.create(
+                customer=self.customer, provider=provider, booking_date=self.day + timedelta(days=offset)
+            )
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('user_history'))
+        bookings = response.context['bookings']
+        self.assertEqual([b.provider.name for b in bookings], ['Lone Star Wind', 'Rhone Solar'])
+
+        lyon_booking = Booking.objects.using('shard_eu').get()
+        response = self.client.post(
+            reverse('cancel_booking', args=[lyon_booking.id]), {'provider': self.lyon.id}
+        )
+        self.assertRedirects(response, reverse('user_history'))
+        self.assertEqual(self._count(Booking, 'shard_eu'), 0)
+        self.assertEqual(self._count(Booking, 'shard_us'), 1)
+        self.assertEqual(ProviderAvailability.objects.using('shard_eu').get().remaining, 1)
+
+    def test_date_range_filter_reads_every_shard(self):
+        ProviderAvailability.objects.create(provider=self.lyon, date=self.day + timedelta(days=2))
+        ProviderAvailability.objects.create(provider=self.austin, date=self.day)
+        from django.db import connections
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get(reverse('providers'), {
+                'available_from': self.day.isoformat(),
+                'available_to': (self.day + timedelta(days=5)).isoformat(),
+            })
+            providers = list(response.context['providers'])
+        self.assertEqual([p.name for p in providers], ['Lone Star Wind', 'Rhone Solar'])
+        self.assertEqual(providers[0].first_free_date, self.day)
+        # The shard results are joined through a staged table, not inlined one provider at a time.
+        listed = [q['sql'] for q in queries if 'services_free_between' in q['sql'] and 'SELECT' in q['sql']]
+        self.assertTrue(listed)
+        self.assertFalse([sql for sql in listed if 'CASE' in sql])
+
+    def test_foreign_keys_are_constrained_outside_the_shards(self):
+        from django.db import connections
+
+        def constrained(alias):
+            with connections[alias].cursor() as cursor:
+                found = connections[alias].introspection.get_constraints(cursor, 'services_booking')
+            return {c['columns'][0] for c in found.values() if c['foreign_key']}
+
+        self.assertEqual(constrained('default'), {'customer_id', 'provider_id'})
+        self.assertEqual(constrained('shard_eu'), set())
+
+    def test_unhinted_schedule_queries_are_refused(self):
+        from .sharding import use_shard
+        with self.assertRaisesMessage(RuntimeError, 'No shard selected for a services.Booking query'):
+            Booking.objects.count()
+        with use_shard(self.lyon):
+            self.assertEqual(Booking.objects.count(), 0)
+
+    def test_rollup_marks_commit_with_the_shard_write(self):
+        from .analytics import update_dirty_days
+        from .models import DemandRollup, RollupDirtyDay
+        ProviderAvailability.objects.create(provider=self.lyon, date=self.day, capacity=2, crews=2)
+        with self.assertRaises(RuntimeError), transaction.atomic(using='shard_eu'):
+            Booking.objects.create(customer=self.customer, provider=self.lyon, booking_date=self.day)
+            raise RuntimeError
+        self.assertEqual(self._count(RollupDirtyDay, 'shard_eu'), 1)
+        self.assertEqual(self._count(RollupDirtyDay, 'default'), 0)
+        self.assertEqual(update_dirty_days(), (1, 1))
+        self.assertEqual(self._count(RollupDirtyDay, 'shard_eu'), 0)
+        self.assertEqual(
+            list(DemandRollup.objects.values_list('service_type', 'bookings', 'offered')), [('solar', 0, 2)]
+        )
+
+    def test_bookings_leaving_the_date_open_do_not_write_default(self):
+        from .snapshot import directory_state
+        ProviderAvailability.objects.create(provider=self.lyon, date=self.day, capacity=2, crews=2)
+        before = directory_state()
+        Booking.objects.create(customer=self.customer, provider=self.lyon, booking_date=self.day)
+        self.assertEqual(directory_state(), before)
+        Booking.objects.create(customer=self.customer, provider=self.lyon, booking_date=self.day)
+        self.assertNotEqual(directory_state(), before)
+
+    def test_rollup_backfill_finds_days_on_every_shard(self):
+        from django.core.management import call_command
+        from .models import DemandRollup
+        ProviderAvailability.objects.create(provider=self.lyon, date=self.day)
+        ProviderAvailability.objects.create(provider=self.austin, date=self.day + timedelta(days=5))
+        out = StringIO()
+        call_command('backfill_demand_rollups', stdout=out)
+        self.assertIn(f'for {self.day}..{self.day + timedelta(days=5)}', out.getvalue())
+        self.assertEqual(
+            sorted(DemandRollup.objects.values_list('service_type', 'offered')), [('solar', 1), ('wind', 1)]
+        )
+
+    def test_closures_and_deletes_reach_the_shard(self):
+        from django.core import mail
+        from .closures import close_dates
+        from .notifications import wait_for_queued
+        ProviderAvailability.objects.create(provider=self.lyon, date=self.day)
+        Booking.objects.create(customer=self.customer, provider=self.lyon, booking_date=self.day)
+        summary = close_dates(self.lyon, self.day, self.day)
+        wait_for_queued()
+        self.assertEqual(summary, {'bookings': 1, 'dates': 1, 'customers': 1})
+        self.assertEqual(mail.outbox[-1].to, ['c@example.com'])
+        self.assertEqual(self._count(ProviderAvailability, 'shard_eu'), 0)
+
+        ProviderAvailability.objects.create(provider=self.austin, date=self.day)
+        Booking.objects.create(customer=self.customer, provider=self.austin, booking_date=self.day)
+        self.austin.delete()
+        self.assertEqual(self._count(ProviderAvailability, 'shard_us'), 0)
+        self.assertEqual(self._count(Booking, 'shard_us'), 0)
+
+
+class WaitlistTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user(username='owner', password='testpass123', email='o@example.com')
+        self.provider = ServiceProvider.objects.create(
+            user=owner, name='Busy Solar', service_type='solar', location='Windsor'
+        )
+        self.day = timezone.now().date() + timedelta(days=2)
+        ProviderAvailability.objects.create(provider=self.provider, date=self.day)
+        self.holder, self.first, self.second = [
+            User.objects.create_user(username=name, password='testpass123', email=f'{name}@example.com')
+            for name in ('holder', 'first', 'second')
+        ]
+        self.booking = Booking.objects.create(customer=self.holder, provider=self.provider, booking_date=self.day)
+
+    def _join(self, user):
+        self.client.force_login(user)
+        return self.client.post(
+            reverse('join_waitlist'), {'provider': self.provider.id, 'date': self.day.isoformat()}, follow=True
+        )
+
+    def test_fully_booked_date_offers_the_waitlist(self):
+        self.client.force_login(self.first)
+        response = self.client.post(
+            reverse('book_service'), {'provider': self.provider.id, 'booking_date': self.day.isoformat()}
+        )
+        self.assertContains(response, reverse('join_waitlist'))
+        self.assertContains(response, 'Join waitlist')
+
+        self.assertContains(self._join(self.first), 'You are number 1 on the waitlist')
+        self.assertContains(self._join(self.second), 'You are number 2 on the waitlist')
+        # Joining twice keeps the original place.
+        self.assertContains(self._join(self.first), 'You are number 1 on the waitlist')
+        self.assertEqual(WaitlistEntry.objects.count(), 2)
+
+    def test_open_dates_are_booked_instead_of_queued(self):
+        ProviderAvailability.objects.update(capacity=2, remaining=1, crews=2)
+        self.assertContains(self._join(self.first), 'you can book it directly')
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_cancellation_promotes_the_first_waiter(self):
+        from django.core import mail
+        from .notifications import send_outbox
+        self._join(self.first)
+        self._join(self.second)
+        self.client.force_login(self.holder)
+        with self.captureOnCommitCallbacks():
+            self.client.post(
+                reverse('cancel_booking', args=[self.booking.id]), {'provider': self.provider.id}
+            )
+        send_outbox()
+
+        self.assertEqual(
+            list(Booking.objects.values_list('customer__username', 'booking_date')), [('first', self.day)]
+        )
+        self.assertEqual(ProviderAvailability.objects.get().remaining, 0)
+        self.assertEqual(list(WaitlistEntry.objects.values_list('customer__username', flat=True)), ['second'])
+        sent = {m.to[0]: m.body for m in mail.outbox if 'waitlist' in m.subject.lower()}
+        self.assertIn('now booked for you', sent['first@example.com'])
+        self.assertIn('now number 1 on the waitlist', sent['second@example.com'])
+
+        self.client.force_login(self.second)
+        response = self.client.get(reverse('user_history'))
+        self.assertEqual([(e.provider.name, e.position) for e in response.context['waitlist']], [('Busy Solar', 1)])
+
+    def test_waiters_already_booked_that_day_are_skipped(self):
+        from .waitlist import promote
+        self._join(self.first)
+        self._join(self.second)
+        ProviderAvailability.objects.update(capacity=2, remaining=1, crews=2)
+        Booking.objects.create(customer=self.first, provider=self.provider, booking_date=self.day)
+        self.booking.delete()
+        promoted = promote(self.provider, [self.day])
+        self.assertEqual([b.customer for b in promoted], [self.second])
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_leaving_the_waitlist(self):
+        self._join(self.first)
+        entry = WaitlistEntry.objects.get()
+        response = self.client.post(reverse('leave_waitlist', args=[entry.id]), {'provider': self.provider.id})
+        self.assertRedirects(response, reverse('user_history'))
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def _timed_day(self):
+        from datetime import time as clock
+        from .scheduling import window_bounds
+        # 09:00-13:00, one crew: four hourly places, each taken by someone.
+        self.booking.delete()
+        ProviderAvailability.objects.update(start_time=clock(9), end_time=clock(13), capacity=4, remaining=4)
+        slots = [window_bounds(self.day, clock(h), clock(h + 1)) for h in range(9, 13)]
+        bookings = [
+            Booking.objects.create(customer=self.holder, provider=self.provider, booking_date=self.day,
+                                   starts_at=starts_at, ends_at=ends_at)
+            for starts_at, ends_at in slots
+        ]
+        return slots, bookings
+
+    def test_timed_waiter_is_promoted_into_the_freed_slot(self):
+        slots, bookings = self._timed_day()
+        self.client.force_login(self.first)
+        response = self.client.post(reverse('book_service'), {
+            'provider': self.provider.id, 'booking_date': self.day.isoformat(),
+            'start_time': '10:00', 'end_time': '11:00',
+        })
+        self.assertContains(response, 'Join waitlist')
+        waitlist_form = response.context['waitlist_form']
+        self.client.post(reverse('join_waitlist'), {
+            name: waitlist_form[name].value() for name in ('provider', 'date', 'starts_at', 'ends_at')
+        })
+        self.assertEqual(WaitlistEntry.objects.values_list('starts_at', 'ends_at').get(), slots[1])
+
+        self.client.force_login(self.holder)
+        self.client.post(reverse('cancel_booking', args=[bookings[1].id]), {'provider': self.provider.id})
+        promoted = Booking.objects.get(customer=self.first)
+        self.assertEqual((promoted.starts_at, promoted.ends_at), slots[1])
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_waiter_who_does_not_fit_lets_the_next_one_in(self):
+        from .waitlist import join, promote
+        slots, bookings = self._timed_day()
+        join(self.first, self.provider, self.day)
+        join(self.second, self.provider, self.day, *slots[2])
+        bookings[2].delete()
+        promoted = promote(self.provider, [self.day])
+        # The whole day is still mostly taken; the 11:00 waiter behind it gets the freed hour.
+        self.assertEqual([(b.customer, b.starts_at) for b in promoted], [(self.second, slots[2][0])])
+        self.assertEqual(list(WaitlistEntry.objects.values_list('customer__username', flat=True)), ['first'])
+
+    def test_removing_a_date_drops_its_waitlist(self):
+        from .availability_calendar import clear_days
+        from .closures import close_dates
+        self._join(self.first)
+        later = self.day + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=self.provider, date=later, capacity=0, remaining=0)
+        WaitlistEntry.objects.create(provider=self.provider, date=later, customer=self.second)
+
+        clear_days(self.provider, [later])
+        self.assertEqual(list(WaitlistEntry.objects.values_list('date', flat=True)), [self.day])
+        close_dates(self.provider, self.day, self.day)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+
+class WaitlistPromotionConcurrencyTest(TransactionTestCase):
+    def test_cancellations_and_direct_bookings_race_for_freed_places(self):
+        from django.db import IntegrityError, OperationalError, transaction
+        from .waitlist import promote
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        provider = ServiceProvider.objects.create(
+            user=owner, name='Busy Solar', service_type='solar', location='Windsor'
+        )
+        day = timezone.now().date() + timedelta(days=1)
+        ProviderAvailability.objects.create(provider=provider, date=day, capacity=2, crews=2)
+        holders = [User.objects.create_user(username=f'h{i}', password='testpass123') for i in range(2)]
+        bookings = [Booking.objects.create(customer=h, provider=provider, booking_date=day) for h in holders]
+        waiters = [User.objects.create_user(username=f'w{i}', password='testpass123') for i in range(4)]
+        for waiter in waiters:
+            WaitlistEntry.objects.create(provider=provider, date=day, customer=waiter)
+        walk_ins = [User.objects.create_user(username=f'x{i}', password='testpass123') for i in range(6)]
+
+        outcomes = []
+        barrier = threading.Barrier(len(bookings) + len(walk_ins))
+
+        def retrying(action):
+            for _ in range(100):
+                try:
+                    return action()
+                except OperationalError:
+                    # SQLite's shared-cache test database reports lock contention instead of waiting.
+                    time.sleep(0.01)
+            outcomes.append('gave up')
+
+        def cancel(booking):
+            def action():
+                with transaction.atomic():
+                    Booking.objects.filter(pk=booking.pk).first().delete()
+                    outcomes.extend('promoted' for _ in promote(provider, [day]))
+            try:
+                barrier.wait()
+                retrying(action)
+            finally:
+                connection.close()
+
+        def walk_in(customer):
+            def action():
+                try:
+                    Booking.objects.create(customer=customer, provider=provider, booking_date=day)
+                    outcomes.append('walk-in')
+                except IntegrityError:
+                    outcomes.append('full')
+            try:
+                barrier.wait()
+                retrying(action)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=cancel, args=(b,)) for b in bookings]
+        threads += [threading.Thread(target=walk_in, args=(c,)) for c in walk_ins]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertNotIn('gave up', outcomes)
+        booked = list(Booking.objects.filter(provider=provider).values_list('customer__username', flat=True))
+        # Never overbooked, every freed place taken exactly once.
+        self.assertEqual(len(booked), 2)
+        self.assertEqual(ProviderAvailability.objects.get(provider=provider).remaining, 0)
+        self.assertEqual(outcomes.count('promoted') + outcomes.count('walk-in'), 2)
+        # Promotions follow the queue order, and promoted waiters leave the queue.
+        promoted = sorted(u for u in booked if u.startswith('w'))
+        self.assertEqual(promoted, [f'w{i}' for i in range(len(promoted))])
+        self.assertEqual(
+            list(WaitlistEntry.objects.values_list('customer__username', flat=True)),
+            [f'w{i}' for i in range(len(promoted), len(waiters))],
+        )
+
+
+class DirectorySnapshotTest(TestCase):
+    def setUp(self):
+        from . import snapshot
+        cache.clear()
+        snapshot._current = None
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, 'directory.snapshot')
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        today = timezone.now().date()
+        places = ['Windsor', 'London, Ontario', 'Toronto', 'Lyon, France']
+        for i in range(16):
+            ServiceProvider.objects.create(
+                user=owner, name=f'Provider {i}', service_type=['solar', 'wind', 'recycling'][i % 3],
+                location=places[i % 4], bio='word ' * 40, price_note=f'From ${i}0',
+                created_at=timezone.now() - timedelta(hours=i),
+            )
+        # A mix of open, past and missing next free dates.
+        for i, provider in enumerate(ServiceProvider.objects.order_by('pk')):
+            if i % 3:
+                ServiceProvider.objects.filter(pk=provider.pk).update(
+                    next_free_date=today + timedelta(days=(i * 7) % 5 - 1), open_slot_count=i
+                )
+
+    def _listed(self, params, use_snapshot):
+        with self.settings(DIRECTORY_SNAPSHOT_PATH=self.path if use_snapshot else ''):
+            response = self.client.get(reverse('providers'), params)
+        return [
+            # The snapshot keeps only the excerpt the page shows.
+            (p.id, p.name, p.location, p.next_free_date, p.open_slot_count, Truncator(p.bio).words(25))
+            for p in response.context['providers']
+        ]
+
+    def test_snapshot_lists_the_same_providers_as_the_database(self):
+        from .snapshot import build
+        build(self.path)
+        for params in [
+            {}, {'page': 2}, {'q': 'wind'}, {'location': 'on'}, {'location': 'LYON'},
+            {'q': 'solar', 'location': 'london'}, {'has_open_dates': 'on'},
+            {'sort': 'soonest'}, {'sort': 'soonest', 'has_open_dates': 'on', 'q': 'recycling'},
+            {'location': 'nowhere'},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self._listed(params, True), self._listed(params, False))
+
+    def test_stale_snapshot_falls_back_to_the_database(self):
+        from .snapshot import build
+        build(self.path)
+        with self.settings(DIRECTORY_SNAPSHOT_PATH=self.path):
+            # Only the directory version lookup touches the database.
+            with self.assertNumQueries(1):
+                self.client.get(reverse('providers'))
+            provider = ServiceProvider.objects.get(name='Provider 0')
+            provider.name = 'Renamed Solar'
+            provider.save()
+            response = self.client.get(reverse('providers'))
+        self.assertContains(response, 'Renamed Solar')
+
+    def test_rebuild_is_picked_up_while_old_mappings_stay_readable(self):
+        from .snapshot import build, get_snapshot
+        build(self.path)
+        with self.settings(DIRECTORY_SNAPSHOT_PATH=self.path):
+            old = get_snapshot()
+            self.assertIs(get_snapshot(), old)
+            ServiceProvider.objects.filter(name='Provider 0').delete()
+            build(self.path)
+            new = get_snapshot()
+        self.assertIsNot(new, old)
+        self.assertEqual((len(old.id), len(new.id)), (16, 15))
+        self.assertEqual(old.provider(0).name, 'Provider 0')
+        self.assertFalse(os.path.exists(f'{self.path}.{os.getpid()}.tmp'))
+
+    def test_build_command_skips_current_snapshot(self):
+        from django.core.management import call_command
+        with self.settings(DIRECTORY_SNAPSHOT_PATH=self.path):
+            out = StringIO()
+            call_command('build_directory_snapshot', stdout=out)
+            self.assertIn('Wrote 16 provider(s)', out.getvalue())
+            out = StringIO()
+            call_command('build_directory_snapshot', if_stale=True, stdout=out)
+            self.assertIn('Snapshot is current.', out.getvalue())
+
+    def test_bookings_make_the_snapshot_stale_until_the_watcher_rebuilds_it(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from .snapshot import directory_state, get_snapshot
+        provider = ServiceProvider.objects.get(name='Provider 0')
+        customer = User.objects.create_user(username='customer', password='testpass123')
+        day = timezone.now().date() + timedelta(days=3)
+
+        def book(seconds):
+            if Booking.objects.exists():
+                raise KeyboardInterrupt
+            ProviderAvailability.objects.create(provider=provider, date=day)
+            Booking.objects.create(customer=customer, provider=provider, booking_date=day)
+            self.assertFalse(get_snapshot().matches(directory_state()))
+
+        out = StringIO()
+        with self.settings(DIRECTORY_SNAPSHOT_PATH=self.path), mock.patch('time.sleep', side_effect=book):
+            call_command('build_directory_snapshot', watch=1, stdout=out)
+            self.assertTrue(get_snapshot().matches(directory_state()))
+        self.assertEqual(out.getvalue().count('Wrote 16 provider(s)'), 2)
+
+    def test_index_advisor_explains_the_database_query_while_a_snapshot_is_current(self):
+        from django.core.management import call_command
+        from .snapshot import build
+        build(self.path)
+        with self.settings(DIRECTORY_SNAPSHOT_PATH=self.path):
+            out = StringIO()
+            call_command('index_advisor', fail_on_issues=True, stdout=out)
+        self.assertIn('providers: newest', out.getvalue())
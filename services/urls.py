@@ -5,15 +5,23 @@ urlpatterns = [
     path("", views.HomeView.as_view(), name="home"),
     path("providers/", views.ProviderListView.as_view(), name="providers"),
     path("book/", views.book_service, name="book_service"),
+    path("provider/<int:provider_id>/availability/stream/", views.availability_stream, name="availability_stream"),
     path("history/", views.user_history, name="user_history"),
     path("register/", views.register, name="register"),
     path("create-provider/", views.create_provider, name="create_provider"),
     path("provider-dashboard/", views.provider_dashboard, name="provider_dashboard"),
     path("about/", views.about_page, name="about"),
     path("contact/", views.contact_page, name="contact"),
+    path("metrics/", views.metrics, name="metrics"),
+    path("events/", views.booking_events, name="booking_events"),
+    path("reports/demand/", views.demand_report, name="demand_report"),
     # Availability management
     path("provider/<int:provider_id>/availability/", views.manage_availability, name="manage_availability"),
+    path("provider/<int:provider_id>/availability/close/", views.close_availability, name="close_availability"),
+    path("provider/<int:provider_id>/availability/toggle/", views.toggle_availability, name="toggle_availability"),
     path("provider/<int:provider_id>/availability/<int:avail_id>/delete/", views.delete_availability, name="delete_availability"),
     # Booking actions
     path("booking/<int:booking_id>/cancel/", views.cancel_booking, name="cancel_booking"),
+    path("waitlist/join/", views.join_waitlist, name="join_waitlist"),
+    path("waitlist/<int:entry_id>/leave/", views.leave_waitlist, name="leave_waitlist"),
 ]
@@ -1,20 +1,48 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.generic import ListView, TemplateView
-from django.core.paginator import Paginator
+from django.views.decorators.http import require_POST
+from django.utils.decorators import method_decorator
 from django.contrib import messages
 from django.utils import timezone
 from django.core.mail import send_mail
 from django.conf import settings
-from django.db import transaction
-from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import DateField, F, OuterRef, Q, Subquery
+from django.db.models.expressions import RawSQL
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from urllib.parse import urlencode
+import asyncio
 import logging
+import uuid
 
-from .models import ServiceProvider, Booking, ProviderAvailability
+from asgiref.sync import sync_to_async
+
+from .analytics import weekly_report
+from .availability_calendar import add_months, clear_days, month_grid, open_days
+from .cache import get_free_dates, get_provider
+from .closures import close_dates
+from .events import read_events, serialize
+from .metrics import BOOKINGS, EMAIL_QUEUE_DEPTH, EMAILS, REGISTRY
+from .httpcache import cache_policy, directory_condition, directory_stats
+from .idempotency import idempotent
+from .live import get_broker, provider_channel, sse_event
+from . import search
+from .sharding import fan_out, is_enabled as sharding_enabled, schedule_databases, shard_for, stage_first_free_dates
+from .ratelimit import limit_concurrency, rate_limit
+from .scheduling import span_days
+from .snapshot import SnapshotRows, get_snapshot
+from . import waitlist
+from .models import ServiceProvider, Booking, ProviderAvailability, WaitlistEntry
 from .forms import (
     BookingForm, ProviderRegistrationForm, UserRegisterForm,
-    ProviderFilterForm, AvailabilityForm
+    ProviderFilterForm, AvailabilityForm, AvailabilityToggleForm, CalendarWindowForm, ClosureForm,
+    DemandReportForm, WaitlistForm,
 )
 
 # Set up logging
@@ -25,6 +53,8 @@ logger = logging.getLogger(__name__)
 class HomeView(TemplateView):
     template_name = "services/home.html"
 
+@method_decorator(cache_policy(max_age=settings.PROVIDER_LIST_MAX_AGE), name="dispatch")
+@method_decorator(directory_condition, name="get")
 class ProviderListView(ListView):
     template_name = "services/provider_list.html"
     context_object_name = "providers"
@@ -33,19 +63,117 @@ class ProviderListView(ListView):
 
     def get_queryset(self):
         qs = ServiceProvider.objects.all().select_related("user")
-        q = self.request.GET.get("q")
-        loc = self.request.GET.get("location")
+        self.filter_form = ProviderFilterForm(self.request.GET or None)
+        if self.filter_form.is_bound and not self.filter_form.is_valid():
+            return qs.none()
+        if not self.filter_form.is_bound:
+            return qs
+        q = self.filter_form.cleaned_data.get("q")
+        loc = self.filter_form.cleaned_data.get("location")
         if q:
             qs = qs.filter(service_type=q)
         if loc:
             qs = qs.filter(location__icontains=loc)
+        if self.filter_form.cleaned_data.get("has_open_dates"):
+            qs = qs.filter(next_free_date__gte=timezone.now().date())
+        if self.filter_form.cleaned_data.get("sort") == "soonest":
+            qs = qs.order_by(F("next_free_date").asc(nulls_last=True), "-created_at")
+        start = self.filter_form.cleaned_data.get("available_from")
+        if start:
+            qs = self._filter_free_between(qs, start, self.filter_form.cleaned_data["available_to"])
+        keywords = self.filter_form.cleaned_data.get("keywords")
+        if keywords:
+            qs = self._rank_by_keywords(qs, keywords)
         return qs
 
+    def paginate_queryset(self, queryset, page_size):
+        # get_queryset() stays a queryset (index_advisor explains it); only the page
+        # is swapped for the shared snapshot while that is current.
+        if not self.filter_form.is_bound or self.filter_form.is_valid():
+            rows = self._from_snapshot(self.filter_form.cleaned_data if self.filter_form.is_bound else {})
+            if rows is not None:
+                queryset = rows
+        return super().paginate_queryset(queryset, page_size)
+
+    def _from_snapshot(self, filters):
+        """The page's providers from the shared directory snapshot, or None to query the database.
+
+        Only used while the snapshot matches the live directory; keyword and
+        date-range searches always go to the database.
+        """
+        if filters.get("keywords") or filters.get("available_from"):
+            return None
+        snapshot = get_snapshot()
+        if snapshot is None or not snapshot.matches(directory_stats(self.request)):
+            return None
+        rows = snapshot.select(
+            service_type=filters.get("q"),
+            location=filters.get("location"),
+            open_from=timezone.now().date() if filters.get("has_open_dates") else None,
+            soonest=filters.get("sort") == "soonest",
+        )
+        return SnapshotRows(snapshot, rows)
+
+    @staticmethod
+    def _rank_by_keywords(qs, keywords):
+        """Providers from ``qs`` matching ``keywords``, best match first, with a highlighted snippet.
+
+        The full-text index ranks only the providers ``qs`` selects, so every
+        filter applies before the top hits are cut (see ``services.search``).
+        """
+        if not search.is_supported():
+            return qs.filter(
+                Q(name__icontains=keywords) | Q(bio__icontains=keywords) | Q(price_note__icontains=keywords)
+            )
+        hits = search.search_providers(keywords, within=qs)
+        snippets = dict(hits)
+        found = {p.pk: p for p in qs.filter(pk__in=snippets)}
+        ranked = []
+        for pk, _ in hits:
+            if pk in found:
+                found[pk].search_snippet = snippets[pk]
+                ranked.append(found[pk])
+        return ranked
+
+    @staticmethod
+    def _filter_free_between(qs, start, end):
+        """Keep providers with an unbooked date in [start, end], soonest first.
+
+        The candidates come from the open dates in the range, read from the partial
+        (date, provider) index on open availability, so providers without one are never
+        visited. Each candidate's earliest open date is then one lookup on the
+        (provider, date) key. Only the matching providers are sorted. With sharded
+        schedules the dates are looked up on every shard first and staged in a
+        temporary table that the provider query joins against.
+        """
+        if sharding_enabled():
+            qn = connections[DEFAULT_DB_ALIAS].ops.quote_name
+            table = qn(stage_first_free_dates(start, end))
+            outer_pk = f"{qn(ServiceProvider._meta.db_table)}.{qn('id')}"
+            return (
+                qs.filter(pk__in=RawSQL(f"SELECT provider_id FROM {table}", []))
+                .annotate(first_free_date=RawSQL(
+                    f"SELECT first_free FROM {table} WHERE provider_id = {outer_pk}", [], output_field=DateField()
+                ))
+                .order_by("first_free_date", "-created_at")
+            )
+        free = ProviderAvailability.objects.open().between(start, end)
+        soonest = free.filter(provider=OuterRef("pk")).order_by("date").values("date")[:1]
+        return (
+            qs.filter(pk__in=free.values("provider"))
+            .annotate(first_free_date=Subquery(soonest))
+            .order_by("first_free_date", "-created_at")
+        )
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["filter_form"] = ProviderFilterForm(self.request.GET or None)
+        ctx["filter_form"] = self.filter_form
+        params = self.request.GET.copy()
+        params.pop("page", None)
+        ctx["filter_params"] = params.urlencode()
         return ctx
 
+@rate_limit("register")
 def register(request):
     if request.method == "POST":
         form = UserRegisterForm(request.POST)
@@ -63,6 +191,7 @@ def register(request):
     return render(request, "services/register.html", {"form": form})
 
 @login_required
+@rate_limit("create_provider")
 def create_provider(request):
     if request.method == "POST":
         form = ProviderRegistrationForm(request.POST, request.FILES)
@@ -102,15 +231,91 @@ def manage_availability(request, provider_id):
     else:
         form = AvailabilityForm()
 
-    # Existing availability with simple pagination
-    av_qs = provider.availability.order_by("date")
-    page = Paginator(av_qs, 15).get_page(request.GET.get("page"))
-    return render(request, "services/manage_availability.html", {"provider": provider, "form": form, "page": page})
+    # A month or quarter of the schedule as a calendar: two range queries however many dates it holds.
+    window = CalendarWindowForm(request.GET)
+    window.is_valid()
+    first_month = (window.cleaned_data.get("month") or timezone.now().date()).replace(day=1)
+    months = window.cleaned_data.get("months") or 1
+    return render(
+        request,
+        "services/manage_availability.html",
+        {
+            "provider": provider,
+            "form": form,
+            "close_form": ClosureForm(),
+            "toggle_form": AvailabilityToggleForm(auto_id="toggle_%s"),
+            "calendar": month_grid(provider, first_month, months),
+            "month": first_month,
+            "months": months,
+            "previous_month": add_months(first_month, -months),
+            "next_month": add_months(first_month, months),
+            "idempotency_key": uuid.uuid4().hex,
+        },
+    )
+
+@login_required
+@require_POST
+def toggle_availability(request, provider_id):
+    provider = get_object_or_404(ServiceProvider, id=provider_id, user=request.user)
+    form = AvailabilityToggleForm(request.POST)
+    if not form.is_valid():
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+    elif form.cleaned_data["action"] == "open":
+        try:
+            opened = open_days(
+                provider,
+                form.cleaned_data["days"],
+                capacity=form.cleaned_data["capacity"],
+                crews=form.cleaned_data["crews"] or 1,
+            )
+            messages.success(request, f"Opened {len(opened)} day(s).")
+        except IntegrityError as e:
+            logger.warning(f"Opening days for provider {provider.id} raced another change: {e}")
+            messages.error(request, "Some of those days changed meanwhile. Please try again.")
+    else:
+        removed, kept = clear_days(provider, form.cleaned_data["days"])
+        messages.success(request, f"Closed {len(removed)} day(s).")
+        if kept:
+            messages.warning(
+                request,
+                f"Kept {len(kept)} booked day(s): {', '.join(d.isoformat() for d in kept)}. "
+                "Use \"Close dates\" to cancel their bookings.",
+            )
+    # Back to the months the provider was looking at; the GET view validates them again.
+    window = urlencode({"month": request.POST.get("month", ""), "months": request.POST.get("months", 1)})
+    back = f"{reverse('manage_availability', args=[provider.id])}?{window}"
+    return redirect(back)
+
+@login_required
+@require_POST
+@idempotent("close")
+def close_availability(request, provider_id):
+    provider = get_object_or_404(ServiceProvider, id=provider_id, user=request.user)
+    form = ClosureForm(request.POST)
+    if not form.is_valid():
+        for error in form.errors.get("__all__", []) or ["Please choose a valid date range."]:
+            messages.error(request, error)
+        return redirect("manage_availability", provider_id=provider.id)
+
+    start, end = form.cleaned_data["start_date"], form.cleaned_data["end_date"]
+    try:
+        summary = close_dates(provider, start, end, form.cleaned_data["reason"])
+        messages.success(
+            request,
+            f"Closed {start} to {end}: cancelled {summary['bookings']} booking(s), "
+            f"removed {summary['dates']} date(s) and notified {summary['customers']} customer(s).",
+        )
+    except Exception as e:
+        logger.error(f"Closing dates failed: {e}")
+        messages.error(request, "Failed to close those dates. Please try again.")
+    return redirect("manage_availability", provider_id=provider.id)
 
 @login_required
 def delete_availability(request, provider_id, avail_id):
     provider = get_object_or_404(ServiceProvider, id=provider_id, user=request.user)
-    avail = get_object_or_404(ProviderAvailability, id=avail_id, provider=provider)
+    avail = get_object_or_404(ProviderAvailability.objects.using(shard_for(provider)), id=avail_id, provider=provider)
     try:
         avail.delete()
         messages.success(request, f"Removed availability for {avail.date}.")
@@ -119,55 +324,66 @@ def delete_availability(request, provider_id, avail_id):
         messages.error(request, "Failed to remove availability.")
     return redirect("manage_availability", provider_id=provider.id)
 
+def _send_notification(kind, subject, message, recipient):
+    EMAIL_QUEUE_DEPTH.inc()
+    try:
+        send_mail(
+            subject=subject,
+            message=message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=[recipient],
+            fail_silently=True,
+        )
+        EMAILS.inc(kind=kind)
+    finally:
+        EMAIL_QUEUE_DEPTH.dec()
+
 def _send_booking_emails(booking, user):
     """Send booking confirmation emails to customer and provider"""
     try:
         # Email to customer
         if user.email:
-            send_mail(
-                subject="EcoConnect: Booking Confirmed",
-                message=f"Your booking with {booking.provider.name} on {booking.booking_date} is confirmed.",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=True,
+            _send_notification(
+                "booking_confirmed",
+                "EcoConnect: Booking Confirmed",
+                f"Your booking with {booking.provider.name} on {booking.booking_date} is confirmed.",
+                user.email,
             )
         
         # Email to provider
         if booking.provider.user.email:
-            send_mail(
-                subject="EcoConnect: New Booking",
-                message=f"You have a new booking on {booking.booking_date} from {user.username}.",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[booking.provider.user.email],
-                fail_silently=True,
+            _send_notification(
+                "booking_received",
+                "EcoConnect: New Booking",
+                f"You have a new booking on {booking.booking_date} from {user.username}.",
+                booking.provider.user.email,
             )
     except Exception as e:
         logger.error(f"Failed to send booking emails: {e}")
 
 @login_required
+@idempotent("book")
+@rate_limit("book")
+@limit_concurrency("book", "BOOKING_MAX_IN_FLIGHT")
 def book_service(request):
     # Pre-calc disabled dates for the selected provider (or none yet)
-    disabled_dates = []
     selected_provider_id = request.GET.get("provider")
     if selected_provider_id:
-        p = get_object_or_404(ServiceProvider, id=selected_provider_id)
-        # Disable all future days that are NOT in availability (client hint only; server validates)
-        future_days = [timezone.now().date()]
-        # For simplicity, just pass the list of available dates and flip logic in template
-        available_dates = list(
-            ProviderAvailability.objects.filter(provider=p, date__gte=timezone.now().date())
-            .order_by("date")
-            .values_list("date", flat=True)
-        )
+        # Client hint only (the form re-validates); served from cache so popular
+        # providers don't re-run these queries on every page view.
+        p = get_provider(selected_provider_id)
+        available_dates = get_free_dates(p.pk)
     else:
         p = None
         available_dates = []
 
+    waitlist_form = None
     if request.method == "POST":
         form = BookingForm(request.POST)
         if form.is_valid():
             try:
-                with transaction.atomic():
+                # On the schedule's database, so the emails only go out with a committed booking.
+                with transaction.atomic(using=shard_for(form.cleaned_data["provider"])):
                     booking = form.save(commit=False)
                     booking.customer = request.user
                     booking.save()
@@ -175,13 +391,29 @@ def book_service(request):
                     # Send confirmation emails
                     _send_booking_emails(booking, request.user)
                     
+                BOOKINGS.inc(outcome="success")
                 messages.success(request, "Booking confirmed.")
                 return redirect("user_history")
             except ValidationError as e:
+                BOOKINGS.inc(outcome="invalid")
                 messages.error(request, str(e))
+            except IntegrityError:
+                # Lost the race for the date to a concurrent booking.
+                BOOKINGS.inc(outcome="conflict")
+                messages.error(request, "This date was just booked by someone else.")
             except Exception as e:
+                BOOKINGS.inc(outcome="failure")
                 logger.error(f"Booking creation failed: {e}")
                 messages.error(request, "Booking failed. Please try again.")
+        elif form.has_error(NON_FIELD_ERRORS, "booked"):
+            BOOKINGS.inc(outcome="conflict")
+            # Queue for the date instead of retrying until someone cancels.
+            waitlist_form = WaitlistForm(initial={
+                "provider": form.cleaned_data["provider"].pk, "date": form.cleaned_data["booking_date"],
+                "starts_at": form.instance.starts_at, "ends_at": form.instance.ends_at,
+            })
+        else:
+            BOOKINGS.inc(outcome="invalid")
     else:
         form = BookingForm(initial={"provider": selected_provider_id} if selected_provider_id else None)
 
@@ -192,55 +424,210 @@ def book_service(request):
             "form": form,
             "selected_provider": p,
             "available_dates": [d.strftime("%Y-%m-%d") for d in available_dates],
+            "waitlist_form": waitlist_form,
+            # Resubmitting the same rendered form (double click, retry) replays the first result.
+            "idempotency_key": uuid.uuid4().hex,
         },
     )
 
+async def availability_stream(request, provider_id):
+    """Server-sent events with the provider's free dates, pushed whenever they change.
+
+    Under ASGI the stream waits on the event loop rather than holding a worker
+    thread. Streams end after ``LIVE_STREAM_MAX_SECONDS`` and EventSource
+    reconnects on its own. Under WSGI an open stream would pin a worker thread
+    (Django collects the whole async iterator first), so it sends the current
+    dates and closes, and EventSource polls every ``LIVE_POLL_SECONDS``.
+    """
+    provider = await sync_to_async(get_provider)(provider_id)
+    if not isinstance(request, ASGIRequest):
+        free_dates = [d.isoformat() for d in await sync_to_async(get_free_dates)(provider.pk)]
+        response = HttpResponse(
+            f"retry: {settings.LIVE_POLL_SECONDS * 1000}\n\n"
+            + sse_event({"provider": provider.pk, "free_dates": free_dates}, "availability"),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        return response
+    subscription = get_broker().subscribe(provider_channel(provider.pk))
+    # Subscribe before reading the snapshot so a change in between is not lost.
+    initial = [d.isoformat() for d in await sync_to_async(get_free_dates)(provider.pk)]
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LIVE_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 5000\n\n"
+            yield sse_event({"provider": provider.pk, "free_dates": initial}, "availability", 0)
+            while loop.time() < deadline:
+                update = await subscription.next(settings.LIVE_HEARTBEAT_SECONDS)
+                if update is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                version, free_dates = update
+                yield sse_event({"provider": provider.pk, "free_dates": free_dates}, "availability", version)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 @login_required
+@idempotent("cancel")
 def cancel_booking(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, customer=request.user)
+    booking = _find_booking(request.user, booking_id, request.POST.get("provider") or request.GET.get("provider"))
     booking_date = booking.booking_date
     provider_name = booking.provider.name
     
     try:
-        with transaction.atomic():
+        with transaction.atomic(using=booking._state.db):
             booking.delete()
+            # The freed place goes to the waitlist before anyone else can take it.
+            waitlist.promote(booking.provider, span_days(booking.starts_at, booking.ends_at))
             
             # Send cancellation email
             if request.user.email:
-                send_mail(
-                    subject="EcoConnect: Booking Cancelled",
-                    message=f"Your booking with {provider_name} on {booking_date} has been cancelled.",
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[request.user.email],
-                    fail_silently=True,
+                _send_notification(
+                    "booking_cancelled",
+                    "EcoConnect: Booking Cancelled",
+                    f"Your booking with {provider_name} on {booking_date} has been cancelled.",
+                    request.user.email,
                 )
-        messages.success(request, "Booking cancelled.")
     except Exception as e:
         logger.error(f"Booking cancellation failed: {e}")
-        messages.error(request, "Failed to cancel booking.")
-    
+        messages.error(request, "Failed to cancel booking. Please try again.")
+        # Not a redirect, so an idempotent retry runs the cancellation again instead of replaying this.
+        response = user_history(request)
+        response.status_code = 503
+        return response
+    messages.success(request, "Booking cancelled.")
+    return redirect("user_history")
+
+@login_required
+@require_POST
+@rate_limit("book")
+def join_waitlist(request):
+    form = WaitlistForm(request.POST)
+    if not form.is_valid():
+        for error in form.non_field_errors() or ["Please choose a provider and date."]:
+            messages.error(request, error)
+        return redirect("book_service")
+    provider, day = form.cleaned_data["provider"], form.cleaned_data["date"]
+    entry, place = waitlist.join(
+        request.user, provider, day, form.cleaned_data["starts_at"], form.cleaned_data["ends_at"]
+    )
+    messages.success(
+        request,
+        f"You are number {place} on the waitlist for {provider.name} on {day}. "
+        "We'll book it for you automatically if a place opens up.",
+    )
     return redirect("user_history")
 
 @login_required
+@require_POST
+def leave_waitlist(request, entry_id):
+    provider_id = request.POST.get("provider", "")
+    if not provider_id.isdigit():
+        raise Http404()
+    entry = get_object_or_404(
+        WaitlistEntry.objects.using(shard_for(provider_id)), id=entry_id, customer=request.user
+    )
+    entry.delete()
+    messages.success(request, f"Left the waitlist for {entry.date}.")
+    return redirect("user_history")
+
+def _find_booking(user, booking_id, provider_id=None):
+    """The user's booking ``booking_id``; booking ids are per shard, so ``provider_id`` says where to look."""
+    if provider_id and str(provider_id).isdigit():
+        return get_object_or_404(Booking.objects.using(shard_for(provider_id)), id=booking_id, customer=user)
+    # Old links without the provider: the first shard holding a booking of this user with that id.
+    found = [
+        b for b in fan_out(lambda alias: Booking.objects.using(alias).filter(id=booking_id, customer=user).first()) if b
+    ]
+    if not found:
+        raise Http404("No Booking matches the given query.")
+    return found[0]
+
+def _customer_bookings(user):
+    return Booking.objects.select_related("provider").filter(customer=user).order_by("-booking_date")
+
+def _booking_history(user):
+    """The user's bookings, newest first, from every schedule database."""
+    if not sharding_enabled():
+        return list(_customer_bookings(user))
+    per_shard = fan_out(lambda alias: list(Booking.objects.using(alias).filter(customer=user)))
+    bookings = sorted((b for rows in per_shard for b in rows), key=lambda b: b.booking_date, reverse=True)
+    # Providers live in default: one lookup instead of a join.
+    providers = ServiceProvider.objects.in_bulk({b.provider_id for b in bookings})
+    for booking in bookings:
+        booking.provider = providers[booking.provider_id]
+    return bookings
+
+@login_required
+@cache_policy(private=True)
 def user_history(request):
-    bookings = (
-        Booking.objects.select_related("provider")
-        .filter(customer=request.user)
-        .order_by("-booking_date")
+    bookings = _booking_history(request.user)
+    waiting = waitlist.entries_for(request.user)
+    providers = ServiceProvider.objects.in_bulk({e.provider_id for e in waiting})
+    for entry in waiting:
+        entry.provider = providers[entry.provider_id]
+    return render(
+        request,
+        "services/user_history.html",
+        {"bookings": bookings, "waitlist": waiting, "idempotency_key": uuid.uuid4().hex},
     )
-    return render(request, "services/user_history.html", {"bookings": bookings})
 
 @login_required
 def provider_dashboard(request):
     providers = ServiceProvider.objects.filter(user=request.user)
     return render(request, "services/provider_dashboard.html", {"providers": providers})
 
+@cache_policy(max_age=3600)
 def about_page(request):
     return render(request, "services/about.html")
 
+# Private: the form carries a CSRF token tied to this visitor's cookie.
+@cache_policy(private=True)
 def contact_page(request):
     return render(request, "services/contact.html")
 
+@staff_member_required
+def demand_report(request):
+    """Weekly demand and fill rate; reads the rollup table only, never live bookings."""
+    form = DemandReportForm(request.GET)
+    rows = []
+    if form.is_valid():
+        data = form.cleaned_data
+        rows = list(weekly_report(data["start"], data["end"], data["service_type"], data["location"]))
+    return render(request, "services/demand_report.html", {"form": form, "rows": rows})
+
+def metrics(request):
+    """Prometheus text endpoint; only answers clients listed in METRICS_ALLOWED_IPS."""
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        raise Http404()
+    return HttpResponse(REGISTRY.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def booking_events(request):
+    """Change feed as JSON: events after the ``after`` cursor; only answers BOOKING_EVENTS_ALLOWED_IPS."""
+    if request.META.get("REMOTE_ADDR") not in settings.BOOKING_EVENTS_ALLOWED_IPS:
+        raise Http404()
+    try:
+        after = int(request.GET.get("after", 0))
+        limit = int(request.GET.get("limit", 500))
+    except ValueError:
+        return JsonResponse({"error": "after and limit must be integers."}, status=400)
+    # Each schedule database keeps its own feed and cursor.
+    shard = request.GET.get("shard") or DEFAULT_DB_ALIAS
+    if shard not in schedule_databases():
+        return JsonResponse({"error": f"Unknown shard {shard!r}."}, status=400)
+    batch = read_events(after, limit, kinds=request.GET.getlist("kind"), using=shard)
+    return JsonResponse({
+        "events": [serialize(e) for e in batch],
+        "next": batch[-1].sequence if batch else after,
+    })
+
 def page_not_found(request, exception):
     return render(request, "services/404.html", status=404)
 
@@ -0,0 +1,156 @@
+"""Per-date waitlists for fully booked providers.
+
+A customer who can't get a date joins its waitlist once instead of retrying
+``book_service``. The entry keeps the interval they asked for (a timed slot
+or the whole day). When a cancellation frees capacity on the date,
+``promote`` books the first waiters whose interval now fits. It runs in the cancellation's
+transaction and inserts each booking through the same conditional capacity
+claim as every other booking (``Booking.save``), so a promotion and a
+concurrent direct booking can never both take the last place.
+
+Promoted customers are told they are booked. Everyone still waiting gets
+their new place in the queue. The emails are built in batches and written
+to the outbox in the same transaction, so they are sent once it commits.
+"""
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Booking, ProviderAvailability, WaitlistEntry
+from .notifications import enqueue
+from .scheduling import interval_for_days
+from .sharding import fan_out, shard_for
+
+logger = logging.getLogger(__name__)
+
+# Waiters looked at per freed day; past this many ineligible ones, the rest wait for the next cancellation.
+MAX_CANDIDATES = 20
+NOTIFY_BATCH = 500
+
+
+def join(customer, provider, day, starts_at=None, ends_at=None):
+    """Put ``customer`` in the queue for ``provider`` on ``day``; return ``(entry, position)``.
+
+    ``starts_at``/``ends_at`` is the interval wanted (default: the whole day). Joining
+    again keeps the place in the queue and only updates the interval.
+    """
+    entry, created = WaitlistEntry.objects.using(shard_for(provider)).get_or_create(
+        provider=provider, date=day, customer=customer, defaults={"starts_at": starts_at, "ends_at": ends_at}
+    )
+    if not created and (entry.starts_at, entry.ends_at) != (starts_at, ends_at):
+        entry.starts_at, entry.ends_at = starts_at, ends_at
+        entry.save(update_fields=["starts_at", "ends_at"])
+    return entry, position(entry)
+
+
+def position(entry):
+    """1-based place of ``entry`` in its queue."""
+    return WaitlistEntry.objects.using(entry._state.db).filter(
+        provider_id=entry.provider_id, date=entry.date, id__lte=entry.id
+    ).count()
+
+
+def entries_for(customer):
+    """The customer's waitlist entries on every schedule database, soonest first, with ``position`` set."""
+    ahead = (
+        WaitlistEntry.objects.filter(provider=OuterRef("provider"), date=OuterRef("date"), id__lte=OuterRef("id"))
+        .order_by()
+        .values("provider")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+
+    def waiting(alias):
+        return list(
+            WaitlistEntry.objects.using(alias)
+            .filter(customer=customer, date__gte=timezone.localdate())
+            .annotate(position=Subquery(ahead))
+        )
+
+    return sorted((e for rows in fan_out(waiting) for e in rows), key=lambda e: (e.date, e.id))
+
+
+def _already_booked(alias, provider, customer_id, starts_at, ends_at):
+    return Booking.objects.using(alias).filter(
+        provider=provider, customer_id=customer_id, starts_at__lt=ends_at, ends_at__gt=starts_at
+    ).exists()
+
+
+def promote(provider, days):
+    """Book waiters into capacity freed on ``days``, oldest entry first; return the new bookings.
+
+    Call it inside the transaction that freed the capacity, after the
+    cancellation, on the provider's schedule database.
+    """
+    alias = shard_for(provider)
+    today = timezone.localdate()
+    promoted = []
+    for day in sorted(d for d in set(days) if d >= today):
+        queue = WaitlistEntry.objects.using(alias).filter(provider=provider, date=day).order_by("id")
+        whole_day = None
+        booked = []
+        # Locked, so two cancellations of the same day can't promote the same waiter twice.
+        for entry in queue.select_for_update()[:MAX_CANDIDATES]:
+            if entry.starts_at is None or entry.ends_at is None:
+                whole_day = whole_day or interval_for_days(provider.pk, day)
+                starts_at, ends_at = whole_day
+            else:
+                starts_at, ends_at = entry.starts_at, entry.ends_at
+            if _already_booked(alias, provider, entry.customer_id, starts_at, ends_at):
+                entry.delete()
+                continue
+            try:
+                # A savepoint: a failed claim must not undo the cancellation around it.
+                with transaction.atomic(using=alias):
+                    booking = Booking(
+                        provider=provider, customer_id=entry.customer_id, booking_date=day,
+                        starts_at=starts_at, ends_at=ends_at,
+                    )
+                    booking.save(using=alias)
+            except IntegrityError:
+                if not ProviderAvailability.objects.using(alias).open().filter(provider=provider, date=day).exists():
+                    # The day is full again: nobody further down can fit.
+                    break
+                # Only this waiter's interval is taken; a later one may still fit.
+                continue
+            entry.delete()
+            booked.append(booking)
+        if booked:
+            waiting = list(queue.values_list("customer_id", flat=True))
+            _notify(alias, provider, day, [b.customer_id for b in booked], waiting)
+        promoted += booked
+    if promoted:
+        logger.info(f"Promoted {len(promoted)} waitlisted customer(s) for provider {provider.pk}")
+    return promoted
+
+
+def _notify(alias, provider, day, promoted_ids, waiting_ids):
+    # ``None`` marks a promoted customer; everyone else gets their new place in the queue.
+    recipients = [(c, None) for c in promoted_ids] + [(c, place) for place, c in enumerate(waiting_ids, start=1)]
+    for start in range(0, len(recipients), NOTIFY_BATCH):
+        enqueue("waitlist", _emails(provider, day, recipients[start:start + NOTIFY_BATCH]), using=alias)
+
+
+def _emails(provider, day, recipients):
+    # Customers live in default: one lookup per batch.
+    users = User.objects.in_bulk([c for c, _ in recipients])
+    messages = []
+    for customer_id, place in recipients:
+        user = users.get(customer_id)
+        if not user or not user.email:
+            continue
+        if place is None:
+            subject = "EcoConnect: You're booked from the waitlist"
+            body = f"A place opened up with {provider.name} on {day} and it is now booked for you."
+        else:
+            subject = "EcoConnect: Waitlist update"
+            body = f"You are now number {place} on the waitlist for {provider.name} on {day}."
+        messages.append(
+            EmailMessage(subject, f"Hi {user.username},\n\n{body}\n", settings.DEFAULT_FROM_EMAIL, [user.email])
+        )
+    return messages
@@ -0,0 +1,63 @@
+"""Process warmup: do the lazy first-request work before a worker takes traffic."""
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.db import DatabaseError, connections
+from django.template import TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+
+def template_names():
+    """Every template shipped in ``services/templates``, as loader-relative names."""
+    root = Path(apps.get_app_config("services").path) / "templates"
+    return sorted(str(path.relative_to(root)) for path in root.rglob("*.html"))
+
+
+def compile_templates():
+    """Load every app template so the cached loader holds the compiled versions."""
+    compiled, failed = 0, []
+    for name in template_names():
+        try:
+            get_template(name)
+            compiled += 1
+        except TemplateSyntaxError as e:
+            logger.error(f"Template {name} failed to compile during warmup: {e}")
+            failed.append(name)
+    return compiled, failed
+
+
+def open_connections():
+    for conn in connections.all():
+        conn.ensure_connection()
+
+
+def warm_up(templates=True, caches=True, db=True):
+    """Run the requested warmup steps and return timings (seconds) per step."""
+    timings = {}
+    if templates:
+        started = time.perf_counter()
+        compiled, failed = compile_templates()
+        timings["templates"] = time.perf_counter() - started
+        timings["templates_compiled"] = compiled
+        timings["templates_failed"] = len(failed)
+    if caches:
+        started = time.perf_counter()
+        # The URL resolver and content-type cache are both built lazily on first use.
+        reverse("home")
+        if apps.is_installed("django.contrib.contenttypes") and db:
+            from django.contrib.contenttypes.models import ContentType
+            try:
+                ContentType.objects.get_for_models(*apps.get_app_config("services").get_models())
+            except DatabaseError as e:
+                logger.error(f"Content type cache warmup failed: {e}")
+        timings["caches"] = time.perf_counter() - started
+    if db:
+        started = time.perf_counter()
+        open_connections()
+        timings["db"] = time.perf_counter() - started
+    return timings